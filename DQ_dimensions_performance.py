@@ -9,13 +9,21 @@
 
 # Propietary files
 import basic_operations
+import cleanup
 import context_broker_api
 import configuration_variables
+import entity_snapshot
+import ground_truth as ground_truth_provider
+import write_buffer
+import quality_state
+import snapshot_cache
+import simulation_storage
+import instrumentation
+import outlier_detector
 
 # Imports
-import math, time, random
+import math, random
 import numpy as np
-import pandas as pd
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
@@ -25,7 +33,7 @@ sys.path.append('../')
 
 # Accuracy
 def accuracy_request(input):
-  ground_truth = basic_operations.get_aemet_value(input['location']['value']['coordinates'])
+  ground_truth = ground_truth_provider.get_aemet_value(input['location']['value']['coordinates'])
   return ground_truth
 
 def accuracy_processing(input, ground_truth):
@@ -39,6 +47,10 @@ def accuracy_processing(input, ground_truth):
 
 # Completeness
 def completeness_request(input):  
+  if configuration_variables.local_quality_state:
+    quality_temporal = quality_state.store.get_quality_temporal(input)
+    if quality_temporal is not None: return quality_temporal, False
+
   quality_temporal, error = context_broker_api.get_temporal_values_by_id(input['hasQuality']['object'], "DataQualityAssessment", input['dateModified']['value'])
   if error: return None, True
 
@@ -47,17 +59,15 @@ def completeness_request(input):
 def completeness_processing(is_synthetic, quality_temporal):
   n = int(is_synthetic)
   total = 1
-	
-  if 'synthetic' not in quality_temporal:
-    print(quality_temporal)
+  synthetic = quality_temporal.get('synthetic', []) # no temporal values
 
-  if isinstance(quality_temporal['synthetic'], list): # more than one temporal value
-    total = total + len(quality_temporal['synthetic'])
-    for i in quality_temporal['synthetic']:
+  if isinstance(synthetic, list): # more than one temporal value
+    total = total + len(synthetic)
+    for i in synthetic:
       if i['value']['isSynthetic']['value'] == "True":
         n = n + 1
-  else: # just one temporal value
-    if quality_temporal['synthetic']['value']['isSynthetic']['value'] == "True":
+  else: # just one temporal value (only counted when it is synthetic)
+    if synthetic['value']['isSynthetic']['value'] == "True":
       total = total + 1
       n = n + 1
 
@@ -67,7 +77,13 @@ def completeness_processing(is_synthetic, quality_temporal):
 
 
 # Precision
-def precision_request():
+#     With precision_fetch = "cache", data_entities is the shared EntitySnapshot of snapshot_cache (and quality_entities None)
+def precision_request(input=None):
+  if configuration_variables.precision_fetch == "geo" and input is not None: return precision_geo_request(input)
+  if configuration_variables.precision_fetch == "cache":
+    snapshot, error = snapshot_cache.cache.get()
+    return snapshot, None, error
+
   data_entities, error = context_broker_api.get_entities_by_type("Temperature")
   if error: return None, None, True
 
@@ -76,12 +92,37 @@ def precision_request():
 
   return data_entities, quality_entities, False
 
+PRECISION_DATA_ATTRS = entity_snapshot.DATA_ATTRS
+PRECISION_QUALITY_ATTRS = entity_snapshot.QUALITY_ATTRS
+PRECISION_IDS_PER_REQUEST = 50 # bounds the URL length
+
+# precision_geo_request: Temperature entities within distance_range of the input (geo-query) and only their DataQualityAssessment entities, with just the attributes used by precision
+def precision_geo_request(input):
+  data_entities, error = context_broker_api.get_entities_by_type_geoQuery("Temperature", input['location']['value']['coordinates'], attrs=PRECISION_DATA_ATTRS)
+  if error: return None, None, True
+
+  quality_ids = [i['hasQuality']['object'] for i in data_entities if 'hasQuality' in i]
+  quality_entities = []
+  for k in range(0, len(quality_ids), PRECISION_IDS_PER_REQUEST):
+    entities, error = context_broker_api.get_entity_by_id(",".join(quality_ids[k:k+PRECISION_IDS_PER_REQUEST]), "DataQualityAssessment", attrs=PRECISION_QUALITY_ATTRS)
+    if error: return None, None, True
+    quality_entities.extend(entities)
+
+  return data_entities, quality_entities, False
+
 def precision_processing(input, data_entities, quality_entities):
-  if len(data_entities) == 0:
+  if isinstance(data_entities, entity_snapshot.EntitySnapshot): return precision_snapshot_processing(input, data_entities)
+
+  snapshot = entity_snapshot.EntitySnapshot(data_entities, quality_entities)
+  return precision_snapshot_processing(input, snapshot)
+
+# precision_snapshot_processing: precision of the input against an EntitySnapshot, which can be reused across inputs
+def precision_snapshot_processing(input, snapshot):
+  if len(snapshot) == 0:
     precision = 0 # +-0 degreeCelsius -- 100%
   else:
     input_value = np.array(input["value"]['value'])
-    surrounding_values = np.array(basic_operations.get_surrounding_values(input, configuration_variables.distance_range, data_entities, quality_entities))
+    surrounding_values = basic_operations.get_neighbour_values(input, configuration_variables.distance_range, snapshot.neighbour_index())
     
     precision = (
       basic_operations.euclidean_distance(input_value, surrounding_values)/math.sqrt(len(surrounding_values))
@@ -94,6 +135,10 @@ def precision_processing(input, data_entities, quality_entities):
 
 # Timeliness
 def timeliness_request(input):
+	if configuration_variables.local_quality_state:
+		data_entity, quality_entity = quality_state.store.get_last_entities(input)
+		if data_entity is not None: return data_entity, quality_entity, False
+
 	data_entity, error = context_broker_api.get_entity_by_id(input['id'], input['type'])
 	if error: return None, None, True
 	if len(data_entity) != 0: data_entity = data_entity[0]
@@ -121,31 +166,163 @@ def timeliness_processing(input, data_entity, quality_entity):
 	return timeliness
 
 
-# Main
-montecarlo_simulations = 60
-for i in range(montecarlo_simulations):
+# Input simulation and tagging
+ENTITY_NAMESPACE = "urn:x-iot:u7jcfa:" # ids of the simulated Temperature entities
+QUALITY_NAMESPACE = "urn:ngsi-ld:DataQualityAssessment:"
+
+# Constant attributes of the Temperature and DataQualityAssessment entities, shared (never modified) by every entity
+ADDRESS = {"type": "Property", "value": {"addressCountry": "Spain", "addressLocality": "Santander", "addressRegion": "Cantabria"}}
+AREA_SERVED = {"type": "Property", "value": "Santander"}
+UNIT = {"type": "Property", "value": "degreeCelsius"}
+DATA_PROVIDER = {"type": "Property", "value": "SmartSantander"}
+TEMPERATURE_SOURCE = {"type": "Property", "value": "https://api.smartsantander.eu/"}
+TEMPERATURE_CONTEXT = ["https://raw.githubusercontent.com/SALTED-Project/contexts/main/wrapped_contexts/energycim-context.jsonld"]
+QUALITY_SOURCE = {"type": "Property", "value": "https://salted-project.eu"}
+QUALITY_CONTEXT = ["https://raw.githubusercontent.com/SALTED-Project/contexts/main/wrapped_contexts/dataquality-context.jsonld"]
+
+# get_quality_id: id of the DataQualityAssessment entity of a Temperature entity
+#     The whole id after ENTITY_NAMESPACE (or after "urn:" for other ids) is kept, so prefixed ids (e.g. sim1:3 and
+#     sim2:3) do not share a quality entity.
+def get_quality_id(entity_id):
+	if entity_id.startswith(ENTITY_NAMESPACE): return QUALITY_NAMESPACE + entity_id[len(ENTITY_NAMESPACE):]
+	if entity_id.startswith("urn:"): return QUALITY_NAMESPACE + entity_id[len("urn:"):]
+	return QUALITY_NAMESPACE + entity_id
+
+# simulate_input: random Temperature entity (with its hasQuality relationship) used as benchmark input
+def simulate_input(id, date_object):
+	temperature_value = round(random.uniform(8,25),2)
+	longitude_value = round(random.uniform(-3.883333, -3.7625),4)
+	latitude_value = round(random.uniform(43.425, 43.481944),4)
+	date_value = date_object.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+	input = {
+		"id": ENTITY_NAMESPACE+str(id),
+		"type": "Temperature",
+		"address": ADDRESS,
+		"areaServed": AREA_SERVED,
+		"unit": UNIT,
+		"dataProvider": DATA_PROVIDER,
+		"dateModified": {
+			"type": "Property",
+			"value": date_value,
+			"observedAt": date_value
+		},
+		"source": TEMPERATURE_SOURCE,
+		"value":{
+			"type": "Property",
+			"value": temperature_value,
+			"observedAt": date_value,
+			"unitCode": "CEL"
+		},
+		"location": {
+			"type": "GeoProperty",
+			"value": {
+					"type": "Point",
+					"coordinates": [
+						latitude_value,
+						longitude_value          
+					]
+			}
+		},
+		"@context": TEMPERATURE_CONTEXT
+	}
+
+	quality_id = get_quality_id(input['id'])
+
+	# Add the relationship with the dataQualityAssessment entity
+	input['hasQuality'] = {"type": "Relationship", "object": quality_id}
+
+	return input
+
+# build_quality_input: DataQualityAssessment entity tagging an input with its quality dimensions
+def build_quality_input(input, is_outlier, is_synthetic, accuracy, timeliness, precision, completeness):
+	date_value = input['dateModified']['value']
+
+	return {
+		"id": input['hasQuality']['object'],
+		"type": "DataQualityAssessment",
+		"dateCalculated": {
+			"type": "Property",
+			"value": date_value
+		},
+		"source": QUALITY_SOURCE,
+		"outlier": {
+			"type": "Property",
+			"value": {
+			"isOutlier": {
+				"type": "Property",
+				"value": str(is_outlier)
+			},
+			# "methodology": {
+			# 		"type": "Relationship",
+			# 		"object": "urn:ngsi-ld:AI-Methodology:Outlier:Temperature:smartsantander:u7jcfa:t508"
+			# }
+			},
+			"observedAt": date_value
+		},
+		"synthetic": {
+			"type": "Property",
+			"value": {
+			"isSynthetic": {
+				"type": "Property",
+				"value": str(is_synthetic)
+			},
+			# "methodology": {
+			# 		"type": "Relationship",
+			# 		"object": "urn:ngsi-ld:AI-Methodology:Synthetic:Temperature:smartsantander:u7jcfa:t508"
+			# }
+			},
+			"observedAt": date_value
+		},
+		"accuracy": {
+			"type": "Property",
+			"value": accuracy,
+			"observedAt": date_value,
+			"unitCode": "CEL"
+		},
+		"timeliness": {
+			"type": "Property",
+			"value": timeliness,
+			"observedAt": date_value,
+			"unitCode": "minutes"
+		},
+		"precision": {
+			"type": "Property",
+			"value": precision,
+			"observedAt": date_value,
+			"unitCode": "CEL"
+		},
+		"completeness": {
+			"type": "Property",
+			"value": completeness,
+			"observedAt": date_value,
+			"unitCode": "P1"
+		},
+		"@context": QUALITY_CONTEXT
+	}
+
+
+# run_simulation: Monte Carlo simulation storing the request/processing times of every dimension in folder_name
+#     Params: 
+#        - i: simulation number
+#        - folder_name: output folder (created if needed)
+#        - nsim: number of observations
+#        - max_id: number of different entities (observations are generated for each entity in turn)
+#        - window: minutes
+#        - seconds_gen: seconds between two observations
+#        - id_prefix: prefix of the entity ids, so that simulations sharing a Context Broker do not collide
+#        - seed: seed of the random generator (None: not seeded)
+#        - storage: format of the results, "npy" (times.npy + metadata.json) or "csv" (main.m), see simulation_storage.py
+def run_simulation(i, folder_name, nsim=10000, max_id=100, window=120, seconds_gen=1.2, id_prefix="", seed=None, storage="npy"):
+	if seed is not None: random.seed(seed)
+
 	# Directory
-	folder_name = "simulations/sim"+str(i)
-	path = os.path.join(".", folder_name)
-	os.mkdir(path)
-
-	# PRODUCTION
-	nsim = 10000 # max_id = 100 x 100 temporal values
-	max_id = 100 # 100 different entities
-	window = 120 # minutes
-	seconds_gen = 1.2 # seconds
-
-	# Filenames
-	accuracy_file = folder_name+"/accuracy.csv"
-	completeness_file = folder_name+"/completeness.csv"
-	precision_file = folder_name+"/precision.csv"
-	timeliness_file = folder_name+"/timeliness.csv"
-
-	# Store arrays
-	accuracy_request_time = []; accuracy_processing_time = []
-	completeness_request_time = []; completeness_processing_time = []
-	precision_request_time = []; precison_processing_time = []
-	timeliness_request_time = []; timeliness_processing_time = []
+	os.makedirs(folder_name, exist_ok=True)
+
+	# Times of every phase (IN SECONDS), one series per simulation_storage.COLUMNS
+	recorder = instrumentation.Recorder(capacity=nsim)
+	timer = recorder.timer
+	instrumentation.recorder.clear() # Context Broker requests (broker_<method>) of this simulation, stored in metadata.json
 
 	date_object = datetime.now()
 
@@ -153,229 +330,111 @@ for i in range(montecarlo_simulations):
 	is_synthetic = random.choices(population = [True, False], weights=[0.1, 0.9], k=nsim)
 	is_outlier = random.choices(population = [True, False], weights=[0.1, 0.9], k=nsim)
 
-	for j in range(nsim):
-		
-		# Simulate input
-		temperature_value = round(random.uniform(8,25),2)
-		longitude_value = round(random.uniform(-3.883333, -3.7625),4)
-		latitude_value = round(random.uniform(43.425, 43.481944),4)
-		date_value = date_object.strftime('%Y-%m-%dT%H:%M:%SZ')
+	upsert_buffer = write_buffer.UpsertBuffer()
+	upsert_buffer.start()
+	if configuration_variables.precision_fetch == "cache": snapshot_cache.cache.start()
 
+	for j in range(nsim):
+	
 		if j%max_id == 0: id = 0 # Generation every seconds_gen (1.2 seconds) of different ids --> Generation every 2 min of temporal value
 
-		input = {
-			"id": "urn:x-iot:u7jcfa:"+str(id),
-			"type": "Temperature",
-			"address": {
-				"type": "Property",
-				"value": {
-					"addressCountry": "Spain",
-					"addressLocality": "Santander",
-					"addressRegion": "Cantabria"
-				}
-			},
-			"areaServed": {
-				"type": "Property",
-				"value": "Santander"
-			},
-			"unit": {
-				"type": "Property",
-				"value": "degreeCelsius"
-			},
-			"dataProvider": {
-				"type": "Property",
-				"value": "SmartSantander"
-			},
-			"dateModified": {
-				"type": "Property",
-				"value": date_value,
-				"observedAt": date_value
-			},
-			"source": {
-				"type": "Property",
-				"value": "https://api.smartsantander.eu/"
-			},
-			"value":{
-				"type": "Property",
-				"value": temperature_value,
-				"observedAt": date_value,
-				"unitCode": "CEL"
-			},
-			"location": {
-				"type": "GeoProperty",
-				"value": {
-						"type": "Point",
-						"coordinates": [
-							latitude_value,
-							longitude_value          
-						]
-				}
-			},
-			"@context":["https://raw.githubusercontent.com/SALTED-Project/contexts/main/wrapped_contexts/energycim-context.jsonld"]
-		}
-
-		quality_id = "urn:ngsi-ld:DataQualityAssessment:"+str(id)
-
-		# Add the relationship with the dataQualityAssessment entity
-		input['hasQuality'] = {"type": "Relationship", "object": quality_id}
+		# Simulate input
+		input = simulate_input(id_prefix+str(id), date_object)
 
-		
+	
 		# -------------- ACCURACY --------------
 		# Request
-		start_time = time.time()
-		ground_truth = accuracy_request(input)
-		final_time = time.time()
-		accuracy_request_time.append(final_time - start_time) # IN SECONDS
+		with timer("accuracy_request"):
+			ground_truth = accuracy_request(input)
 
 		# Processing
-		start_time = time.time()
-		accuracy = accuracy_processing(input, ground_truth)
-		final_time = time.time()
-		accuracy_processing_time.append(final_time - start_time) # IN SECONDS
+		with timer("accuracy_processing"):
+			accuracy = accuracy_processing(input, ground_truth)
 
 
 		# -------------- COMPLETENESS --------------
 		timeAt = date_object - relativedelta(minutes=window) # 120 minutes === 60 entities (generation every 2 minutes)
 		timeAt = timeAt.strftime('%Y-%m-%dT%H:%M:%SZ')
 		# Request
-		start_time = time.time()
-		quality_temporal, error = completeness_request(input)
-		final_time = time.time()
-		completeness_request_time.append(final_time - start_time) # IN SECONDS
+		with timer("completeness_request"):
+			quality_temporal, error = completeness_request(input)
 
 		# Processing
-		start_time = time.time()
-		if error: completeness = 1
-		else: 
-			if j >= max_id: completeness = completeness_processing(is_synthetic[i], quality_temporal) # First entity
-			else: completeness = 1 # First time
-		final_time = time.time()
-		completeness_processing_time.append(final_time - start_time) # IN SECONDS
+		with timer("completeness_processing"):
+			if error: completeness = 1
+			else: 
+				if j >= max_id: completeness = completeness_processing(is_synthetic[j], quality_temporal) # First entity
+				else: completeness = 1 # First time
 
 
 		# -------------- PRECISION --------------
 		# Request
-		start_time = time.time()
-		data_entities, quality_entities, error = precision_request()
-		final_time = time.time()
-		precision_request_time.append(final_time - start_time) # IN SECONDS
+		with timer("precision_request"):
+			data_entities, quality_entities, error = precision_request(input)
 
 		# Processing
-		start_time = time.time()
-		if error: precision = 0
-		else: 
-			if j >= max_id: precision = precision_processing(input, data_entities, quality_entities)
-			else: precision = 0 # First time
-		final_time = time.time()
-		precison_processing_time.append(final_time - start_time) # IN SECONDS
+		with timer("precision_processing"):
+			if error: precision = 0
+			else: 
+				if j >= max_id: precision = precision_processing(input, data_entities, quality_entities)
+				else: precision = 0 # First time
 
 
 		# -------------- TIMELINESS --------------
 		# Request
-		start_time = time.time()
-		data_entities, quality_entities, error = timeliness_request(input)
-		final_time = time.time()
-		timeliness_request_time.append(final_time - start_time) # IN SECONDS
+		with timer("timeliness_request"):
+			data_entities, quality_entities, error = timeliness_request(input)
 
 		# Processing
-		start_time = time.time()
-		if error: timeliness = 10
-		else: 
-			if j >= max_id: timeliness = timeliness_processing(input, data_entities, quality_entities)
-			else: timeliness = 10
-		final_time = time.time()
-		timeliness_processing_time.append(final_time - start_time) # IN SECONDS
+		with timer("timeliness_processing"):
+			if error: timeliness = 10
+			else: 
+				if j >= max_id: timeliness = timeliness_processing(input, data_entities, quality_entities)
+				else: timeliness = 10
 
 
 		# -------------- TAGGING --------------
-		quality_input = {
-			"id": "urn:ngsi-ld:DataQualityAssessment:"+str(id),
-			"type": "DataQualityAssessment",
-			"dateCalculated": {
-				"type": "Property",
-				"value": date_value
-			},
-			"source": {
-				"type": "Property",
-				"value": "https://salted-project.eu"
-			},
-			"outlier": {
-				"type": "Property",
-				"value": {
-				"isOutlier": {
-					"type": "Property",
-					"value": str(is_outlier[i])
-				},
-				# "methodology": {
-				# 		"type": "Relationship",
-				# 		"object": "urn:ngsi-ld:AI-Methodology:Outlier:Temperature:smartsantander:u7jcfa:t508"
-				# }
-				},
-				"observedAt": date_value
-			},
-			"synthetic": {
-				"type": "Property",
-				"value": {
-				"isSynthetic": {
-					"type": "Property",
-					"value": str(is_synthetic[i])
-				},
-				# "methodology": {
-				# 		"type": "Relationship",
-				# 		"object": "urn:ngsi-ld:AI-Methodology:Synthetic:Temperature:smartsantander:u7jcfa:t508"
-				# }
-				},
-				"observedAt": date_value
-			},
-			"accuracy": {
-				"type": "Property",
-				"value": accuracy,
-				"observedAt": date_value,
-				"unitCode": "CEL"
-			},
-			"timeliness": {
-				"type": "Property",
-				"value": timeliness,
-				"observedAt": date_value,
-				"unitCode": "minutes"
-			},
-			"precision": {
-				"type": "Property",
-				"value": precision,
-				"observedAt": date_value,
-				"unitCode": "CEL"
-			},
-			"completeness": {
-				"type": "Property",
-				"value": completeness,
-				"observedAt": date_value,
-				"unitCode": "P1"
-			},
-			"@context": ["https://raw.githubusercontent.com/SALTED-Project/contexts/main/wrapped_contexts/dataquality-context.jsonld"]
-		}
+		outlier = outlier_detector.detect(input) if configuration_variables.outlier_detection else is_outlier[j]
+		quality_input = build_quality_input(input, outlier, is_synthetic[j], accuracy, timeliness, precision, completeness)
+
+		quality_state.store.update(input, quality_input)
+		if configuration_variables.precision_fetch == "cache": snapshot_cache.cache.update(input, quality_input)
 
 		# -------------- UPSERT TO CONTEXT BROKER --------------
-		status = context_broker_api.upsert_entity(input)
-		if status == 204 or status == 201: status = context_broker_api.upsert_entity(quality_input)
+		upsert_buffer.add(input)
+		upsert_buffer.add(quality_input)
 
 		date_object = date_object + relativedelta(seconds = seconds_gen)
 		id += 1
 
+	upsert_buffer.close()
+	snapshot_cache.cache.close()
+	if len(upsert_buffer.failures) != 0: print("UPSERT failures ", len(upsert_buffer.failures))
+
 	# Store time values
-	df = pd.DataFrame()
-	df["request_time"] = accuracy_request_time; df["processing_time"] = accuracy_processing_time
-	df.to_csv(accuracy_file)  
+	parameters = {"simulation": i, "nsim": nsim, "max_id": max_id, "window": window, "seconds_gen": seconds_gen, "id_prefix": id_prefix, "seed": seed, "precision_fetch": configuration_variables.precision_fetch}
+	parameters["broker_requests"] = {name: summary for (name, summary) in instrumentation.recorder.summary().items() if name.startswith("broker_")}
+	simulation_storage.save_times(folder_name, recorder.export(simulation_storage.COLUMNS), parameters, storage)
 
-	df = pd.DataFrame()
-	df["request_time"] = completeness_request_time; df["processing_time"] = completeness_processing_time
-	df.to_csv(completeness_file)  
+	cleanup_report = cleanup.delete_entities(id_prefix)
+	if cleanup.failures(cleanup_report) != 0: cleanup.print_report(cleanup_report)
+	quality_state.store.clear()
+	snapshot_cache.cache.clear()
+	outlier_detector.detector.clear()
 
-	df = pd.DataFrame()
-	df["request_time"] = precision_request_time; df["processing_time"] = precison_processing_time
-	df.to_csv(precision_file)  
 
-	df = pd.DataFrame()
-	df["request_time"] = timeliness_request_time; df["processing_time"] = timeliness_processing_time
-	df.to_csv(timeliness_file)  
+# is_completed: True if the folder of a simulation already contains all its results
+def is_completed(folder_name):
+	return simulation_storage.is_completed(folder_name)
+
+
+# Main
+def main():
+	montecarlo_simulations = 60
+	for i in range(montecarlo_simulations):
+		# PRODUCTION: 10000 observations (100 x 100 temporal values) of 100 different entities, generated every 1.2 seconds
+		run_simulation(i, "simulations/sim"+str(i), nsim=10000, max_id=100, window=120, seconds_gen=1.2)
+
 
-	context_broker_api.delete_entities()
+if __name__ == "__main__":
+	main()
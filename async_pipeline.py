@@ -0,0 +1,200 @@
+# Software Name: async_pipeline.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Asynchronous variant of the DQ_dimensions_performance benchmark: the accuracy, completeness, precision and
+# timeliness requests of an observation are issued concurrently, and up to `in_flight` observations are assessed at
+# the same time. Besides the per-dimension request/processing times, the end-to-end latency of every observation is
+# stored in latency.csv.
+
+# Propietary files
+import DQ_dimensions_performance as dq
+import cleanup
+import context_broker_api_async
+import ground_truth as ground_truth_provider
+import outlier_detector
+import configuration_variables
+
+# Imports
+import asyncio, argparse, time, random, os
+import pandas as pd
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+
+DIMENSIONS = ["accuracy", "completeness", "precision", "timeliness"]
+
+
+# Requests (same results as the *_request functions of DQ_dimensions_performance)
+async def accuracy_request(input):
+  # AEMET is read through the cached provider; misses are downloaded in a worker thread
+  return await asyncio.to_thread(ground_truth_provider.get_aemet_value, input['location']['value']['coordinates'])
+
+async def completeness_request(client, input):
+  return await context_broker_api_async.get_temporal_values_by_id(client, input['hasQuality']['object'], "DataQualityAssessment", input['dateModified']['value'])
+
+async def precision_request(client, input):
+  if configuration_variables.precision_fetch == "geo": return await precision_geo_request(client, input)
+
+  (data_entities, data_error), (quality_entities, quality_error) = await asyncio.gather(
+    context_broker_api_async.get_entities_by_type(client, "Temperature"),
+    context_broker_api_async.get_entities_by_type(client, "DataQualityAssessment")
+  )
+  if data_error or quality_error: return None, None, True
+
+  return data_entities, quality_entities, False
+
+async def precision_geo_request(client, input):
+  data_entities, error = await context_broker_api_async.get_entities_by_type_geoQuery(client, "Temperature", input['location']['value']['coordinates'], attrs=dq.PRECISION_DATA_ATTRS)
+  if error: return None, None, True
+
+  quality_ids = [i['hasQuality']['object'] for i in data_entities if 'hasQuality' in i]
+  responses = await asyncio.gather(*[
+    context_broker_api_async.get_entity_by_id(client, ",".join(quality_ids[k:k+dq.PRECISION_IDS_PER_REQUEST]), "DataQualityAssessment", attrs=dq.PRECISION_QUALITY_ATTRS)
+    for k in range(0, len(quality_ids), dq.PRECISION_IDS_PER_REQUEST)
+  ])
+  if any(error for (_, error) in responses): return None, None, True
+
+  return data_entities, [j for (entities, _) in responses for j in entities], False
+
+async def timeliness_request(client, input):
+  (data_entity, data_error), (quality_entity, quality_error) = await asyncio.gather(
+    context_broker_api_async.get_entity_by_id(client, input['id'], input['type']),
+    context_broker_api_async.get_entity_by_id(client, input['hasQuality']['object'], "DataQualityAssessment")
+  )
+  if data_error or quality_error: return None, None, True
+  if len(data_entity) != 0: data_entity = data_entity[0]
+  if len(quality_entity) != 0: quality_entity = quality_entity[0]
+
+  return data_entity, quality_entity, False
+
+
+async def timed(coroutine):
+  start_time = time.perf_counter()
+  result = await coroutine
+  return result, time.perf_counter() - start_time
+
+
+# assess_observation: compute the four DQ dimensions of an input and tag it in the Context Broker
+#     Params:
+#        - client: AsyncBrokerClient
+#        - input: Temperature entity
+#        - is_outlier, is_synthetic: flags stored in the DataQualityAssessment entity
+#        - first_time: True while the entity has no previous values (dimensions take their default value)
+#     Return:
+#        - dictionary with the request/processing time of each dimension and the total time (in seconds)
+async def assess_observation(client, input, is_outlier, is_synthetic, first_time):
+  start_time = time.perf_counter()
+  times = {}
+
+  (ground_truth, times["accuracy_request"]), (completeness_response, times["completeness_request"]), (precision_response, times["precision_request"]), (timeliness_response, times["timeliness_request"]) = await asyncio.gather(
+    timed(accuracy_request(input)),
+    timed(completeness_request(client, input)),
+    timed(precision_request(client, input)),
+    timed(timeliness_request(client, input))
+  )
+
+  # Processing
+  processing_start = time.perf_counter()
+  accuracy = dq.accuracy_processing(input, ground_truth)
+  times["accuracy_processing"] = time.perf_counter() - processing_start
+
+  processing_start = time.perf_counter()
+  quality_temporal, error = completeness_response
+  completeness = 1 if error or first_time else dq.completeness_processing(is_synthetic, quality_temporal)
+  times["completeness_processing"] = time.perf_counter() - processing_start
+
+  processing_start = time.perf_counter()
+  data_entities, quality_entities, error = precision_response
+  precision = 0 if error or first_time else dq.precision_processing(input, data_entities, quality_entities)
+  times["precision_processing"] = time.perf_counter() - processing_start
+
+  processing_start = time.perf_counter()
+  data_entity, quality_entity, error = timeliness_response
+  missing = error or len(data_entity) == 0 or len(quality_entity) == 0 # e.g. the previous observation failed
+  timeliness = 10 if missing or first_time else dq.timeliness_processing(input, data_entity, quality_entity)
+  times["timeliness_processing"] = time.perf_counter() - processing_start
+
+  # Tagging
+  quality_input = dq.build_quality_input(input, is_outlier, is_synthetic, accuracy, timeliness, precision, completeness)
+  status = await context_broker_api_async.upsert_entity(client, input)
+  if status == 204 or status == 201: status = await context_broker_api_async.upsert_entity(client, quality_input)
+
+  times["total"] = time.perf_counter() - start_time
+  return times
+
+
+# run_simulation: assess nsim simulated observations with at most in_flight of them being processed concurrently
+#     An observation only starts once the previous observation of the same entity has been tagged, so completeness
+#     and timeliness always see it.
+#     An observation raising an exception is counted and left out, so it does not discard the times of the others.
+#     Return:
+#        - array with the times dictionary of every assessed observation (in input order)
+#        - number of observations that failed
+async def run_simulation(nsim, max_id, seconds_gen, in_flight):
+  semaphore = asyncio.Semaphore(in_flight)
+  date_object = datetime.now()
+  is_synthetic = random.choices(population = [True, False], weights=[0.1, 0.9], k=nsim)
+  is_outlier = random.choices(population = [True, False], weights=[0.1, 0.9], k=nsim)
+
+  async with context_broker_api_async.AsyncBrokerClient(pool_size=max(in_flight*6, 1)) as client:
+    async def bounded(input, j, outlier, previous):
+      if previous is not None: await asyncio.wait([previous])
+      async with semaphore:
+        return await assess_observation(client, input, outlier, is_synthetic[j], j < max_id)
+
+    tasks = []; last_task = {}
+    for j in range(nsim):
+      input = dq.simulate_input(j % max_id, date_object)
+      outlier = outlier_detector.detect(input) if configuration_variables.outlier_detection else is_outlier[j] # input order
+      task = asyncio.create_task(bounded(input, j, outlier, last_task.get(input['id'])))
+      tasks.append(task); last_task[input['id']] = task
+      date_object = date_object + relativedelta(seconds = seconds_gen)
+      await asyncio.sleep(0) # let the tasks start in input order
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+  times = [result for result in results if not isinstance(result, BaseException)]
+  return times, len(results) - len(times)
+
+
+def store_times(folder_name, times):
+  df = pd.DataFrame(times)
+  for dimension in DIMENSIONS:
+    pd.DataFrame({
+      "request_time": df[dimension+"_request"],
+      "processing_time": df[dimension+"_processing"]
+    }).to_csv(folder_name+"/"+dimension+".csv")
+
+  pd.DataFrame({"total_time": df["total"]}).to_csv(folder_name+"/latency.csv")
+
+
+def main():
+  arguments = argparse.ArgumentParser(description="Asynchronous DQ dimensions performance benchmark")
+  arguments.add_argument("--simulations", type=int, default=1)
+  arguments.add_argument("--observations", type=int, default=10000)
+  arguments.add_argument("--entities", type=int, default=100)
+  arguments.add_argument("--seconds-gen", type=float, default=1.2)
+  arguments.add_argument("--in-flight", type=int, default=10)
+  arguments.add_argument("--output", default="simulations/async")
+  args = arguments.parse_args()
+
+  for i in range(args.simulations):
+    folder_name = os.path.join(args.output, "sim"+str(i))
+    os.makedirs(folder_name)
+
+    times, failures = asyncio.run(run_simulation(args.observations, args.entities, args.seconds_gen, args.in_flight))
+    if failures != 0: print("Failed observations ", failures)
+    store_times(folder_name, times)
+    outlier_detector.detector.clear()
+
+    cleanup_report = cleanup.delete_entities()
+    if cleanup.failures(cleanup_report) != 0: cleanup.print_report(cleanup_report)
+
+
+if __name__ == "__main__":
+  main()
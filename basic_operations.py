@@ -7,34 +7,63 @@
 #
 # Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
 
-import requests, csv
+# requests, geopy and dateutil.parser are imported by the functions that use them: workers importing the date and
+# mean helpers do not load them (geopy alone loads aiohttp, see benchmarks.py import_time)
+import csv
 import numpy as np
-import pandas as pd
-from geopy import distance
-from dateutil import parser
+from datetime import datetime, timezone
+from functools import lru_cache
+import entity_snapshot
 
 LONGITUDE = [-3.883333, -3.7625]; LATITUDE = [43.425, 43.481944]
 
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ' # format of the dates written in the Context Broker
+
+# parse_date: parse a date string, with a fast path for DATE_FORMAT (dateutil is only used for other formats)
+#     Results are cached, since the same dateModified strings are parsed several times per observation.
+#     Params: 
+#        - date: date string
+#     Return: 
+#        - datetime (timezone-aware UTC for DATE_FORMAT)
+@lru_cache(maxsize=65536)
+def parse_date(date):
+  if len(date) == 20 and date[10] == 'T' and date[19] == 'Z':
+    try:
+      return datetime.fromisoformat(date[:19]).replace(tzinfo=timezone.utc)
+    except ValueError:
+      pass
+
+  from dateutil import parser
+  return parser.parse(date)
+
 def get_timestamp(date):
-  try:
-    return parser.parse(date).timestamp()
-  except:     
-    return date.timestamp()
+  if isinstance(date, str): return parse_date(date).timestamp()
+  return date.timestamp()
+
+# get_timestamps: vectorised get_timestamp for an array of date strings
+#     Params: 
+#        - dates: array of date strings
+#     Return: 
+#        - numpy array of timestamps in seconds
+def get_timestamps(dates):
+  dates = np.asarray(dates, dtype=str)
+  if dates.size != 0 and np.all(np.char.str_len(dates) == 20) and np.all(np.char.endswith(dates, 'Z')):
+    try:
+      return np.char.rstrip(dates, 'Z').astype('datetime64[s]').astype(np.int64).astype(np.float64)
+    except ValueError:
+      pass
+  return np.array([get_timestamp(str(date)) for date in dates.ravel()], dtype=np.float64).reshape(dates.shape)
 
 def get_date(date):
-  return parser.parse(date)
+  return parse_date(date)
 
 def get_minutes(date):
-  try:
-    return parser.parse(date).minute
-  except:     
-    return date.minute
+  if isinstance(date, str): return parse_date(date).minute
+  return date.minute
 
 def get_hour(date):
-  try:
-    return parser.parse(date).hour
-  except:     
-    return date.hour
+  if isinstance(date, str): return parse_date(date).hour
+  return date.hour
 
 def weighted_mean(a, b, alpha):
   return (alpha*a+(1-alpha)*b)
@@ -49,6 +78,9 @@ def check_coordinates(longitude, latitude):
   return (LONGITUDE[0] <= longitude <= LONGITUDE[1] and LATITUDE[0] <= latitude <= LATITUDE[1])
 
 def get_aemet_value(coords):
+  import requests
+  from geopy import distance
+
   santander = (43.4911111,-3.8005556)
   santanderairport = (43.4286111,-3.8313889)
   coordenates = (coords[1], coords[0])
@@ -103,16 +135,18 @@ def get_aemet_value(coords):
 
   return value
 
+# get_neighbour_values: values of the indexed entities within a distance of the input
+#     Params: 
+#        - input: Temperature entity
+#        - distance_required: maximum distance in metres
+#        - index: NeighbourIndex
+#     Return: 
+#        - array of values
+def get_neighbour_values(input, distance_required, index):
+  return index.query(input['location']['value']['coordinates'][1], input['location']['value']['coordinates'][0], distance_required)
+
 def get_surrounding_values(input, distance_required, data_entities, quality_entities):
-  values = []
-  inputCoords = (input['location']['value']['coordinates'][1], input['location']['value']['coordinates'][0])
-
-  if len(data_entities) != 0: 
-    for (i, j) in zip(data_entities, quality_entities):
-      if j['outlier']['value']['isOutlier']['value'] == "False":
-        if distance.distance(inputCoords, (i['location']['value']['coordinates'][1],i['location']['value']['coordinates'][0])).m <= distance_required:
-          values.append([i["value"]['value']])
-  else:
-    values = []
+  if len(data_entities) == 0: return []
 
-  return values
\ No newline at end of file
+  snapshot = entity_snapshot.EntitySnapshot(data_entities, quality_entities)
+  return get_neighbour_values(input, distance_required, snapshot.neighbour_index())
@@ -0,0 +1,279 @@
+# Software Name: batch_assessment.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Batch version of the DQ dimensions for historical observations (e.g. the raw_data dataset). The observations are
+# replayed in timestamp order as if each one had been assessed on arrival and tagged in the Context Broker, and the
+# result matches, row by row, the per-entity functions of DQ_dimensions_performance.
+
+import numpy as np
+import pandas as pd
+
+import configuration_variables
+import spatial_index
+
+COLUMNS = ["id", "timestamp", "value", "lon", "lat", "isSynthetic", "isOutlier"]
+
+
+# assess_dataframe: accuracy, completeness, precision and timeliness of every observation of a DataFrame
+#     Params:
+#        - df: DataFrame with the columns id, timestamp (datetime, ISO-8601 string or seconds), value, lon, lat,
+#              isSynthetic, isOutlier (booleans) and, optionally, ground_truth (accuracy is 0 where it is missing)
+#        - time_window: completeness window in minutes
+#        - lastN: maximum number of previous observations in completeness
+#        - distance_range: precision neighbourhood in metres
+#     Return:
+#        - DataFrame (same index as df) with the columns accuracy, completeness, precision and timeliness
+def assess_dataframe(df, time_window=configuration_variables.time_window, lastN=configuration_variables.lastN, distance_range=configuration_variables.distance_range):
+  missing = [column for column in COLUMNS if column not in df.columns]
+  if len(missing) != 0: raise ValueError("Missing columns: " + ", ".join(missing))
+
+  data = pd.DataFrame({
+    "id": df["id"].to_numpy(),
+    "time": get_seconds(df["timestamp"]),
+    "value": df["value"].to_numpy(dtype=np.float64),
+    "lon": df["lon"].to_numpy(dtype=np.float64),
+    "lat": df["lat"].to_numpy(dtype=np.float64),
+    "isSynthetic": df["isSynthetic"].to_numpy(dtype=bool),
+    "isOutlier": df["isOutlier"].to_numpy(dtype=bool),
+    "ground_truth": df["ground_truth"].to_numpy(dtype=np.float64) if "ground_truth" in df.columns else np.nan
+  })
+  order = np.argsort(data["time"].to_numpy(), kind="stable") # arrival order
+  data = data.iloc[order].reset_index(drop=True)
+
+  result = pd.DataFrame(index=df.index)
+  for (dimension, column) in [
+    ("accuracy", accuracy_column(data)),
+    ("completeness", completeness_column(data, time_window, lastN)),
+    ("precision", precision_column(data, distance_range)),
+    ("timeliness", timeliness_column(data))
+  ]:
+    values = np.empty(len(data))
+    values[order] = column
+    result[dimension] = values
+
+  return result
+
+
+def get_seconds(timestamps):
+  if pd.api.types.is_numeric_dtype(timestamps): return timestamps.to_numpy(dtype=np.float64)
+
+  times = pd.to_datetime(timestamps, utc=True)
+  return ((times - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64)
+
+
+# Accuracy: |value - ground truth|, 0 without ground truth
+def accuracy_column(data):
+  ground_truth = data["ground_truth"].to_numpy()
+  available = ~np.isnan(ground_truth) & (ground_truth != 0)
+  return np.where(available, np.round(np.abs(data["value"].to_numpy() - ground_truth), 2), 0)
+
+
+# Completeness: synthetic share among the observation and its previous ones (strictly after time - time_window, last lastN)
+#     As in completeness_processing, a single previous value is only counted when it is synthetic.
+def completeness_column(data, time_window, lastN):
+  codes, _ = pd.factorize(data["id"])
+  frame = pd.DataFrame({"id": codes, "time": pd.to_datetime(data["time"], unit="s"), "synthetic": data["isSynthetic"].astype(np.float64)})
+  groups = frame.groupby("id", sort=True)
+
+  # Rolling results are returned grouped by id (in code order) and in arrival order within each id
+  grouped_order = np.argsort(codes, kind="stable")
+  def aligned(rolling):
+    values = np.empty(len(frame))
+    values[grouped_order] = rolling.to_numpy()
+    return values
+
+  # Time window (time - time_window, time], including the observation itself
+  by_time = groups.rolling(str(time_window*60)+"s", on="time", closed="right")["synthetic"]
+  time_sum = aligned(by_time.sum()); time_count = aligned(by_time.count())
+  # Last lastN previous observations plus the observation itself
+  by_count = groups["synthetic"].rolling(lastN+1, min_periods=1)
+  count_sum = aligned(by_count.sum()); count_count = aligned(by_count.count())
+
+  capped = time_count > lastN + 1
+  total = np.where(capped, count_count, time_count)
+  n = np.where(capped, count_sum, time_sum)
+  total = np.where((total == 2) & (n == data["isSynthetic"].to_numpy(dtype=np.float64)), 1, total)
+
+  return np.round((total-n)/total, 3)*100
+
+
+# Precision: RMS difference with the last value of every non-outlier entity within distance_range
+#     Rows are split into time-ordered blocks of `block_size` rows. For a row, the last value of another entity is
+#     either its last row before the block (a table of blocks x entities) or a previous row of the same block:
+#        - against the entities known before the block, the neighbours are found once for the distinct positions
+#          (entity, lat, lon) with spatial_index.pairs_within, so the cost grows with the neighbour pairs instead of
+#          rows x entities, and an entity counts if it has not arrived yet in the block and is still at that position;
+#        - against the previous rows of the block, every pair is checked (block_size/2 distances per row).
+#     Blocks are processed in chunks of about `chunk_pairs` candidate neighbours.
+def precision_column(data, distance_range, block_size=None, chunk_pairs=1<<22):
+  codes, ids = pd.factorize(data["id"])
+  input_latitudes = data["lat"].to_numpy(dtype=np.float64); input_longitudes = data["lon"].to_numpy(dtype=np.float64)
+  input_values = data["value"].to_numpy(dtype=np.float64); input_valid = ~data["isOutlier"].to_numpy(dtype=bool)
+  rows = len(data); entities = len(ids)
+  precision = np.zeros(rows)
+  if rows == 0: return precision
+  if block_size is None: block_size = int(np.clip(np.sqrt(entities), 8, 256)) # balances the table and the in-block pairs
+
+  # Distinct positions and their neighbouring positions (neighbours[offsets[p]:offsets[p+1]])
+  positions = pd.DataFrame({"id": codes, "lat": input_latitudes, "lon": input_longitudes}).groupby(["id", "lat", "lon"], sort=False, dropna=False).ngroup().to_numpy()
+  _, first_rows = np.unique(positions, return_index=True)
+  position, neighbour = spatial_index.pairs_within(input_latitudes[first_rows], input_longitudes[first_rows], input_latitudes[first_rows], input_longitudes[first_rows], distance_range)
+  neighbours = neighbour[np.argsort(position, kind="stable")]
+  degrees = np.bincount(position, minlength=len(first_rows))
+  offsets = np.r_[0, np.cumsum(degrees)]
+  neighbour_codes = codes[first_rows]
+
+  # Next row of the same entity (rows if none)
+  by_entity = np.argsort(codes, kind="stable")
+  following = np.full(rows, rows)
+  same = codes[by_entity[1:]] == codes[by_entity[:-1]]
+  following[by_entity[:-1][same]] = by_entity[1:][same]
+
+  # Pairs (row, previous row) of a block, as offsets from the start of the block
+  later, earlier = np.tril_indices(block_size, -1)
+
+  last = np.full(entities, -1) # last row of every entity before the chunk
+  candidates = np.cumsum(degrees[positions])
+  start = 0
+  while start < rows:
+    end = int(np.searchsorted(candidates, candidates[start] - degrees[positions[start]] + chunk_pairs, side="right"))
+    end = min(max(end, start + block_size), start + max(block_size, chunk_pairs//entities*block_size), rows)
+    chunk = np.arange(start, end)
+    block = (chunk - start)//block_size; blocks = block[-1] + 1
+
+    # Last row before every block and first row in every block of each entity
+    before = np.full((blocks+1, entities), -1); before[0] = last
+    np.maximum.at(before, (block+1, codes[chunk]), chunk)
+    before = np.maximum.accumulate(before, axis=0)
+    first = np.full((blocks, entities), rows)
+    np.minimum.at(first, (block, codes[chunk]), chunk)
+
+    # Entities known before the block
+    counts = degrees[positions[chunk]]
+    row = np.repeat(chunk, counts)
+    pair = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(offsets[positions[chunk]], counts)
+    other_position = neighbours[pair]; other_code = neighbour_codes[other_position]
+    row_block = (row - start)//block_size
+    previous = before[row_block, other_code]
+    current = (previous >= 0) & (first[row_block, other_code] >= row)
+    row, other_position, previous = row[current], other_position[current], previous[current]
+    current = (positions[previous] == other_position) & input_valid[previous]
+    known_rows, known_previous = row[current], previous[current]
+
+    # Previous rows of the same block, while they are the last row of their entity
+    block_starts = np.arange(start, end, block_size)
+    row = (block_starts[:, None] + later).ravel(); previous = (block_starts[:, None] + earlier).ravel()
+    current = row < end
+    row, previous = row[current], previous[current]
+    current = input_valid[previous] & (following[previous] >= row)
+    row, previous = row[current], previous[current]
+    current = spatial_index.local_distances(input_latitudes[row], input_longitudes[row], input_latitudes[previous], input_longitudes[previous]) <= distance_range
+    row = np.r_[known_rows, row[current]]; previous = np.r_[known_previous, previous[current]]
+
+    squares = np.bincount(row - start, (input_values[row] - input_values[previous])**2, minlength=len(chunk))
+    neighbour_counts = np.bincount(row - start, minlength=len(chunk))
+    available = neighbour_counts != 0
+    precision[chunk[available]] = np.sqrt(squares[available])/np.sqrt(neighbour_counts[available])
+
+    last = before[-1]
+    start = end
+
+  return precision
+
+
+# Timeliness: weighted mean of the previous timeliness and the minutes since the previous observation (10 for the first one)
+#     Each observation applies t -> a*t + b to the previous timeliness of its entity (a=0.8, b=0.2*minutes if more than
+#     0.5 minutes passed, else a=1, b=0; a=0, b=10 for the first one). With the rows grouped by entity, the composition
+#     of those maps is computed as a prefix scan in log2(observations per entity) vectorised passes.
+def timeliness_column(data):
+  codes, ids = pd.factorize(data["id"])
+  times = data["time"].to_numpy()
+
+  previous_time = pd.Series(times).groupby(codes).shift(1).to_numpy()
+  input_timeliness = np.round((times - previous_time)/60, 2)
+
+  first = np.isnan(previous_time); update = input_timeliness > 0.5
+  a = np.where(first, 0.0, np.where(update, 0.8, 1.0))
+  b = np.where(first, 10.0, np.where(update, (1-0.8)*input_timeliness, 0.0)) # weighted_mean(t, x, 0.8) = 0.8*t + (1-0.8)*x
+
+  order = np.argsort(codes, kind="stable")
+  a = a[order]; b = b[order]
+  starts = np.flatnonzero(np.r_[True, codes[order][1:] != codes[order][:-1]])
+  position = np.arange(len(data)) - np.repeat(starts, np.diff(np.r_[starts, len(data)])) # index within the entity
+
+  shift = 1
+  while shift < len(data) and (position >= shift).any():
+    later = position[shift:] >= shift # compose with the map `shift` observations before
+    b[shift:] = np.where(later, a[shift:]*b[:-shift] + b[shift:], b[shift:])
+    a[shift:] = np.where(later, a[shift:]*a[:-shift], a[shift:])
+    shift *= 2
+
+  timeliness = np.empty(len(data))
+  timeliness[order] = b # a is 0 once the first observation is composed
+  return timeliness
+
+
+# check_equivalence: compare assess_dataframe with the per-entity functions of DQ_dimensions_performance
+#     Return:
+#        - number of rows checked (raises AssertionError on the first mismatch)
+def check_equivalence(rows=3000, entities=50, seed=0):
+  import DQ_dimensions_performance as dq
+  import random
+
+  generator = random.Random(seed)
+  records = []; timestamp = 1700000000
+  for k in range(rows):
+    timestamp = timestamp + generator.choice([0, 1, 30, 60, 120])
+    records.append({
+      "id": "urn:x-iot:u7jcfa:"+str(generator.randrange(entities)), "timestamp": timestamp,
+      "value": round(generator.uniform(8,25),2), "lon": round(generator.uniform(-3.883333, -3.7625),4), "lat": round(generator.uniform(43.425, 43.481944),4),
+      "isSynthetic": generator.random() < 0.1, "isOutlier": generator.random() < 0.1,
+      "ground_truth": round(generator.uniform(8,25),2)
+    })
+  df = pd.DataFrame(records)
+  result = assess_dataframe(df)
+
+  data_entities = {}; quality_entities = {}; history = {}
+  for k, record in enumerate(records):
+    date_value = pd.Timestamp(record["timestamp"], unit="s").strftime('%Y-%m-%dT%H:%M:%SZ')
+    input = {
+      "id": record["id"], "type": "Temperature", "hasQuality": {"object": record["id"]+":quality"},
+      "dateModified": {"value": date_value}, "value": {"value": record["value"]},
+      "location": {"value": {"coordinates": [record["lon"], record["lat"]]}}
+    }
+
+    time_at = record["timestamp"] - configuration_variables.time_window*60
+    previous = [flag for (t, flag) in history.get(record["id"], []) if t > time_at][-configuration_variables.lastN:]
+    expected = {
+      "accuracy": dq.accuracy_processing(input, record["ground_truth"]),
+      "completeness": dq.completeness_processing(record["isSynthetic"], {'synthetic': temporal_response(previous)}),
+      "precision": dq.precision_processing(input, list(data_entities.values()), list(quality_entities.values())),
+      "timeliness": dq.timeliness_processing(input, data_entities[record["id"]], quality_entities[record["id"]]) if record["id"] in data_entities else 10
+    }
+    for dimension in expected:
+      if not np.isclose(result[dimension].iloc[k], expected[dimension], rtol=1e-12, atol=1e-12):
+        raise AssertionError("Row {} {}: {} instead of {}".format(k, dimension, result[dimension].iloc[k], expected[dimension]))
+
+    history.setdefault(record["id"], []).append((record["timestamp"], record["isSynthetic"]))
+    data_entities[record["id"]] = input
+    quality_entities[record["id"]] = {
+      "id": input["hasQuality"]["object"], "timeliness": {"value": expected["timeliness"]},
+      "outlier": {"value": {"isOutlier": {"value": str(record["isOutlier"])}}}
+    }
+
+  return rows
+
+# temporal_response: synthetic attribute of a temporal response (a single value is returned as an object)
+def temporal_response(flags):
+  values = [{'value': {'isSynthetic': {'value': str(flag)}}} for flag in flags]
+  return values[0] if len(values) == 1 else values
+
+
+if __name__ == "__main__":
+  print("assess_dataframe matches the per-entity functions on", check_equivalence(), "rows")
@@ -0,0 +1,293 @@
+# Software Name: benchmarks.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Micro-benchmarks of the client-side operations of the DQ pipeline.
+#     Usage: python benchmarks.py [name ...]   (all benchmarks when no name is given)
+
+import sys, timeit
+from datetime import datetime, timedelta
+
+import basic_operations
+
+
+# per_call: average time per call of a function, in microseconds (best of several repetitions)
+def per_call(function, number):
+  return min(timeit.repeat(function, number=number, repeat=5))/number*1e6
+
+def report(name, microseconds):
+  print("  {:<45} {:>10.3f} us/call".format(name, microseconds))
+
+
+# Timestamps: dateutil parsing (previous implementation) against the DATE_FORMAT fast path, its cache and the vectorised variant
+def benchmark_timestamps(n=10000):
+  from dateutil import parser
+
+  start = datetime(2023, 6, 1)
+  dates = [(start + timedelta(seconds=1.2*k)).strftime(basic_operations.DATE_FORMAT) for k in range(n)]
+  iterator = iter(dates*1000)
+
+  print("timestamps ({} distinct dates)".format(n))
+  report("dateutil parser.parse(date).timestamp()", per_call(lambda: parser.parse(next(iterator)).timestamp(), n))
+  report("fast path, uncached", per_call(lambda: basic_operations.parse_date.__wrapped__(next(iterator)).timestamp(), n))
+  basic_operations.parse_date.cache_clear()
+  for date in dates: basic_operations.get_timestamp(date)
+  report("get_timestamp, cached", per_call(lambda: basic_operations.get_timestamp(next(iterator)), n))
+  report("get_timestamps (vectorised, per element)", per_call(lambda: basic_operations.get_timestamps(dates), 1)/n)
+
+  assert basic_operations.get_timestamps(dates).tolist() == [parser.parse(date).timestamp() for date in dates]
+
+
+# Instrumentation: overhead of timing an empty block (paired time.time() + list append, as before, against instrumentation)
+def benchmark_instrumentation(n=100000):
+  import time
+  import instrumentation
+
+  def time_pair(values=[]):
+    start_time = time.time()
+    final_time = time.time()
+    values.append(final_time - start_time)
+
+  recorder = instrumentation.Recorder(capacity=n)
+  timer = recorder.timer
+  def timer_block():
+    with timer("block"): pass
+
+  histogram_recorder = instrumentation.Recorder(capacity=n, histograms=True)
+  def histogram_block():
+    with histogram_recorder.timer("block"): pass
+
+  disabled = instrumentation.Recorder(capacity=n, enabled=False)
+  def disabled_block():
+    with disabled.timer("block"): pass
+
+  print("instrumentation (empty block)")
+  report("time.time() pair + list append", per_call(time_pair, n))
+  report("Recorder.timer", per_call(timer_block, n))
+  report("Recorder.timer with histogram", per_call(histogram_block, n))
+  report("Recorder.timer disabled", per_call(disabled_block, n))
+
+
+# Precision fetch: every Temperature/DataQualityAssessment entity (full) against the geo-query + quality entities by id (geo), on the local broker
+def benchmark_precision_fetch(entities=500, inputs=200, latency=0.001):
+  import random, time
+  from datetime import datetime
+  import configuration_variables, context_broker_api, local_broker
+  import DQ_dimensions_performance as dq
+
+  class CountingClient(context_broker_api.BrokerClient):
+    bytes = 0; requests = 0
+
+    def request(self, method, url, headers=None, data=None, stream=False):
+      response = super().request(method, url, headers=headers, data=data, stream=stream)
+      self.bytes += int(response.headers.get("Content-Length", 0)); self.requests += 1 # the body of a streamed response is not read here
+      return response
+
+  broker = local_broker.start(latency=latency, default_limit=local_broker.MAX_LIMIT)
+  configuration_variables.broker_url = broker.url
+  previous_client = context_broker_api.client
+  context_broker_api.client = CountingClient()
+
+  random.seed(0)
+  date_object = datetime.now()
+  bodies = []
+  for k in range(entities):
+    input = dq.simulate_input("bench"+str(k), date_object)
+    bodies += [input, dq.build_quality_input(input, random.random() < 0.1, False, 0, 10, 0, 100)]
+  context_broker_api.upsert_entities(bodies)
+  observations = [dq.simulate_input("bench"+str(random.randrange(entities)), date_object) for k in range(inputs)]
+
+  print("precision fetch ({} entities, {} inputs, {} ms broker latency)".format(entities, inputs, latency*1e3))
+  precisions = {}
+  for mode in ["full", "geo"]:
+    configuration_variables.precision_fetch = mode
+    context_broker_api.client.bytes = 0; context_broker_api.client.requests = 0
+    start_time = time.perf_counter()
+    responses = [dq.precision_request(input) for input in observations]
+    elapsed = (time.perf_counter() - start_time)/inputs
+    precisions[mode] = [dq.precision_processing(input, data_entities, quality_entities) for (input, (data_entities, quality_entities, _)) in zip(observations, responses)]
+    report(mode+" latency", elapsed*1e6)
+    print("  {:<45} {:>10.0f} bytes/call, {:.1f} requests/call".format(mode+" transferred", context_broker_api.client.bytes/inputs, context_broker_api.client.requests/inputs))
+
+  assert precisions["full"] == precisions["geo"]
+  context_broker_api.client = previous_client
+  broker.stop()
+
+
+# Payloads: build + serialise the DataQualityAssessment/Temperature entities, with every attribute rebuilt per entity and
+# json.dumps (previous path) against the shared constant attributes of DQ_dimensions_performance and payloads.dumps
+def benchmark_payloads(n=10000):
+  import itertools, json, random
+  from datetime import datetime
+  import numpy as np
+  import payloads
+  import DQ_dimensions_performance as dq
+
+  # Previous builders: every constant attribute is a new dictionary
+  def rebuilt_quality_input(input, is_outlier, is_synthetic, accuracy, timeliness, precision, completeness):
+    date_value = input['dateModified']['value']
+    return {
+      "id": input['hasQuality']['object'], "type": "DataQualityAssessment",
+      "dateCalculated": {"type": "Property", "value": date_value},
+      "source": {"type": "Property", "value": "https://salted-project.eu"},
+      "outlier": {"type": "Property", "value": {"isOutlier": {"type": "Property", "value": str(is_outlier)}}, "observedAt": date_value},
+      "synthetic": {"type": "Property", "value": {"isSynthetic": {"type": "Property", "value": str(is_synthetic)}}, "observedAt": date_value},
+      "accuracy": {"type": "Property", "value": accuracy, "observedAt": date_value, "unitCode": "CEL"},
+      "timeliness": {"type": "Property", "value": timeliness, "observedAt": date_value, "unitCode": "minutes"},
+      "precision": {"type": "Property", "value": precision, "observedAt": date_value, "unitCode": "CEL"},
+      "completeness": {"type": "Property", "value": completeness, "observedAt": date_value, "unitCode": "P1"},
+      "@context": ["https://raw.githubusercontent.com/SALTED-Project/contexts/main/wrapped_contexts/dataquality-context.jsonld"]
+    }
+
+  def rebuilt_input(id, date_object):
+    temperature_value = round(random.uniform(8,25),2)
+    longitude_value = round(random.uniform(-3.883333, -3.7625),4)
+    latitude_value = round(random.uniform(43.425, 43.481944),4)
+    date_value = date_object.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return {
+      "id": "urn:x-iot:u7jcfa:"+str(id), "type": "Temperature",
+      "address": {"type": "Property", "value": {"addressCountry": "Spain", "addressLocality": "Santander", "addressRegion": "Cantabria"}},
+      "areaServed": {"type": "Property", "value": "Santander"},
+      "unit": {"type": "Property", "value": "degreeCelsius"},
+      "dataProvider": {"type": "Property", "value": "SmartSantander"},
+      "dateModified": {"type": "Property", "value": date_value, "observedAt": date_value},
+      "source": {"type": "Property", "value": "https://api.smartsantander.eu/"},
+      "value": {"type": "Property", "value": temperature_value, "observedAt": date_value, "unitCode": "CEL"},
+      "location": {"type": "GeoProperty", "value": {"type": "Point", "coordinates": [latitude_value, longitude_value]}},
+      "@context": ["https://raw.githubusercontent.com/SALTED-Project/contexts/main/wrapped_contexts/energycim-context.jsonld"],
+      "hasQuality": {"type": "Relationship", "object": "urn:ngsi-ld:DataQualityAssessment:"+str(id)}
+    }
+
+  random.seed(0)
+  date_object = datetime.now()
+  inputs = [dq.simulate_input(k, date_object) for k in range(100)]
+  arguments = [(False, False, 1.25, 0.0, np.float64(0.8165), 93.3)]*100
+  iterator = itertools.cycle(list(zip(inputs, arguments)))
+  ids = itertools.cycle(range(100))
+
+  def quality_previous():
+    input, args = next(iterator)
+    return json.dumps([rebuilt_quality_input(input, *args)])
+
+  def quality_json():
+    input, args = next(iterator)
+    return json.dumps([dq.build_quality_input(input, *args)])
+
+  def quality_payloads():
+    input, args = next(iterator)
+    return payloads.dumps([dq.build_quality_input(input, *args)])
+
+  def temperature_previous():
+    return json.dumps([rebuilt_input(next(ids), date_object)])
+
+  def temperature_json():
+    return json.dumps([dq.simulate_input(next(ids), date_object)])
+
+  def temperature_payloads():
+    return payloads.dumps([dq.simulate_input(next(ids), date_object)])
+
+  print("payloads: build + serialise (orjson {})".format("installed" if payloads.orjson is not None else "not installed"))
+  report("quality: rebuilt attributes + json.dumps", per_call(quality_previous, n))
+  report("quality: shared attributes + json.dumps", per_call(quality_json, n))
+  report("quality: shared attributes + payloads.dumps", per_call(quality_payloads, n))
+  report("temperature: rebuilt attributes + json.dumps", per_call(temperature_previous, n))
+  report("temperature: shared attributes + json.dumps", per_call(temperature_json, n))
+  report("temperature: shared attributes + payloads.dumps", per_call(temperature_payloads, n))
+
+  for (input, args) in zip(inputs, arguments):
+    assert json.loads(payloads.dumps(dq.build_quality_input(input, *args))) == json.loads(json.dumps(rebuilt_quality_input(input, *args)))
+  random.seed(1); expected = rebuilt_input(7, date_object)
+  random.seed(1); assert json.loads(payloads.dumps(dq.simulate_input(7, date_object))) == expected
+
+
+# Request templates: client-side cost of building the URL and headers of a request (previous string building against request_templates), and of preparing it with requests
+def benchmark_request_templates(n=100000):
+  import requests
+  import configuration_variables, request_templates
+
+  configuration_variables.broker_url = "http://localhost:1026/ngsi-ld/v1/"
+  types = configuration_variables.types.split(",")
+  entity_id = "urn:ngsi-ld:DataQualityAssessment:42"
+  time_at = "2023-06-01T10:00:00Z"
+
+  def previous():
+    url = configuration_variables.broker_url + "temporal/entities/"+entity_id+"?timerel=after&timeAt="+time_at+"&lastN="+str(configuration_variables.lastN)
+    context_link = (
+      configuration_variables.base_context+"DataQualityAssessment".lower()+'-context.jsonld'
+      if "DataQualityAssessment" in types
+      else configuration_variables.base_context + "default-context.jsonld"
+    )
+    headers = {
+      'Accept': 'application/ld+json',
+      'Link': '<'+context_link+'>;rel="http://www.w3.org/ns/json-ld#context"'
+    }
+    return url, headers
+
+  def templates():
+    current = request_templates.get()
+    return current.temporal_url(entity_id, timerel="after", timeAt=time_at, lastN=configuration_variables.lastN), current.get_headers("DataQualityAssessment")
+
+  session = requests.Session()
+  url, headers = templates()
+
+  print("request templates (temporal request)")
+  report("previous: concatenation + Link header", per_call(previous, n))
+  report("request_templates (URL-encoded)", per_call(templates, n))
+  report("requests: prepare_request", per_call(lambda: session.prepare_request(requests.Request("GET", url, headers=headers)), n//10))
+
+
+# Import time: cold start of a worker process importing the DQ modules (python -X importtime, fresh interpreter)
+#     Reports the cumulative import time of each module and of the heaviest packages it loads.
+def benchmark_import_time(modules=("basic_operations", "DQ_dimensions_performance", "ingestion_service"), repeat=5):
+  import os, subprocess
+
+  def import_times(module):
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import "+module], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stderr
+    times = {}
+    for line in output.splitlines():
+      if not line.startswith("import time:") or "cumulative" in line: continue
+      _, cumulative, name = line[len("import time:"):].split("|")
+      times[name.strip()] = max(times.get(name.strip(), 0), int(cumulative)/1000)
+    return times
+
+  startup = import_times("sys") # loaded by the interpreter itself (site...)
+  print("import time (cold start, ms, best of {})".format(repeat))
+  for module in modules:
+    runs = [import_times(module) for k in range(repeat)]
+    best = min(runs, key=lambda times: times.get(module, 0))
+    packages = sorted(((ms, name) for (name, ms) in best.items() if "." not in name and name != module and name not in startup and ms >= 10), reverse=True)
+    print("  {:<45} {:>10.1f} ms   ({})".format(module, best.get(module, float("nan")), ", ".join("{} {:.0f}".format(name, ms) for (ms, name) in packages[:5])))
+
+
+# Outlier detection: per-observation cost of the online detector over a replay (python outlier_detector.py --csv for the raw_data dataset)
+def benchmark_outlier_detection(observations=200000, sensors=100):
+  import outlier_detector
+
+  stream, injected = outlier_detector.synthetic_stream(observations, sensors)
+  flags, throughput = outlier_detector.replay(stream)
+  detected = sum(1 for (flag, spike) in zip(flags, injected) if flag and spike)
+
+  print("outlier detection ({} observations, {} sensors, {} injected spikes)".format(observations, sensors, sum(injected)))
+  report("OutlierDetector.add (replay)", 1e6/throughput)
+  print("  recall {:.3f}, precision {:.3f}".format(detected/max(sum(injected), 1), detected/max(sum(flags), 1)))
+
+
+BENCHMARKS = {
+  "timestamps": benchmark_timestamps,
+  "instrumentation": benchmark_instrumentation,
+  "precision_fetch": benchmark_precision_fetch,
+  "payloads": benchmark_payloads,
+  "request_templates": benchmark_request_templates,
+  "import_time": benchmark_import_time,
+  "outlier_detection": benchmark_outlier_detection
+}
+
+if __name__ == "__main__":
+  names = sys.argv[1:] or list(BENCHMARKS)
+  for name in names:
+    BENCHMARKS[name]()
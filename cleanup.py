@@ -0,0 +1,125 @@
+# Software Name: cleanup.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Removal of the Temperature and DataQualityAssessment entities created by a simulation.
+#     For each type, the ids are listed page by page, the current entities are deleted in batch requests of
+#     `batch_size` ids and their temporal representations (one DELETE per entity) are deleted concurrently by `workers`
+#     threads. Connection errors and transient status codes (429, 502, 503, 504) are retried by the BrokerClient of
+#     context_broker_api (its only retry layer); an entity already missing (404 / ResourceNotFound) counts as deleted.
+#
+#     Usage: python cleanup.py [--prefix sim0]
+
+import argparse, json, time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import context_broker_api
+import configuration_variables
+import request_templates
+
+TYPES = ["Temperature", "DataQualityAssessment"]
+CLEANUP_ATTRS = {"Temperature": ["dateModified"], "DataQualityAssessment": ["dateCalculated"]} # only the ids are needed
+NOT_FOUND = "https://uri.etsi.org/ngsi-ld/errors/ResourceNotFound"
+
+
+# list_ids: ids of the entities of a type, filtered by the simulation prefix
+#     Return:
+#        - array of ids
+#        - error: boolean specifying if there have been any errors with the requests to the Context Broker
+def list_ids(entity_type, id_prefix=""):
+  pages = context_broker_api.EntityPages(entity_type, headers=request_templates.get().entity_headers[entity_type], attrs=CLEANUP_ATTRS[entity_type])
+  ids = [i['id'] for i in pages if id_prefix == "" or ":"+id_prefix in i['id']]
+  return ids, pages.error
+
+
+# attempt: call a request function (already retried by the BrokerClient)
+#     Params:
+#        - request: function without arguments returning (status code, result)
+#     Return:
+#        - status code (None if it raised a connection error once the retries were exhausted)
+#        - result (the exception if it raised)
+def attempt(request):
+  try:
+    return request()
+  except requests.RequestException as e:
+    return None, e
+
+
+# delete_type: delete the current and temporal entities of one type
+#     Return:
+#        - report: entities found, batch requests, failed (entity id, error) tuples and elapsed seconds
+def delete_type(entity_type, id_prefix, batch_size, executor):
+  start_time = time.perf_counter()
+  report = {"entities": 0, "batches": 0, "failures": [], "elapsed": 0}
+
+  ids, error = list_ids(entity_type, id_prefix)
+  if error: report["failures"].append((None, "listing failed"))
+  report["entities"] = len(ids)
+
+  # DELETE /entities (batches)
+  for k in range(0, len(ids), batch_size):
+    batch = ids[k:k+batch_size]
+    status, result = attempt(lambda: context_broker_api.delete_entities_batch(batch))
+    report["batches"] += 1
+    if status is None: report["failures"].extend([(i, repr(result)) for i in batch])
+    else: report["failures"].extend([(i, e) for (i, e) in result if not not_found(e)])
+
+  # DELETE /temporal/entities (concurrently)
+  def delete_temporal(entity_id):
+    status, result = attempt(lambda: (context_broker_api.delete_temporal_entity(entity_id), None))
+    if status == 204 or status == 404: return None
+    return (entity_id, status if status is not None else repr(result))
+
+  report["failures"].extend([failure for failure in executor.map(delete_temporal, ids) if failure is not None])
+  report["elapsed"] = time.perf_counter() - start_time
+  return report
+
+def not_found(error):
+  return isinstance(error, dict) and error.get('type') == NOT_FOUND
+
+
+# delete_entities: delete the Temperature and DataQualityAssessment entities (current and temporal) of a simulation
+#     Params:
+#        - id_prefix: only entities whose id contains ":"+id_prefix ("": every entity)
+#        - batch_size: ids per batch delete request
+#        - workers: concurrent temporal DELETE requests (at most configuration_variables.broker_pool_size are useful)
+#     Return:
+#        - dictionary with the report of every type (see delete_type)
+def delete_entities(id_prefix="", batch_size=configuration_variables.cleanup_batch_size, workers=configuration_variables.cleanup_workers):
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    return {entity_type: delete_type(entity_type, id_prefix, batch_size, executor) for entity_type in TYPES}
+
+
+# failures: number of failures of a cleanup report
+def failures(report):
+  return sum(len(report[entity_type]["failures"]) for entity_type in report)
+
+# print_report: one line per type with the entities, failures and elapsed time
+def print_report(report):
+  for (entity_type, result) in report.items():
+    print("DELETE", entity_type, result["entities"], "entities,", len(result["failures"]), "failures,", round(result["elapsed"], 3), "s")
+    for failure in result["failures"][:5]: print("  ", failure)
+
+
+def main():
+  arguments = argparse.ArgumentParser(description="Delete the Temperature and DataQualityAssessment entities of the Context Broker")
+  arguments.add_argument("--prefix", default="", help="only entities whose id contains :prefix (default: every entity)")
+  arguments.add_argument("--batch-size", type=int, default=configuration_variables.cleanup_batch_size)
+  arguments.add_argument("--workers", type=int, default=configuration_variables.cleanup_workers)
+  arguments.add_argument("--json", action="store_true", help="print the report as JSON")
+  args = arguments.parse_args()
+
+  report = delete_entities(args.prefix, batch_size=args.batch_size, workers=args.workers)
+  if args.json: print(json.dumps(report, default=str))
+  else: print_report(report)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,105 @@
+# Software Name: completeness_window.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import random
+from collections import deque
+
+import configuration_variables
+
+
+# SlidingCompleteness: completeness of a stream of observations over a sliding time window
+#     For every entity it keeps the previous observations that the temporal request of completeness_request would
+#     return (those strictly after timestamp - time_window, at most the last lastN) together with a running count of
+#     the synthetic ones, so each observation is added and old ones expired in O(1) amortised time.
+#     Params:
+#        - time_window: window in minutes
+#        - lastN: maximum number of previous observations considered (None for no limit)
+class SlidingCompleteness:
+  def __init__(self, time_window=configuration_variables.time_window, lastN=configuration_variables.lastN):
+    self.time_window = time_window*60
+    self.lastN = lastN
+    self.windows = {} # entity id -> [deque of (timestamp, is_synthetic), number of synthetic observations]
+
+  # add: add an observation and compute its completeness
+  #     Params:
+  #        - entity_id: id of the entity
+  #        - timestamp: observation time in seconds
+  #        - is_synthetic: True if the observation is synthetic
+  #     Return:
+  #        - completeness (%) of the observation, as completeness_processing
+  def add(self, entity_id, timestamp, is_synthetic):
+    window = self.windows.get(entity_id)
+    if window is None:
+      window = self.windows[entity_id] = [deque(), 0]
+    observations = window[0]
+
+    # Expire observations out of the time window
+    time_at = timestamp - self.time_window
+    while len(observations) != 0 and observations[0][0] <= time_at:
+      if observations.popleft()[1]: window[1] -= 1
+
+    n = int(is_synthetic) + window[1]
+    total = 1 + len(observations)
+    if len(observations) == 1 and window[1] == 0: total = 1 # a single previous real value is not counted (completeness_processing)
+    completeness = round((total-n)/total,3)*100
+
+    observations.append((timestamp, bool(is_synthetic)))
+    if is_synthetic: window[1] += 1
+    if self.lastN is not None and len(observations) > self.lastN:
+      if observations.popleft()[1]: window[1] -= 1
+
+    return completeness
+
+  # process: completeness of every observation of a stream
+  #     Params:
+  #        - stream: iterable of (entity id, timestamp, is_synthetic)
+  #     Return:
+  #        - generator of completeness values, one per observation
+  def process(self, stream):
+    for (entity_id, timestamp, is_synthetic) in stream:
+      yield self.add(entity_id, timestamp, is_synthetic)
+
+  def clear(self):
+    self.windows = {}
+
+
+# check_equivalence: compare SlidingCompleteness with completeness_processing over a random stream
+#     completeness_processing is fed with the temporal response the Context Broker would return for each observation
+#     (previous values strictly after timestamp - time_window, last lastN).
+#     Return:
+#        - number of observations checked (raises AssertionError on the first mismatch, also under python -O)
+def check_equivalence(observations=20000, entities=20, seed=0):
+  import DQ_dimensions_performance as dq
+
+  generator = random.Random(seed)
+  engine = SlidingCompleteness()
+  history = {}
+  timestamp = 0
+
+  for k in range(observations):
+    entity_id = generator.randrange(entities)
+    timestamp = timestamp + generator.choice([0, 1, 30, 60, 120, 600])
+    is_synthetic = generator.random() < 0.3
+
+    time_at = timestamp - configuration_variables.time_window*60
+    previous = [flag for (t, flag) in history.get(entity_id, []) if t > time_at][-configuration_variables.lastN:]
+    temporal = [{'value': {'isSynthetic': {'value': str(flag)}}} for flag in previous]
+    if len(temporal) == 1: temporal = temporal[0] # the broker returns a single temporal value as an object
+    expected = dq.completeness_processing(is_synthetic, {'synthetic': temporal})
+
+    obtained = engine.add(entity_id, timestamp, is_synthetic)
+    if obtained != expected: raise AssertionError((k, entity_id, obtained, expected))
+
+    history.setdefault(entity_id, []).append((timestamp, is_synthetic))
+
+  return observations
+
+
+if __name__ == "__main__":
+  print("SlidingCompleteness matches completeness_processing on", check_equivalence(), "observations")
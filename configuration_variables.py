@@ -13,4 +13,53 @@ base_context = "https://raw.githubusercontent.com/SALTED-Project/contexts/main/w
 lastN = 15
 distance_range = 2000
 time_window = 60
-types = "DataQualityAssessment,Temperature"
\ No newline at end of file
+types = "DataQualityAssessment,Temperature"
+
+# Context Broker connection pool
+broker_pool_size = 10
+broker_retries = 3
+broker_backoff = 0.1 # seconds
+broker_timeout = 30 # seconds
+broker_query_limit = 1000 # entities per query/page (the NGSI-LD default is 20)
+broker_streaming = True # parse the pages of entities incrementally with ijson, when installed
+
+# Precision neighbours: "geo" (geo-query around the input + its neighbours' quality entities by id), "full" (every entity of both types)
+# or "cache" (shared snapshot of every entity, see snapshot_cache.py)
+precision_fetch = "geo"
+snapshot_max_staleness = 10 # seconds
+snapshot_refresh_interval = 5 # seconds
+
+# Batch upserts (write-behind buffer)
+upsert_batch_size = 20 # entities
+upsert_max_delay = 1 # seconds
+upsert_max_pending = 8 # flushed batches waiting to be sent (producers then send them themselves)
+
+# Cleanup of the entities of a simulation (cleanup.py)
+cleanup_batch_size = 500 # ids per batch delete request
+cleanup_workers = 8 # concurrent temporal DELETE requests (<= broker_pool_size)
+
+# Completeness/timeliness answered from the assessments of this process (the broker is read on cold start)
+local_quality_state = True
+
+# AEMET ground truth
+aemet_url = "http://www.aemet.es/es/eltiempo/observacion/"
+aemet_cache_ttl = 3600 # seconds after the latest hourly row (when the next one is due)
+aemet_refetch_interval = 300 # seconds between downloads while the next row is not published yet
+aemet_timeout = 10 # seconds
+
+# Timing of the pipeline phases and broker requests (see instrumentation.py)
+instrumentation_enabled = True
+instrumentation_capacity = 100000 # durations kept per series
+instrumentation_histograms = False
+
+# Outlier flag of the DataQualityAssessment entities (see outlier_detector.py): per-sensor EWMA z-score, or random
+# flags (10%) as in the original benchmark when outlier_detection is False
+outlier_detection = True
+outlier_alpha = 0.1
+outlier_threshold = 4 # standard deviations
+outlier_warmup = 10 # observations
+outlier_min_std = 0.1 # CEL
+
+# Live tagging service (see ingestion_service.py)
+ingestion_workers = 8
+ingestion_queue_size = 100 # observations waiting per worker
@@ -8,11 +8,55 @@
 # Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
 
 import requests, json
-from dateutil import parser
+from time import perf_counter_ns
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as TransportError
+from urllib3.util.retry import Retry
 from dateutil.relativedelta import relativedelta
 import configuration_variables
+import basic_operations
+import instrumentation
+import payloads
+import request_templates
 
-types = configuration_variables.types.split(",")
+try:
+  import ijson
+except ImportError:
+  ijson = None
+
+
+# BrokerClient: keep-alive connection pool shared by every request to the Context Broker
+#     Params: 
+#        - pool_size: maximum number of connections kept open per host
+#        - retries: number of retries on connection errors and 429/502/503/504 responses (honouring Retry-After)
+#        - backoff: backoff factor in seconds between retries (backoff * 2^(retry-1))
+#        - timeout: connect/read timeout in seconds
+#        - tenant: NGSI-LD tenant sent with every request (None: default tenant)
+class BrokerClient:
+  def __init__(self, pool_size=configuration_variables.broker_pool_size, retries=configuration_variables.broker_retries, backoff=configuration_variables.broker_backoff, timeout=configuration_variables.broker_timeout, tenant=None):
+    self.timeout = timeout
+    self.session = requests.Session()
+    if tenant is not None: self.session.headers['NGSILD-Tenant'] = tenant
+
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 502, 503, 504), allowed_methods=None, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+
+  # request: send a request (timed as broker_<method> in instrumentation.recorder)
+  #     Params:
+  #        - stream: do not read the body yet (the response must then be read or closed); the request is not timed,
+  #          the caller times it until the body is read (see EntityPages.read_page)
+  def request(self, method, url, headers=None, data=None, stream=False):
+    if stream: return self.session.request(method, url, headers=headers, data=data, timeout=self.timeout, stream=True)
+    with instrumentation.recorder.timer("broker_"+method):
+      return self.session.request(method, url, headers=headers, data=data, timeout=self.timeout)
+
+  def close(self):
+    self.session.close()
+
+
+client = BrokerClient()
 
 # upsert_entity: upsert entity into the Context Broker
 #     Params: 
@@ -20,12 +64,29 @@ types = configuration_variables.types.split(",")
 #     Return: 
 #        - status code -- 201 Created / 204 No Content
 def upsert_entity(body):
-	url = configuration_variables.broker_url + "entityOperations/upsert?options=update"
-	payload = json.dumps([body])
-	headers = {'Content-Type': 'application/ld+json'}
+	status, _ = upsert_entities([body])
+	return status
 
-	response = requests.request("POST", url, headers=headers, data=payload)
-	return response.status_code
+
+# upsert_entities: upsert several entities into the Context Broker in a single batch request
+#     Params: 
+#        - bodies: array of complete entity bodies
+#     Return: 
+#        - status code -- 201 Created / 204 No Content / 207 Multi-Status (some entities failed)
+#        - array of (entity id, error) tuples of the entities that could not be upserted
+def upsert_entities(bodies):
+	payload = payloads.dumps(bodies)
+	response = client.request("POST", request_templates.get().upsert, headers=request_templates.UPSERT_HEADERS, data=payload)
+	if response.status_code == 201 or response.status_code == 204: return response.status_code, []
+
+	if response.status_code == 207:
+		try:
+			errors = response.json().get('errors', [])
+			return response.status_code, [(i.get('entityId'), i.get('error')) for i in errors]
+		except ValueError:
+			pass
+
+	return response.status_code, [(i['id'], response.status_code) for i in bodies]
 
 
 # check_if_entity_already_exists: check if the entity requested already exists in the Context broker
@@ -36,74 +97,52 @@ def upsert_entity(body):
 #        - True/False: Entity found/not found
 #        - error: boolean specifying if there have been any errors throughout the function (associated with requests to the Context Broker or external instances)
 def check_if_entity_already_exists(entity_id, entity_type):
-  url = configuration_variables.broker_url + "entities/" + entity_id
-
-  context_link = (
-    configuration_variables.base_context+entity_type.lower()+'-context.jsonld'
-    if entity_type in types
-    else configuration_variables.base_context + "default-context.jsonld"
-  )
+  templates = request_templates.get()
+  url = templates.entity_url(entity_id)
 
-  headers = {
-    'Accept': 'application/ld+json',
-    'Link': '<'+context_link+'>;rel="http://www.w3.org/ns/json-ld#context"'
-  }
+  headers = templates.get_headers(entity_type)
 
-  response = requests.request("GET", url, headers=headers, data={})
+  response = client.request("GET", url, headers=headers, data={})
   if response.status_code == 200: return True, False
   elif response.status_code == 404: return False, False
   else: return None, True
   
 
-# get_entities_by_type_geoQuery: get entities stored in the Context Broker filtering by type and applying a geoQuery
+# get_entities_by_type_geoQuery: get entities stored in the Context Broker filtering by type and applying a geoQuery (read page by page)
 #     Params: 
 #        - entity_type: type requested
-#        - coordinates: coordinates to make the geoQuery filter
+#        - coordinates: coordinates of the Point to make the geoQuery filter (array, as stored in location)
+#        - distance_range: maximum distance in metres (None: configuration_variables.distance_range)
+#        - attrs: array of attributes to return (None: every attribute)
 #     Return: 
 #        - array of entities
 #        - error: boolean specifying if there have been any errors throughout the function (associated with requests to the Context Broker or external instances)
-def get_entities_by_type_geoQuery(entity_type, coordinates):
-  url = configuration_variables.broker_url + "entities/?type="+entity_type+"&georel=near%3BmaxDistance=="+configuration_variables.distance_range+"&coordinates="+coordinates+"&geometry=Point"
+def get_entities_by_type_geoQuery(entity_type, coordinates, distance_range=None, attrs=None):
+  if distance_range is None: distance_range = configuration_variables.distance_range
+  if not isinstance(coordinates, str): coordinates = json.dumps(coordinates, separators=(",", ":"))
 
-  context_link = (
-    configuration_variables.base_context+entity_type.lower()+'-context.jsonld'
-    if entity_type in types
-    else configuration_variables.base_context + "default-context.jsonld"
-  )
+  pages = EntityPages(entity_type, georel="near;maxDistance=="+str(distance_range), geometry="Point", coordinates=coordinates, attrs=attrs)
+  entities = list(pages)
 
-  headers = {
-    'Accept': 'application/ld+json',
-    'Link': '<'+context_link+'>;rel="http://www.w3.org/ns/json-ld#context"'
-  }
-
-  response = requests.request("GET", url, headers=headers, data={})
-
-  if response.status_code == 200: return response.json(), False
-  else: return None, True
+  if pages.error: return None, True
+  return entities, False
 
 
 # get_entity_by_id: get last value recorded in the Context Broker of an entity (by its unique id) or several entities (by a string with a list of ids)
 #     Params: 
 #        - entity_id: id or list of id concatenated as a string with commas e.g.: id1,id2,id3
 #        - entity_type: type of the entities requested
+#        - attrs: array of attributes to return (None: every attribute)
 #     Return: 
 #        - array of entities
 #        - error: boolean specifying if there have been any errors throughout the function (associated with requests to the Context Broker or external instances)
-def get_entity_by_id(entity_id, entity_type):
-  url = configuration_variables.broker_url + "entities/?id=" + entity_id
-
-  context_link = (
-    configuration_variables.base_context+entity_type.lower()+'-context.jsonld'
-    if entity_type in types
-    else configuration_variables.base_context + "default-context.jsonld"
-  )
+def get_entity_by_id(entity_id, entity_type, attrs=None):
+  templates = request_templates.get()
+  url = templates.query_url(id=entity_id, limit=configuration_variables.broker_query_limit if "," in entity_id else None, attrs=attrs)
 
-  headers = {
-    'Accept': 'application/ld+json',
-    'Link': '<'+context_link+'>;rel="http://www.w3.org/ns/json-ld#context"'
-  }
+  headers = templates.get_headers(entity_type)
 
-  response = requests.request("GET", url, headers=headers, data={})
+  response = client.request("GET", url, headers=headers, data={})
   if response.status_code == 200: return response.json(), False
   else: return None, True
 
@@ -117,86 +156,120 @@ def get_entity_by_id(entity_id, entity_type):
 #        - entity with arrays in attributes if there is more thant one temporal instance
 #        - error: boolean specifying if there have been any errors throughout the function (associated with requests to the Context Broker or external instances)
 def get_temporal_values_by_id(entity_id, entity_type, entity_date_string):
-  entity_date = parser.parse(entity_date_string)
+  entity_date = basic_operations.get_date(entity_date_string)
   timeAt = (entity_date - relativedelta(minutes=configuration_variables.time_window)).strftime('%Y-%m-%dT%H:%M:%SZ')
 
-  url = configuration_variables.broker_url + "temporal/entities/"+entity_id+"?timerel=after&timeAt="+timeAt+"&lastN="+str(configuration_variables.lastN)
+  templates = request_templates.get()
+  url = templates.temporal_url(entity_id, timerel="after", timeAt=timeAt, lastN=configuration_variables.lastN)
 
-  context_link = (
-    configuration_variables.base_context+entity_type.lower()+'-context.jsonld'
-    if entity_type in types
-    else configuration_variables.base_context + "default-context.jsonld"
-  )
-
-  headers = {
-    'Accept': 'application/ld+json',
-    'Link': '<'+context_link+'>;rel="http://www.w3.org/ns/json-ld#context"'
-  }
+  headers = templates.get_headers(entity_type)
   
-  response = requests.request("GET", url, headers=headers, data={})
+  response = client.request("GET", url, headers=headers, data={})
   if response.status_code == 200: return response.json(), False
   else: return None, True
 
 
-def get_entities_by_type(entity_type):
-  url = configuration_variables.broker_url + "entities/?type="+entity_type+"&lastN=200"
-  
-  context_link = (
-    configuration_variables.base_context+entity_type.lower()+'-context.jsonld'
-    if entity_type in types
-    else configuration_variables.base_context + "default-context.jsonld"
-  )
-
-  headers = {
-    'Accept': 'application/ld+json',
-    'Link': '<'+context_link+'>;rel="http://www.w3.org/ns/json-ld#context"'
-  }
-
-  response = requests.request("GET", url, headers=headers, data={})
-
-  if response.status_code == 200: return response.json(), False
-  else: return None, True
-
-
-def delete_entities():
-  id_list=[]
-
-  # Temperature
-  url = configuration_variables.broker_url + "entities/?type=Temperature&limit=1000"
-  headers = {
-    'Accept': 'application/ld+json',
-    'Link': '<https://raw.githubusercontent.com/SALTED-Project/contexts/main/wrapped_contexts/energycim-context.jsonld>;rel="http://www.w3.org/ns/json-ld#context";type="application/ld+json"'
-  }
-  response = requests.request("GET", url, headers=headers, data={})
-
-  for i in response.json():
-    id_list.append(i['id'])
+# EntityPages: entities of a query, requested page by page (limit/offset) and yielded one by one
+#     Params: 
+#        - entity_type: type requested (None: every type, e.g. when querying by id)
+#        - page_size: entities per request (None: configuration_variables.broker_query_limit)
+#        - headers: request headers (None: those of entity_type)
+#        - stream: parse each page incrementally with ijson, if installed (None: configuration_variables.broker_streaming)
+#        - params: other query parameters (e.g. attrs, id, georel)
+#     Only one page is held in memory (a few entities when streaming). After the iteration, error is True if a page
+#     could not be read (including a body cut by a connection drop or a timeout); the entities yielded until then are
+#     valid. A streamed page is timed as broker_GET from the request until its body is read, without the time spent by
+#     the caller between entities.
+class EntityPages:
+  def __init__(self, entity_type=None, page_size=None, headers=None, stream=None, **params):
+    self.entity_type = entity_type
+    self.page_size = page_size or configuration_variables.broker_query_limit
+    self.headers = headers
+    self.stream = (configuration_variables.broker_streaming if stream is None else stream) and ijson is not None
+    self.params = params
+    self.error = False
+    self.requests = 0
+
+  def __iter__(self):
+    templates = request_templates.get()
+    headers = self.headers or templates.get_headers(self.entity_type)
+    offset = 0
+    while True:
+      url = templates.query_url(type=self.entity_type, limit=self.page_size, offset=offset, **self.params)
+      count = 0
+      for entity in self.read_page(url, headers):
+        count += 1
+        yield entity
+      if self.error or count < self.page_size: return
+      offset += self.page_size
+
+  def read_page(self, url, headers):
+    self.requests += 1
+    if not self.stream:
+      response = client.request("GET", url, headers=headers, data={})
+      if response.status_code != 200: self.error = True
+      else: yield from response.json()
+      return
+
+    elapsed = 0; start = perf_counter_ns()
+    try:
+      with client.request("GET", url, headers=headers, data={}, stream=True) as response:
+        if response.status_code != 200:
+          self.error = True
+          return
+        response.raw.decode_content = True
+        try:
+          for entity in ijson.items(response.raw, "item", use_float=True):
+            elapsed += perf_counter_ns() - start; start = None
+            yield entity
+            start = perf_counter_ns()
+        except (ijson.JSONError, requests.RequestException, TransportError): # e.g. urllib3 ProtocolError/ReadTimeoutError
+          self.error = True
+    finally:
+      if start is not None: elapsed += perf_counter_ns() - start
+      instrumentation.recorder.record("broker_GET", elapsed)
+
+
+# get_entities_by_type: every entity of a type (read page by page)
+#     Params: 
+#        - entity_type: type requested
+#        - attrs: array of attributes to return (None: every attribute)
+#     Return: 
+#        - array of entities
+#        - error: boolean specifying if there have been any errors throughout the function (associated with requests to the Context Broker or external instances)
+def get_entities_by_type(entity_type, attrs=None):
+  pages = EntityPages(entity_type, attrs=attrs)
+  entities = list(pages)
 
-  # DataQualityAssessment
-  url = configuration_variables.broker_url + "entities/?type=DataQualityAssessment&limit=1000"
-  headers = {
-    'Accept': 'application/ld+json',
-    'Link': '<https://raw.githubusercontent.com/SALTED-Project/contexts/main/wrapped_contexts/dataquality-context.jsonld>;rel="http://www.w3.org/ns/json-ld#context";type="application/ld+json"'
-  }
-  response = requests.request("GET", url, headers=headers, data={})
+  if pages.error: return None, True
+  return entities, False
 
-  for i in response.json():
-    id_list.append(i['id'])
 
+# delete_entities_batch: delete several entities in a single batch request (their temporal representation is kept)
+#     Params: 
+#        - entity_ids: array of entity ids
+#     Return: 
+#        - status code -- 204 No Content / 207 Multi-Status (some entities failed)
+#        - array of (entity id, error) tuples of the entities that could not be deleted
+def delete_entities_batch(entity_ids):
+  response = client.request("POST", request_templates.get().delete, headers=request_templates.DELETE_HEADERS, data=payloads.dumps(entity_ids))
+  if response.status_code == 204: return response.status_code, []
 
-  # DELETE 
-  url = configuration_variables.broker_url + "entityOperations/delete"
-  payload = json.dumps(id_list)
-  headers = {
-    'Content-Type': 'application/ld+json'
-  }
-  response = requests.request("POST", url, headers=headers, data=payload)
-  if response.status_code != 204: print("DELETE /entities ", response.status_code)
+  if response.status_code == 207:
+    try:
+      errors = response.json().get('errors', [])
+      return response.status_code, [(i.get('entityId'), i.get('error')) for i in errors]
+    except ValueError:
+      pass
 
+  return response.status_code, [(i, response.status_code) for i in entity_ids]
 
-  # DELETE /temporal
-  for i in id_list:
-      url = configuration_variables.broker_url + "temporal/entities/"+i
-      response = requests.request("DELETE", url, headers=headers, data=payload)
-      if response.status_code != 204: print("DELETE /temporal/entities ", response.status_code)
 
+# delete_temporal_entity: delete the temporal representation of an entity
+#     Params: 
+#        - entity_id: id of the entity
+#     Return: 
+#        - status code -- 204 No Content / 404 Not Found
+def delete_temporal_entity(entity_id):
+  response = client.request("DELETE", request_templates.get().temporal_url(entity_id))
+  return response.status_code
@@ -0,0 +1,117 @@
+# Software Name: context_broker_api_async.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Asynchronous (asyncio + aiohttp) version of the context_broker_api requests used by the DQ dimensions.
+# Every function receives an AsyncBrokerClient, which must be created inside the running event loop.
+
+import aiohttp, asyncio, json
+from dateutil.relativedelta import relativedelta
+import configuration_variables
+import basic_operations
+import instrumentation
+import payloads
+import request_templates
+
+
+# AsyncBrokerClient: aiohttp session with a bounded keep-alive connection pool
+#     Params:
+#        - pool_size: maximum number of simultaneous connections
+#        - timeout: total timeout of each request in seconds
+class AsyncBrokerClient:
+  def __init__(self, pool_size=configuration_variables.broker_pool_size, timeout=configuration_variables.broker_timeout):
+    self.session = aiohttp.ClientSession(
+      connector=aiohttp.TCPConnector(limit=pool_size),
+      timeout=aiohttp.ClientTimeout(total=timeout)
+    )
+
+  # request: send a request and read the response
+  #     Connection errors, timeouts and invalid JSON bodies are not raised: the callers take their error paths.
+  #     Return:
+  #        - status code (None if the request failed)
+  #        - decoded JSON body (None if there is no body or the status code is not 200)
+  async def request(self, method, url, headers=None, data=None):
+    with instrumentation.recorder.timer("broker_async_"+method):
+      try:
+        async with self.session.request(method, url, headers=headers, data=data) as response:
+          if response.status == 200: return response.status, await response.json(content_type=None)
+          await response.read()
+          return response.status, None
+      except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return None, None
+
+  async def close(self):
+    await self.session.close()
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc):
+    await self.close()
+
+
+def get_context_headers(entity_type):
+  return request_templates.get().get_headers(entity_type)
+
+
+# upsert_entity: upsert entity into the Context Broker
+#     Return:
+#        - status code -- 201 Created / 204 No Content
+async def upsert_entity(client, body):
+  payload = payloads.dumps([body])
+  status, _ = await client.request("POST", request_templates.get().upsert, headers=request_templates.UPSERT_HEADERS, data=payload)
+  return status
+
+
+# get_entity_by_id: see context_broker_api.get_entity_by_id
+async def get_entity_by_id(client, entity_id, entity_type, attrs=None):
+  url = request_templates.get().query_url(id=entity_id, limit=configuration_variables.broker_query_limit if "," in entity_id else None, attrs=attrs)
+
+  status, body = await client.request("GET", url, headers=get_context_headers(entity_type))
+  if status == 200: return body, False
+  else: return None, True
+
+
+# get_temporal_values_by_id: see context_broker_api.get_temporal_values_by_id
+async def get_temporal_values_by_id(client, entity_id, entity_type, entity_date_string):
+  entity_date = basic_operations.get_date(entity_date_string)
+  timeAt = (entity_date - relativedelta(minutes=configuration_variables.time_window)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+  url = request_templates.get().temporal_url(entity_id, timerel="after", timeAt=timeAt, lastN=configuration_variables.lastN)
+
+  status, body = await client.request("GET", url, headers=get_context_headers(entity_type))
+  if status == 200: return body, False
+  else: return None, True
+
+
+# get_entities_by_type_geoQuery: see context_broker_api.get_entities_by_type_geoQuery
+async def get_entities_by_type_geoQuery(client, entity_type, coordinates, distance_range=None, attrs=None):
+  if distance_range is None: distance_range = configuration_variables.distance_range
+  if not isinstance(coordinates, str): coordinates = json.dumps(coordinates, separators=(",", ":"))
+
+  return await get_pages(client, entity_type, georel="near;maxDistance=="+str(distance_range), geometry="Point", coordinates=coordinates, attrs=attrs)
+
+
+# get_entities_by_type: see context_broker_api.get_entities_by_type
+async def get_entities_by_type(client, entity_type, attrs=None):
+  return await get_pages(client, entity_type, attrs=attrs)
+
+
+# get_pages: every entity of a type matching the query parameters, read page by page (see context_broker_api.EntityPages)
+async def get_pages(client, entity_type, **params):
+  templates = request_templates.get()
+  page_size = configuration_variables.broker_query_limit
+  entities = []
+
+  while True:
+    url = templates.query_url(type=entity_type, limit=page_size, offset=len(entities), **params)
+    status, body = await client.request("GET", url, headers=get_context_headers(entity_type))
+    if status != 200: return None, True
+
+    entities.extend(body)
+    if len(body) < page_size: return entities, False
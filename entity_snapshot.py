@@ -0,0 +1,137 @@
+# Software Name: entity_snapshot.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import spatial_index
+
+DATA_ATTRS = ["location", "value", "hasQuality"] # attributes read from the Temperature entities
+QUALITY_ATTRS = ["outlier"] # attributes read from the DataQualityAssessment entities
+
+# EntitySnapshot: columnar view of the Temperature entities joined with their DataQualityAssessment entities
+#     Temperature and DataQualityAssessment entities are joined through the hasQuality relationship (hash lookup by
+#     id), so the order in which the Context Broker returns each collection does not matter. Temperature entities
+#     whose quality entity is missing are kept with an unknown outlier flag and are not used as neighbours.
+#     A snapshot is immutable once built (columns and neighbour index included), so it can be shared by several
+#     threads; updated() returns a new snapshot.
+#     Params:
+#        - data_entities: array (or iterable) of Temperature entities
+#        - quality_entities: array (or iterable) of DataQualityAssessment entities, read before data_entities
+class EntitySnapshot:
+  def __init__(self, data_entities=(), quality_entities=()):
+    outliers = {}
+    for j in quality_entities:
+      outliers[j['id']] = get_outlier_flag(j)
+
+    columns = Columns()
+    for i in data_entities:
+      quality_id = i['hasQuality']['object'] if 'hasQuality' in i else None
+      columns.upsert(i['id'], i['location']['value']['coordinates'], i['value']['value'], quality_id, outliers.get(quality_id))
+    self.publish(columns)
+
+  # publish: freeze the columns of a snapshot and build its neighbour index
+  def publish(self, columns):
+    self.rows = columns.rows
+    self.ids = tuple(columns.ids); self.quality_ids = tuple(columns.quality_ids)
+    self.latitudes = tuple(columns.latitudes); self.longitudes = tuple(columns.longitudes)
+    self.values = tuple(columns.values); self.is_outlier = tuple(columns.is_outlier)
+    valid = [flag is False for flag in self.is_outlier]
+    self.index = spatial_index.NeighbourIndex(self.latitudes, self.longitudes, self.values, valid)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __contains__(self, entity_id):
+    return entity_id in self.rows
+
+  # updated: copy of the snapshot with some entities added or replaced
+  #     Params:
+  #        - updates: iterable of (entity id, coordinates, value, quality id, outlier flag), see Columns.upsert
+  #     Return:
+  #        - EntitySnapshot
+  def updated(self, updates):
+    columns = Columns(self)
+    for update in updates: columns.upsert(*update)
+
+    snapshot = EntitySnapshot.__new__(EntitySnapshot)
+    snapshot.publish(columns)
+    return snapshot
+
+  # get: row of an entity as a dictionary
+  #     Params:
+  #        - entity_id: id of the Temperature entity
+  #     Return:
+  #        - dictionary with location, value, quality id and outlier flag (None if the entity is unknown)
+  def get(self, entity_id):
+    row = self.rows.get(entity_id)
+    if row is None: return None
+
+    return {
+      "id": entity_id,
+      "hasQuality": self.quality_ids[row],
+      "latitude": self.latitudes[row],
+      "longitude": self.longitudes[row],
+      "value": self.values[row],
+      "isOutlier": self.is_outlier[row]
+    }
+
+  # neighbour_index: spatial index of the entities not flagged as outliers
+  #     Return:
+  #        - NeighbourIndex
+  def neighbour_index(self):
+    return self.index
+
+
+# Columns: rows of a snapshot being built (not shared)
+#     Params:
+#        - snapshot: EntitySnapshot whose rows are copied (None: empty)
+class Columns:
+  def __init__(self, snapshot=None):
+    if snapshot is None:
+      self.rows = {} # entity id -> row
+      self.ids = []; self.quality_ids = []
+      self.latitudes = []; self.longitudes = []; self.values = []; self.is_outlier = []
+    else:
+      self.rows = dict(snapshot.rows)
+      self.ids = list(snapshot.ids); self.quality_ids = list(snapshot.quality_ids)
+      self.latitudes = list(snapshot.latitudes); self.longitudes = list(snapshot.longitudes)
+      self.values = list(snapshot.values); self.is_outlier = list(snapshot.is_outlier)
+
+  # upsert: add or replace the row of an entity
+  #     Params:
+  #        - entity_id: id of the Temperature entity
+  #        - coordinates: location coordinates as stored in the entity ([1] latitude, [0] longitude)
+  #        - value: last observed value
+  #        - quality_id: id of the related DataQualityAssessment entity (or None)
+  #        - is_outlier: True/False, or None if unknown
+  def upsert(self, entity_id, coordinates, value, quality_id=None, is_outlier=None):
+    row = self.rows.get(entity_id)
+    if row is None:
+      self.rows[entity_id] = len(self.ids)
+      self.ids.append(entity_id); self.quality_ids.append(quality_id)
+      self.latitudes.append(coordinates[1]); self.longitudes.append(coordinates[0])
+      self.values.append(value); self.is_outlier.append(is_outlier)
+    else:
+      self.quality_ids[row] = quality_id
+      self.latitudes[row] = coordinates[1]; self.longitudes[row] = coordinates[0]
+      self.values[row] = value; self.is_outlier[row] = is_outlier
+
+
+# get_outlier_flag: outlier flag of a DataQualityAssessment entity
+#     Params:
+#        - quality_entity: DataQualityAssessment entity
+#     Return:
+#        - True/False, or None if the entity has no outlier information
+def get_outlier_flag(quality_entity):
+  try:
+    flag = quality_entity['outlier']['value']['isOutlier']['value']
+  except (KeyError, TypeError):
+    return None
+
+  if flag == "False": return False
+  elif flag == "True": return True
+  else: return None
@@ -0,0 +1,182 @@
+# Software Name: ground_truth.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import csv, threading, time
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import basic_operations
+import configuration_variables
+
+# AEMET stations used as ground truth
+SANTANDER = "1111X" # Estación AEMET Santander Ciudad
+SANTANDER_AIRPORT = "1109X" # Estación AEMET Santander Aeropuerto
+STATIONS = {
+  SANTANDER: (43.4911111,-3.8005556),
+  SANTANDER_AIRPORT: (43.4286111,-3.8313889)
+}
+TIME_ZONE = ZoneInfo("Europe/Madrid") # AEMET dates are official Spanish time
+DATE_FORMAT = "%d/%m/%Y %H:%M"
+
+
+# fetch_station_series: download the last 24h of hourly observations of an AEMET station
+#     Params:
+#        - station: AEMET station code
+#     Return:
+#        - array of (date, temperature) tuples, most recent first
+#        - error: boolean specifying if there have been any errors throughout the function (associated with requests to the Context Broker or external instances)
+def fetch_station_series(station):
+  import requests # loaded on the first download (see basic_operations)
+
+  url = configuration_variables.aemet_url + "ultimosdatos_"+station+"_datos-horarios.csv?k=can&l="+station+"&datos=det&w=0&f=temperatura&x=h24"
+  try:
+    response = requests.request("GET", url, headers={}, data={}, timeout=configuration_variables.aemet_timeout)
+  except requests.RequestException:
+    return None, True
+  if response.status_code != 200: return None, True
+
+  series = parse_station_csv(response.text)
+  if len(series) == 0: return None, True
+  return series, False
+
+
+# parse_station_csv: parse an AEMET hourly CSV (4 header lines followed by one row per hour, most recent first)
+#     Params:
+#        - text: CSV content
+#     Return:
+#        - array of (date, temperature) tuples
+def parse_station_csv(text):
+  series = []
+  for iterator, row in enumerate(csv.reader(text.splitlines())):
+    if iterator < 4 or len(row) < 2: continue
+    try:
+      series.append((row[0], float(row[1])))
+    except ValueError:
+      continue
+  return series
+
+
+# get_row_time: time of a row of an AEMET series
+#     Params:
+#        - date: date of the row (DATE_FORMAT, official Spanish time)
+#     Return:
+#        - seconds since the epoch (None if the date cannot be parsed)
+def get_row_time(date):
+  try:
+    return datetime.strptime(date, DATE_FORMAT).replace(tzinfo=TIME_ZONE).timestamp()
+  except ValueError:
+    return None
+
+
+# get_station_weight: inverse-distance weight of the Santander station for a sensor (memoised per coordinate)
+#     Params:
+#        - longitude, latitude: sensor coordinates (coords[0], coords[1] of the entity location)
+#     Return:
+#        - weight of Santander Ciudad; Santander Aeropuerto gets 1 - weight
+@lru_cache(maxsize=4096)
+def get_station_weight(longitude, latitude):
+  from geopy import distance # loaded on the first sensor (geopy is slow to import)
+
+  coordenates = (latitude, longitude)
+  distance_santander = distance.distance(STATIONS[SANTANDER], coordenates).km
+  distance_santanderairport = distance.distance(STATIONS[SANTANDER_AIRPORT], coordenates).km
+
+  total = distance_santander + distance_santanderairport
+  return 1 - (distance_santander/total)
+
+
+# AemetProvider: ground truth from AEMET stations with a cache per station
+#     AEMET publishes one row per hour, so a station series is kept until `ttl` seconds after its latest row, when the
+#     next row is due, instead of for a wall-clock hour. Until that row is published the series is downloaded again
+#     at most every `refetch_interval` seconds (also when the dates cannot be parsed). Concurrent misses of a station
+#     wait for a single download. Failed downloads are not cached.
+#     Params:
+#        - ttl: seconds after the latest row of a series during which it is served from the cache
+#        - refetch_interval: minimum seconds between downloads of a station
+#        - clock: function returning the current time in seconds since the epoch
+class AemetProvider:
+  def __init__(self, ttl=configuration_variables.aemet_cache_ttl, refetch_interval=configuration_variables.aemet_refetch_interval, clock=time.time):
+    self.ttl = ttl
+    self.refetch_interval = refetch_interval
+    self.clock = clock
+    self.cache = {} # station -> (expires_at, fetched_at, series)
+    self.hits = 0; self.misses = 0
+
+    self.lock = threading.Lock()
+    self.station_locks = {} # station -> lock held while it is downloaded
+
+  # get_series: hourly series of a station, downloaded only on a cache miss
+  #     Params:
+  #        - station: AEMET station code
+  #     Return:
+  #        - array of (date, temperature) tuples, most recent first
+  #        - error: boolean specifying if there have been any errors throughout the function (associated with requests to the Context Broker or external instances)
+  def get_series(self, station):
+    series = self.cached(station)
+    if series is not None: return series, False
+
+    with self.lock:
+      station_lock = self.station_locks.setdefault(station, threading.Lock())
+    with station_lock:
+      series = self.cached(station) # downloaded meanwhile by another thread
+      if series is not None: return series, False
+
+      with self.lock:
+        self.misses += 1
+      now = self.clock()
+      series, error = fetch_station_series(station)
+      if error: return None, True
+
+      latest = get_row_time(series[0][0])
+      expires_at = now if latest is None else latest + self.ttl
+      with self.lock:
+        self.cache[station] = (expires_at, now, series)
+      return series, False
+
+  # cached: cached series of a station (None if missing or expired)
+  def cached(self, station):
+    with self.lock:
+      entry = self.cache.get(station)
+      if entry is None: return None
+      now = self.clock()
+      if now >= entry[0] and now - entry[1] >= self.refetch_interval: return None
+      self.hits += 1
+      return entry[2]
+
+  # get_value: ground truth temperature at some coordinates (weighted mean of the last value of both stations)
+  #     Params:
+  #        - coords: entity location coordinates
+  #     Return:
+  #        - temperature, or False if no station is available
+  def get_value(self, coords):
+    weigth_santander = get_station_weight(coords[0], coords[1])
+
+    santander, santander_error = self.get_series(SANTANDER)
+    santanderairport, santanderairport_error = self.get_series(SANTANDER_AIRPORT)
+
+    if santander_error:
+      if santanderairport_error: value = False
+      else: value = santanderairport[0][1]
+    elif santanderairport_error:
+      value = santander[0][1]
+    else:
+      value = round(basic_operations.weighted_mean(santander[0][1], santanderairport[0][1], weigth_santander),2)
+
+    return value
+
+  def clear(self):
+    with self.lock:
+      self.cache = {}
+
+
+provider = AemetProvider()
+
+def get_aemet_value(coords):
+  return provider.get_value(coords)
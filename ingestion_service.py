@@ -0,0 +1,192 @@
+# Software Name: ingestion_service.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Long-running DQ tagging of live Temperature observations.
+#     Observations are queued in one bounded queue per worker thread, chosen by entity id, so the observations of an
+#     entity are assessed in arrival order while different entities are assessed in parallel. A full queue blocks the
+#     producer (backpressure) or, with a timeout, rejects the observation. Every worker computes accuracy,
+#     completeness, precision and timeliness with the DQ_dimensions_performance functions and tags the observation
+#     (Temperature + DataQualityAssessment entities) through the write buffer.
+#
+#     Usage: python ingestion_service.py --workers 8 < observations.jsonl   (one NGSI-LD Temperature entity per line)
+
+# Propietary files
+import DQ_dimensions_performance as dq
+import configuration_variables
+import instrumentation
+import outlier_detector
+import quality_state
+import snapshot_cache
+import write_buffer
+
+# Imports
+import argparse, json, queue, sys, threading, time
+import zlib
+
+
+# IngestionService: pool of workers assessing and tagging observations
+#     Params:
+#        - workers: number of worker threads (the Context Broker connection pool should be at least as large)
+#        - queue_size: maximum number of observations waiting per worker
+#        - upsert_buffer: UpsertBuffer used for tagging (None: a new started buffer, closed by close)
+class IngestionService:
+  def __init__(self, workers=configuration_variables.ingestion_workers, queue_size=configuration_variables.ingestion_queue_size, upsert_buffer=None):
+    self.queues = [queue.Queue(maxsize=queue_size) for k in range(workers)]
+    self.recorder = instrumentation.Recorder()
+
+    self.own_buffer = upsert_buffer is None
+    self.upsert_buffer = write_buffer.UpsertBuffer() if upsert_buffer is None else upsert_buffer
+    if self.own_buffer: self.upsert_buffer.start()
+    if configuration_variables.precision_fetch == "cache": snapshot_cache.cache.start()
+
+    self.lock = threading.Lock()
+    self.submitted = 0; self.rejected = 0; self.processed = 0; self.errors = 0
+    self.last_error = None
+    self.start_time = time.monotonic()
+
+    self.threads = [threading.Thread(target=self.run, args=(q,), daemon=True) for q in self.queues]
+    for thread in self.threads: thread.start()
+
+  # submit: queue an observation
+  #     Params:
+  #        - input: Temperature entity (a hasQuality relationship to dq.get_quality_id is added if it has none)
+  #        - is_outlier: outlier flag stored in its DataQualityAssessment entity (None: computed by outlier_detector
+  #          when configuration_variables.outlier_detection is True, False otherwise)
+  #        - is_synthetic: synthetic flag stored in its DataQualityAssessment entity
+  #        - timeout: seconds to wait while the queue is full (None: wait indefinitely)
+  #     Return:
+  #        - True if queued, False if rejected because the queue stayed full
+  def submit(self, input, is_outlier=None, is_synthetic=False, timeout=None):
+    if 'hasQuality' not in input:
+      input['hasQuality'] = {"type": "Relationship", "object": dq.get_quality_id(input['id'])}
+
+    shard = self.queues[zlib.crc32(input['id'].encode()) % len(self.queues)]
+    try:
+      shard.put((time.perf_counter_ns(), input, is_outlier, is_synthetic), timeout=timeout)
+    except queue.Full:
+      with self.lock: self.rejected += 1
+      return False
+
+    with self.lock: self.submitted += 1
+    return True
+
+  def run(self, shard):
+    while True:
+      item = shard.get()
+      if item is None: return
+
+      queued_at, input, is_outlier, is_synthetic = item
+      self.recorder.record("wait", time.perf_counter_ns() - queued_at)
+      try:
+        with self.recorder.timer("service"):
+          self.assess(input, is_outlier, is_synthetic)
+        with self.lock: self.processed += 1
+      except Exception as e:
+        with self.lock:
+          self.errors += 1; self.last_error = repr(e)
+      self.recorder.record("latency", time.perf_counter_ns() - queued_at)
+
+  # assess: compute the DQ dimensions of an observation and tag it
+  #     Completeness and timeliness take their default value when the entity has no previous value.
+  #     Return:
+  #        - DataQualityAssessment entity
+  def assess(self, input, is_outlier, is_synthetic):
+    if is_outlier is None: is_outlier = configuration_variables.outlier_detection and outlier_detector.detect(input) # same worker for every observation of a sensor
+
+    ground_truth = dq.accuracy_request(input)
+    accuracy = dq.accuracy_processing(input, ground_truth)
+
+    data_entity, quality_entity, error = dq.timeliness_request(input)
+    first_time = error or len(data_entity) == 0 or len(quality_entity) == 0
+
+    quality_temporal, error = dq.completeness_request(input)
+    completeness = 1 if error or first_time else dq.completeness_processing(is_synthetic, quality_temporal)
+
+    data_entities, quality_entities, error = dq.precision_request(input)
+    precision = 0 if error else dq.precision_processing(input, data_entities, quality_entities)
+
+    timeliness = 10 if first_time else dq.timeliness_processing(input, data_entity, quality_entity)
+
+    quality_input = dq.build_quality_input(input, is_outlier, is_synthetic, accuracy, timeliness, precision, completeness)
+    quality_state.store.update(input, quality_input)
+    if configuration_variables.precision_fetch == "cache": snapshot_cache.cache.update(input, quality_input)
+
+    self.upsert_buffer.add(input)
+    self.upsert_buffer.add(quality_input)
+    return quality_input
+
+  # pending: observations waiting in the queues
+  def pending(self):
+    return sum(q.qsize() for q in self.queues)
+
+  # report: counters, throughput (observations per second) and latency percentiles (seconds) since the service started
+  #     wait: time in the queue, service: assessment and tagging, latency: wait + service
+  def report(self):
+    elapsed = time.monotonic() - self.start_time
+    summary = self.recorder.summary()
+    with self.lock:
+      result = {
+        "submitted": self.submitted, "processed": self.processed, "rejected": self.rejected, "errors": self.errors,
+        "pending": self.pending(), "elapsed": elapsed,
+        "throughput": self.processed/elapsed if elapsed > 0 else 0,
+        "upsert_failures": len(self.upsert_buffer.failures)
+      }
+    for name in ["wait", "service", "latency"]:
+      if name in summary: result[name] = {key: summary[name][key] for key in ["mean", "p50", "p95", "p99"]}
+    return result
+
+  # close: process the queued observations, stop the workers and send the pending entities
+  def close(self):
+    for q in self.queues: q.put(None)
+    for thread in self.threads: thread.join()
+    if self.own_buffer: self.upsert_buffer.close()
+    else: self.upsert_buffer.flush()
+    snapshot_cache.cache.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+def print_report(report):
+  print(json.dumps(report, default=lambda x: round(x, 6)), file=sys.stderr, flush=True)
+
+
+def main():
+  arguments = argparse.ArgumentParser(description="DQ tagging of NGSI-LD Temperature entities read as JSON lines from stdin")
+  arguments.add_argument("--workers", type=int, default=configuration_variables.ingestion_workers)
+  arguments.add_argument("--queue-size", type=int, default=configuration_variables.ingestion_queue_size, help="observations waiting per worker")
+  arguments.add_argument("--report-interval", type=float, default=10, help="seconds between reports (0: only the final report)")
+  args = arguments.parse_args()
+
+  service = IngestionService(workers=args.workers, queue_size=args.queue_size)
+  stopped = threading.Event()
+  if args.report_interval > 0:
+    def run():
+      while not stopped.wait(args.report_interval): print_report(service.report())
+    threading.Thread(target=run, daemon=True).start()
+
+  for line in sys.stdin:
+    if line.strip() == "": continue
+    try:
+      input = json.loads(line)
+    except ValueError:
+      print("Invalid JSON line skipped", file=sys.stderr)
+      continue
+    service.submit(input)
+
+  service.close()
+  stopped.set()
+  print_report(service.report())
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,143 @@
+# Software Name: instrumentation.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Low-overhead timing of the DQ pipeline phases and of the Context Broker requests.
+#     Durations are measured with time.perf_counter_ns and stored in a preallocated ring buffer per series (the last
+#     `capacity` durations are kept), optionally with a log2 histogram of every duration. Timing a block costs about a
+#     microsecond (python benchmarks.py instrumentation), so the module-level recorder is left enabled.
+#
+#     with recorder.timer("accuracy_request"): ...
+
+import array, threading
+from time import perf_counter_ns
+import numpy as np
+import configuration_variables
+
+
+# Series: ring buffer of the durations (nanoseconds) of one phase
+#     Params:
+#        - capacity: number of durations kept
+#        - histogram: also count every duration in log2 buckets (bucket k: [2^(k-1), 2^k) ns)
+#     Several threads can record into the same series (e.g. the broker_* series of the module-level recorder): the
+#     slot, the count and the histogram are updated under a lock (uncontended, a fraction of the cost of a timer).
+class Series:
+  def __init__(self, capacity, histogram=False):
+    self.buffer = array.array("q", bytes(8*capacity))
+    self.capacity = capacity
+    self.count = 0
+    self.histogram = [0]*64 if histogram else None
+    self.lock = threading.Lock()
+
+  def record(self, duration):
+    with self.lock:
+      self.buffer[self.count % self.capacity] = duration
+      self.count += 1
+      if self.histogram is not None: self.histogram[min(duration.bit_length(), 63)] += 1
+
+  # values: durations kept, oldest first, in nanoseconds
+  def values(self):
+    with self.lock:
+      buffer = np.frombuffer(self.buffer, dtype=np.int64)
+      if self.count <= self.capacity: return buffer[:self.count].copy()
+      k = self.count % self.capacity
+      return np.concatenate([buffer[k:], buffer[:k]])
+
+
+# Timer: context manager recording the duration of its block into a series
+class Timer:
+  __slots__ = ("series", "start")
+
+  def __init__(self, series):
+    self.series = series
+
+  def __enter__(self):
+    self.start = perf_counter_ns()
+    return self
+
+  def __exit__(self, *exc):
+    self.series.record(perf_counter_ns() - self.start)
+
+
+class NullTimer:
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    pass
+
+null_timer = NullTimer()
+
+
+# Recorder: set of named series
+#     Params:
+#        - capacity: durations kept per series
+#        - histograms: keep a log2 histogram per series
+#        - enabled: False makes every timer a no-op
+class Recorder:
+  def __init__(self, capacity=configuration_variables.instrumentation_capacity, histograms=False, enabled=True):
+    self.capacity = capacity
+    self.histograms = histograms
+    self.enabled = enabled
+    self.series = {}
+    self.lock = threading.Lock()
+
+  def get_series(self, name):
+    series = self.series.get(name)
+    if series is None:
+      with self.lock:
+        series = self.series.setdefault(name, Series(self.capacity, self.histograms))
+    return series
+
+  def record(self, name, duration):
+    if self.enabled: self.get_series(name).record(duration)
+
+  # timer: context manager timing its block as `name`
+  def timer(self, name):
+    if not self.enabled: return null_timer
+    series = self.series.get(name)
+    return Timer(series if series is not None else self.get_series(name))
+
+  # export: durations of several series in seconds
+  #     Params:
+  #        - names: series names (e.g. simulation_storage.COLUMNS)
+  #     Return:
+  #        - array (duration, series), padded with NaN when a series has fewer durations
+  def export(self, names):
+    columns = [self.get_series(name).values()/1e9 for name in names]
+    times = np.full((max([len(c) for c in columns] or [0]), len(names)), np.nan, order="F")
+    for (k, column) in enumerate(columns):
+      times[:len(column), k] = column
+    return times
+
+  # histogram: buckets of a series
+  #     Return:
+  #        - array of (upper bound in seconds, count) of the non-empty buckets
+  def histogram(self, name):
+    series = self.get_series(name)
+    if series.histogram is None: return []
+    return [(2**k/1e9, count) for (k, count) in enumerate(series.histogram) if count != 0]
+
+  # summary: count, mean and percentiles (seconds) of the kept durations of every series
+  def summary(self):
+    result = {}
+    for name in sorted(self.series):
+      values = self.series[name].values()/1e9
+      if len(values) == 0: continue
+      p50, p95, p99 = np.percentile(values, [50, 95, 99])
+      result[name] = {"count": self.series[name].count, "mean": values.mean(), "p50": p50, "p95": p95, "p99": p99}
+    return result
+
+  def clear(self):
+    with self.lock:
+      self.series = {}
+
+
+recorder = Recorder(histograms=configuration_variables.instrumentation_histograms, enabled=configuration_variables.instrumentation_enabled)
@@ -0,0 +1,175 @@
+# Software Name: load_generator.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Open-loop load test of the DQ tagging pipeline.
+#     Unlike DQ_dimensions_performance.run_simulation (closed loop: the next observation is simulated once the
+#     previous one has been tagged), observations are emitted at wall-clock arrival times drawn from a constant,
+#     Poisson or bursty process, whatever the state of the pipeline, and assessed concurrently by an IngestionService.
+#     Each sensor emits in turn (as simulate_input with j % max_id). Every rate of a sweep is run for `duration`
+#     seconds; the pipeline is saturated at the first rate whose throughput falls below `min_efficiency` of the
+#     offered rate, whose p99 latency exceeds `max_latency` or that has rejected observations (full queues).
+#
+#     Usage: python load_generator.py --rates 5,10,20,40 --duration 30 --sensors 100 --arrivals poisson [--local]
+
+# Propietary files
+import DQ_dimensions_performance as dq
+import cleanup
+import configuration_variables
+import ingestion_service
+import outlier_detector
+import quality_state
+import snapshot_cache
+
+# Imports
+import argparse, json, random, time
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+ARRIVALS = ["constant", "poisson", "bursty"]
+
+
+# arrival_times: arrival offsets (seconds from the start) of the observations of one run
+#     Params:
+#        - arrivals: "constant" (every 1/rate seconds), "poisson" (exponential gaps) or "bursty" (bursts of
+#          burst_size simultaneous observations, the bursts following a Poisson process of rate/burst_size)
+#        - rate: mean observations per second
+#        - duration: seconds of emission
+#        - burst_size: observations per burst (bursty arrivals)
+#        - rng: numpy Generator
+#     Return:
+#        - sorted numpy array of offsets lower than duration
+def arrival_times(arrivals, rate, duration, burst_size=10, rng=None):
+  rng = np.random.default_rng() if rng is None else rng
+  expected = int(rate*duration)
+
+  if arrivals == "constant": return np.arange(expected) / rate
+  if arrivals == "poisson": return bounded(np.cumsum(rng.exponential(1/rate, size=2*expected+10)), duration)
+  if arrivals == "bursty":
+    bursts = bounded(np.cumsum(rng.exponential(burst_size/rate, size=2*expected//burst_size+10)), duration)
+    return np.repeat(bursts, burst_size)
+  raise ValueError("Unknown arrival process: " + arrivals)
+
+def bounded(offsets, duration):
+  return offsets[offsets < duration]
+
+
+# run_rate: emit the observations of one rate into a new IngestionService and wait until they are tagged
+#     Observations are submitted without blocking: an observation whose queue is full is rejected.
+#     Params:
+#        - offsets: arrival offsets (see arrival_times)
+#        - sensors: number of simulated sensors
+#        - workers, queue_size: IngestionService settings
+#        - id_prefix: prefix of the entity ids
+#     Return:
+#        - dictionary with the offered and achieved rates, the delay of the generator behind its schedule and the
+#          IngestionService report (counters and wait/service/latency percentiles in seconds)
+def run_rate(offsets, sensors, workers, queue_size, id_prefix=""):
+  lag = np.zeros(len(offsets))
+
+  with ingestion_service.IngestionService(workers=workers, queue_size=queue_size) as service:
+    start_time = time.perf_counter()
+    for j in range(len(offsets)):
+      delay = start_time + offsets[j] - time.perf_counter()
+      if delay > 0: time.sleep(delay)
+      lag[j] = time.perf_counter() - start_time - offsets[j]
+
+      input = dq.simulate_input(id_prefix+str(j % sensors), datetime.now())
+      service.submit(input, None, random.random() < 0.1, timeout=0)
+    emitted_at = time.perf_counter()
+  finished_at = time.perf_counter() # close waits for the queued observations
+
+  report = service.report()
+  elapsed = finished_at - start_time
+  report.update({
+    "emission": emitted_at - start_time, "elapsed": elapsed,
+    "throughput": report["processed"]/elapsed if elapsed > 0 else 0,
+    "lag_mean": lag.mean() if len(lag) != 0 else 0, "lag_max": lag.max() if len(lag) != 0 else 0
+  })
+  return report
+
+
+# run_sweep: run increasing rates and find the saturation point
+#     Params:
+#        - rates: array of rates (observations per second), in increasing order
+#        - arrivals, duration, burst_size: arrival process (see arrival_times)
+#        - sensors, workers, queue_size: see run_rate
+#        - max_latency: p99 latency (seconds) above which the pipeline is saturated
+#        - min_efficiency: fraction of the offered rate below which the pipeline is saturated
+#        - seed: seed of the arrival times, sensor values and flags
+#        - stop: stop the sweep at the first saturated rate
+#     Return:
+#        - DataFrame with one row per rate
+#        - saturation point: first saturated rate (None if none)
+def run_sweep(rates, arrivals="poisson", duration=30, sensors=100, workers=configuration_variables.ingestion_workers, queue_size=configuration_variables.ingestion_queue_size, burst_size=10, max_latency=1, min_efficiency=0.9, seed=None, stop=True, id_prefix="load", verbose=True):
+  rng = np.random.default_rng(seed)
+  if seed is not None: random.seed(seed)
+  rows = []; saturation = None
+
+  for rate in rates:
+    offsets = arrival_times(arrivals, rate, duration, burst_size, rng)
+    report = run_rate(offsets, sensors, workers, queue_size, id_prefix)
+
+    row = {"rate": rate, "offered": len(offsets)/duration, "submitted": report["submitted"], "processed": report["processed"],
+           "rejected": report["rejected"], "errors": report["errors"], "throughput": report["throughput"],
+           "lag_mean": report["lag_mean"], "lag_max": report["lag_max"]}
+    for name in ["wait", "service", "latency"]:
+      for key in ["mean", "p50", "p95", "p99"]: row[name+"_"+key] = report.get(name, {}).get(key, np.nan)
+    row["saturated"] = bool(report["rejected"] > 0 or row["throughput"] < min_efficiency*row["offered"] or row["latency_p99"] > max_latency)
+    rows.append(row)
+    if verbose: print(json.dumps(row, default=lambda x: round(float(x), 6)), flush=True)
+
+    # Same cleanup as the end of every simulation
+    cleanup_report = cleanup.delete_entities(id_prefix)
+    if cleanup.failures(cleanup_report) != 0: cleanup.print_report(cleanup_report)
+    quality_state.store.clear()
+    snapshot_cache.cache.clear()
+    outlier_detector.detector.clear()
+
+    if row["saturated"] and saturation is None:
+      saturation = rate
+      if stop: break
+
+  return pd.DataFrame(rows), saturation
+
+
+def main():
+  arguments = argparse.ArgumentParser(description="Open-loop load test of the DQ tagging pipeline")
+  arguments.add_argument("--rates", default="1,2,5,10,20,50", help="comma-separated observations per second, in increasing order")
+  arguments.add_argument("--arrivals", choices=ARRIVALS, default="poisson")
+  arguments.add_argument("--burst-size", type=int, default=10, help="observations per burst (bursty arrivals)")
+  arguments.add_argument("--duration", type=float, default=30, help="seconds of emission per rate")
+  arguments.add_argument("--sensors", type=int, default=100)
+  arguments.add_argument("--workers", type=int, default=configuration_variables.ingestion_workers)
+  arguments.add_argument("--queue-size", type=int, default=configuration_variables.ingestion_queue_size, help="observations waiting per worker")
+  arguments.add_argument("--max-latency", type=float, default=1, help="p99 latency (seconds) of a sustainable rate")
+  arguments.add_argument("--min-efficiency", type=float, default=0.9, help="throughput/offered rate of a sustainable rate")
+  arguments.add_argument("--precision", choices=["geo", "full", "cache"], default=None, help="precision neighbours fetch (default: configuration_variables.precision_fetch)")
+  arguments.add_argument("--seed", type=int, default=None)
+  arguments.add_argument("--all", action="store_true", help="run every rate, even after saturation")
+  arguments.add_argument("--local", action="store_true", help="run against an in-process local_broker")
+  arguments.add_argument("--output", default=None, help="CSV file with one row per rate")
+  args = arguments.parse_args()
+
+  if args.precision is not None: configuration_variables.precision_fetch = args.precision
+  if args.local:
+    import local_broker
+    broker = local_broker.start()
+    broker.configure()
+
+  rates = [float(rate) for rate in args.rates.split(",")]
+  results, saturation = run_sweep(rates, args.arrivals, args.duration, args.sensors, args.workers, args.queue_size, args.burst_size, args.max_latency, args.min_efficiency, args.seed, stop=not args.all)
+  if args.output is not None: results.to_csv(args.output, sep=";", index=False)
+
+  sustainable = results[~results["saturated"]]
+  print("Saturation point:", "not reached" if saturation is None else str(saturation)+" obs/s", "- maximum sustainable rate:", sustainable["rate"].max() if len(sustainable) != 0 else None, "obs/s")
+
+
+if __name__ == "__main__":
+  main()
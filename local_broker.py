@@ -0,0 +1,328 @@
+# Software Name: local_broker.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# In-memory stand-in of the NGSI-LD Context Broker and of the AEMET CSV service for offline benchmarking.
+#     It implements the subset of NGSI-LD used by context_broker_api (batch upsert/delete, entities by id/type with
+#     geo-query, attrs, limit/offset and count, temporal lastN/timeAt and temporal delete, tenants) and serves hourly
+#     AEMET-like CSVs with fixed temperatures. Every response can be delayed by a configurable latency (+ seeded
+#     jitter), so runs are deterministic on a single machine.
+#
+#     In process:   broker = local_broker.start(latency=0.002); broker.configure(); ...; broker.stop()
+#     Stand-alone:  python local_broker.py --port 1026 --latency 0.002
+
+import argparse, copy, json, random, sys, threading, time
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import basic_operations
+import configuration_variables
+import ground_truth
+import spatial_index
+
+NGSI_LD_PATH = "/ngsi-ld/v1/"
+AEMET_PATH = "/aemet/"
+DEFAULT_LIMIT = 20 # NGSI-LD default page size
+MAX_LIMIT = 1000
+AEMET_TEMPERATURES = {"1111X": 15.0, "1109X": 14.0}
+
+
+# BrokerState: entities and temporal instances of every tenant
+class BrokerState:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.tenants = {}
+
+  def tenant(self, name):
+    if name not in self.tenants: self.tenants[name] = {"entities": {}, "temporal": {}}
+    return self.tenants[name]
+
+  # upsert: create or update (merging attributes) several entities, keeping a temporal instance of each attribute
+  #     Return:
+  #        - ids of the created entities, (id, error) of the failed ones
+  def upsert(self, tenant, bodies, update):
+    created = []; errors = []
+    with self.lock:
+      store = self.tenant(tenant)
+      for body in bodies:
+        if not isinstance(body, dict) or 'id' not in body or 'type' not in body:
+          errors.append((body.get('id') if isinstance(body, dict) else None, "BadRequestData"))
+          continue
+
+        entity = store["entities"].get(body['id'])
+        if entity is None or not update:
+          if entity is None: created.append(body['id'])
+          entity = store["entities"][body['id']] = {}
+        entity.update(copy.deepcopy(body))
+
+        temporal = store["temporal"].setdefault(body['id'], {"type": body['type'], "attributes": {}})
+        for (name, attribute) in body.items():
+          if isinstance(attribute, dict) and attribute.get('type') in ("Property", "GeoProperty", "Relationship"):
+            temporal["attributes"].setdefault(name, []).append(copy.deepcopy(attribute))
+    return created, errors
+
+  # delete: delete several entities (current values only)
+  #     Return:
+  #        - ids not found
+  def delete(self, tenant, ids):
+    missing = []
+    with self.lock:
+      store = self.tenant(tenant)
+      for entity_id in ids:
+        if store["entities"].pop(entity_id, None) is None: missing.append(entity_id)
+    return missing
+
+  def delete_temporal(self, tenant, entity_id):
+    with self.lock:
+      return self.tenant(tenant)["temporal"].pop(entity_id, None) is not None
+
+  # query: entities filtered by id, type and geo-query
+  #     Return:
+  #        - array of matching entities (copies), in creation order
+  def query(self, tenant, ids=None, types=None, near=None):
+    with self.lock:
+      entities = list(self.tenant(tenant)["entities"].values())
+    if ids is not None: entities = [i for i in entities if i['id'] in ids]
+    if types is not None: entities = [i for i in entities if i['type'] in types]
+
+    if near is not None:
+      (longitude, latitude), max_distance = near
+      located = [i for i in entities if isinstance(i.get('location'), dict)]
+      if len(located) == 0: return []
+      distances = spatial_index.local_distances(
+        latitude, longitude,
+        [i['location']['value']['coordinates'][1] for i in located],
+        [i['location']['value']['coordinates'][0] for i in located]
+      )
+      entities = [i for (i, d) in zip(located, distances) if d <= max_distance]
+
+    return copy.deepcopy(entities)
+
+  # temporal: temporal representation of an entity (attributes with one instance are returned as an object)
+  def temporal(self, tenant, entity_id, time_at=None, lastN=None, attrs=None):
+    with self.lock:
+      temporal = self.tenant(tenant)["temporal"].get(entity_id)
+      if temporal is None: return None
+      temporal = copy.deepcopy(temporal)
+
+    entity = {"id": entity_id, "type": temporal["type"]}
+    for (name, instances) in temporal["attributes"].items():
+      if attrs is not None and name not in attrs: continue
+      if time_at is not None:
+        instances = [i for i in instances if 'observedAt' in i and basic_operations.get_timestamp(i['observedAt']) > time_at]
+      if lastN is not None: instances = instances[-lastN:]
+      if len(instances) == 1: entity[name] = instances[0]
+      elif len(instances) > 1: entity[name] = instances
+    return entity
+
+
+# aemet_csv: AEMET-like hourly CSV (4 header lines, then 24 rows most recent first, official Spanish time) with a constant
+#     temperature
+def aemet_csv(station, temperature):
+  now = datetime.now(ground_truth.TIME_ZONE).replace(minute=0, second=0, microsecond=0)
+  lines = [
+    '"Estación: '+station+'"', '"Últimas observaciones"', '', '"Fecha y hora oficial","Temperatura (ºC)"'
+  ]
+  for hour in range(24):
+    lines.append('"'+(now - timedelta(hours=hour)).strftime('%d/%m/%Y %H:%M')+'","'+str(temperature)+'"')
+  return "\n".join(lines)
+
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  disable_nagle_algorithm = True
+  wbufsize = -1 # headers and body are sent together
+
+  def log_message(self, *args):
+    pass
+
+  def send(self, status, body=None, headers=None, content_type="application/ld+json"):
+    self.server.delay()
+    payload = b"" if body is None else (body if isinstance(body, bytes) else json.dumps(body).encode())
+    self.send_response(status)
+    if len(payload) != 0: self.send_header("Content-Type", content_type)
+    for (name, value) in (headers or {}).items(): self.send_header(name, value)
+    self.send_header("Content-Length", str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload)
+
+  def read_body(self):
+    length = int(self.headers.get("Content-Length", 0))
+    if length == 0: return None
+    return json.loads(self.rfile.read(length))
+
+  def route(self):
+    url = urlsplit(self.path)
+    params = {key: values[-1] for (key, values) in parse_qs(url.query).items()}
+    tenant = self.headers.get("NGSILD-Tenant", "")
+    return url.path, params, tenant
+
+  def do_GET(self):
+    path, params, tenant = self.route()
+    state = self.server.state
+
+    if path.startswith(AEMET_PATH):
+      station = next((i for i in self.server.aemet if i in path), None)
+      if station is None: return self.send(404)
+      return self.send(200, aemet_csv(station, self.server.aemet[station]).encode("utf-8"), content_type="text/csv")
+
+    if path.startswith(NGSI_LD_PATH + "temporal/entities/"):
+      entity_id = unquote(path[len(NGSI_LD_PATH + "temporal/entities/"):])
+      time_at = basic_operations.get_timestamp(params["timeAt"]) if params.get("timerel") == "after" and "timeAt" in params else None
+      lastN = int(params["lastN"]) if "lastN" in params else None
+      attrs = params["attrs"].split(",") if "attrs" in params else None
+      entity = state.temporal(tenant, entity_id, time_at, lastN, attrs)
+      if entity is None: return self.send(404, {"type": "https://uri.etsi.org/ngsi-ld/errors/ResourceNotFound", "title": "Entity not found"})
+      return self.send(200, entity)
+
+    if path.startswith(NGSI_LD_PATH + "entities/") and path != NGSI_LD_PATH + "entities/":
+      entity_id = unquote(path[len(NGSI_LD_PATH + "entities/"):])
+      entities = state.query(tenant, ids={entity_id})
+      if len(entities) == 0: return self.send(404, {"type": "https://uri.etsi.org/ngsi-ld/errors/ResourceNotFound", "title": "Entity not found"})
+      return self.send(200, project(entities[0], params))
+
+    if path in (NGSI_LD_PATH + "entities/", NGSI_LD_PATH + "entities"):
+      ids = set(params["id"].split(",")) if "id" in params else None
+      types = set(params["type"].split(",")) if "type" in params else None
+      if ids is None and types is None and "georel" not in params: return self.send(400, {"type": "https://uri.etsi.org/ngsi-ld/errors/BadRequestData", "title": "Too broad query"})
+
+      near = None
+      if "georel" in params:
+        try:
+          max_distance = float(params["georel"].split("maxDistance==")[1])
+          near = (json.loads(params["coordinates"]), max_distance)
+        except (IndexError, KeyError, ValueError):
+          return self.send(400, {"type": "https://uri.etsi.org/ngsi-ld/errors/BadRequestData", "title": "Invalid geo-query"})
+
+      entities = state.query(tenant, ids, types, near)
+      limit = min(int(params.get("limit", self.server.default_limit)), MAX_LIMIT)
+      offset = int(params.get("offset", 0))
+      page = [project(i, params) for i in entities[offset:offset+limit]]
+
+      headers = {"NGSILD-Results-Count": str(len(entities))} if params.get("count") == "true" else None
+      return self.send(200, page, headers)
+
+    self.send(404)
+
+  def do_POST(self):
+    path, params, tenant = self.route()
+    state = self.server.state
+    try:
+      body = self.read_body()
+    except ValueError:
+      return self.send(400, {"type": "https://uri.etsi.org/ngsi-ld/errors/InvalidRequest", "title": "Invalid JSON"})
+
+    if path == NGSI_LD_PATH + "entityOperations/upsert":
+      created, errors = state.upsert(tenant, body or [], params.get("options") == "update")
+      if len(errors) != 0:
+        succeeded = [i['id'] for i in body if isinstance(i, dict) and 'id' in i and i['id'] not in [e[0] for e in errors]]
+        return self.send(207, {"success": succeeded, "errors": [{"entityId": e[0], "error": {"type": "https://uri.etsi.org/ngsi-ld/errors/"+e[1]}} for e in errors]}, content_type="application/json")
+      if len(created) != 0: return self.send(201, created, content_type="application/json")
+      return self.send(204)
+
+    if path == NGSI_LD_PATH + "entityOperations/delete":
+      missing = state.delete(tenant, body or [])
+      if len(missing) != 0:
+        return self.send(207, {"success": [i for i in body if i not in missing], "errors": [{"entityId": i, "error": {"type": "https://uri.etsi.org/ngsi-ld/errors/ResourceNotFound"}} for i in missing]}, content_type="application/json")
+      return self.send(204)
+
+    self.send(404)
+
+  def do_DELETE(self):
+    path, params, tenant = self.route()
+    if self.headers.get("Content-Length"): self.rfile.read(int(self.headers["Content-Length"]))
+
+    if path.startswith(NGSI_LD_PATH + "temporal/entities/"):
+      entity_id = unquote(path[len(NGSI_LD_PATH + "temporal/entities/"):])
+      return self.send(204 if self.server.state.delete_temporal(tenant, entity_id) else 404)
+
+    self.send(404)
+
+
+# project: keep only the attributes requested with attrs= (plus id, type and @context)
+def project(entity, params):
+  if "attrs" not in params: return entity
+  attrs = set(params["attrs"].split(","))
+  return {key: value for (key, value) in entity.items() if key in ("id", "type", "@context") or key in attrs}
+
+
+# LocalBroker: HTTP server running the stand-in in a background thread
+#     Params:
+#        - host, port: address to listen on (port 0: any free port)
+#        - latency: delay in seconds added to every response
+#        - jitter: maximum extra delay in seconds, drawn from a seeded uniform distribution
+#        - seed: seed of the jitter
+#        - default_limit: page size when the request has no limit
+#        - aemet: temperature served for each AEMET station
+class LocalBroker(ThreadingHTTPServer):
+  daemon_threads = True
+
+  def __init__(self, host="127.0.0.1", port=0, latency=0, jitter=0, seed=0, default_limit=DEFAULT_LIMIT, aemet=AEMET_TEMPERATURES):
+    super().__init__((host, port), Handler)
+    self.state = BrokerState()
+    self.latency = latency; self.jitter = jitter
+    self.random = random.Random(seed); self.random_lock = threading.Lock()
+    self.default_limit = default_limit
+    self.aemet = dict(aemet)
+    self.thread = None
+
+    self.url = "http://"+self.server_address[0]+":"+str(self.server_address[1])+NGSI_LD_PATH
+    self.aemet_url = "http://"+self.server_address[0]+":"+str(self.server_address[1])+AEMET_PATH
+
+  def handle_error(self, request, client_address):
+    # Clients closing keep-alive connections are not errors
+    if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+      super().handle_error(request, client_address)
+
+  def delay(self):
+    delay = self.latency
+    if self.jitter:
+      with self.random_lock: delay = delay + self.random.uniform(0, self.jitter)
+    if delay > 0: time.sleep(delay)
+
+  # configure: point configuration_variables (broker_url and aemet_url) to this stand-in
+  def configure(self):
+    configuration_variables.broker_url = self.url
+    configuration_variables.aemet_url = self.aemet_url
+
+  def start(self):
+    self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+
+def start(**kwargs):
+  return LocalBroker(**kwargs).start()
+
+
+def main():
+  arguments = argparse.ArgumentParser(description="In-memory NGSI-LD Context Broker and AEMET stand-in")
+  arguments.add_argument("--host", default="127.0.0.1")
+  arguments.add_argument("--port", type=int, default=1026)
+  arguments.add_argument("--latency", type=float, default=0, help="delay added to every response (seconds)")
+  arguments.add_argument("--jitter", type=float, default=0, help="maximum extra random delay (seconds)")
+  arguments.add_argument("--seed", type=int, default=0)
+  arguments.add_argument("--default-limit", type=int, default=DEFAULT_LIMIT)
+  args = arguments.parse_args()
+
+  broker = LocalBroker(args.host, args.port, args.latency, args.jitter, args.seed, args.default_limit)
+  print("broker_url =", broker.url)
+  print("aemet_url =", broker.aemet_url)
+  try:
+    broker.serve_forever()
+  except KeyboardInterrupt:
+    broker.server_close()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,111 @@
+# Software Name: montecarlo_runner.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Parallel runner of the DQ_dimensions_performance Monte Carlo simulations.
+#     Simulations run in a pool of processes. Every simulation uses its own entity id prefix (sim<N>:) and, unless
+#     --shared-tenant is given, its own NGSI-LD tenant, so that the entity listings (precision neighbours) of a
+#     simulation only return its own entities and the final cleanup only deletes them. Simulation N is seeded with
+#     seed + N, and simulations whose folder already contains all their results are skipped, so an interrupted (or
+#     failed) campaign can be resumed by running the same command again.
+#
+#     Usage: python montecarlo_runner.py --simulations 60 --workers 8
+#            python montecarlo_runner.py --simulations 4 --local-broker --latency 0.002   (offline, see local_broker.py)
+
+# Propietary files
+import DQ_dimensions_performance as dq
+import cleanup
+import context_broker_api
+import configuration_variables
+import local_broker
+import simulation_storage
+
+# Imports
+import argparse, os, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# run_worker: run one simulation in a worker process
+#     The entities of the simulation left in its tenant by a previous failed run are deleted first.
+#     Return:
+#        - simulation number and elapsed time in seconds
+def run_worker(i, folder_name, nsim, max_id, window, seconds_gen, seed, tenant, broker_url=None, aemet_url=None, storage="npy", precision_fetch=None):
+  start_time = time.time()
+  if precision_fetch is not None: configuration_variables.precision_fetch = precision_fetch
+  if broker_url is not None: configuration_variables.broker_url = broker_url
+  if aemet_url is not None: configuration_variables.aemet_url = aemet_url
+  if tenant is not None:
+    context_broker_api.client = context_broker_api.BrokerClient(tenant=tenant+str(i))
+
+  id_prefix = "sim"+str(i)+":"
+  report = cleanup.delete_entities(id_prefix)
+  if cleanup.failures(report) != 0:
+    cleanup.print_report(report)
+    raise RuntimeError("the entities of a previous run could not be deleted")
+
+  dq.run_simulation(i, folder_name, nsim=nsim, max_id=max_id, window=window, seconds_gen=seconds_gen, id_prefix=id_prefix, seed=seed+i, storage=storage)
+  return i, time.time() - start_time
+
+
+def get_arguments():
+  arguments = argparse.ArgumentParser(description="Parallel Monte Carlo simulations of the DQ dimensions performance")
+  arguments.add_argument("--simulations", type=int, default=60, help="number of simulations")
+  arguments.add_argument("--first", type=int, default=0, help="number of the first simulation")
+  arguments.add_argument("--observations", type=int, default=10000, help="observations per simulation (nsim)")
+  arguments.add_argument("--entities", type=int, default=100, help="different entities per simulation (max_id)")
+  arguments.add_argument("--window", type=int, default=120, help="window in minutes")
+  arguments.add_argument("--seconds-gen", type=float, default=1.2, help="seconds between observations")
+  arguments.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+  arguments.add_argument("--seed", type=int, default=0, help="base seed (simulation N uses seed + N)")
+  arguments.add_argument("--tenant", default="sim", help="run simulation N in the NGSI-LD tenant <tenant><N>")
+  arguments.add_argument("--shared-tenant", action="store_true", help="run every simulation in the default tenant (the precision neighbours include the entities of the other simulations)")
+  arguments.add_argument("--output", default="simulations", help="folder containing the simN folders")
+  arguments.add_argument("--precision", choices=["geo", "full", "cache"], default=None, help="precision neighbours fetch (default: configuration_variables.precision_fetch)")
+  arguments.add_argument("--storage", choices=simulation_storage.FORMATS, default="npy", help="format of the results (csv: as read by main.m)")
+  arguments.add_argument("--local-broker", action="store_true", help="run against an in-memory broker/AEMET stand-in (local_broker.py)")
+  arguments.add_argument("--latency", type=float, default=0, help="latency of the local broker responses (seconds)")
+  arguments.add_argument("--jitter", type=float, default=0, help="maximum extra random latency of the local broker (seconds)")
+  return arguments.parse_args()
+
+
+def main():
+  args = get_arguments()
+
+  pending = []
+  for i in range(args.first, args.first + args.simulations):
+    folder_name = os.path.join(args.output, "sim"+str(i))
+    if dq.is_completed(folder_name): print("sim"+str(i), "already completed, skipped")
+    else: pending.append((i, folder_name))
+
+  broker = None; broker_url = None; aemet_url = None
+  if args.local_broker:
+    broker = local_broker.start(latency=args.latency, jitter=args.jitter, seed=args.seed)
+    broker_url = broker.url; aemet_url = broker.aemet_url
+
+  tenant = None if args.shared_tenant else args.tenant
+  start_time = time.time(); failed = 0
+  with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(pending) or 1))) as executor:
+    futures = {
+      executor.submit(run_worker, i, folder_name, args.observations, args.entities, args.window, args.seconds_gen, args.seed, tenant, broker_url, aemet_url, args.storage, args.precision): i
+      for (i, folder_name) in pending
+    }
+    for future in as_completed(futures):
+      try:
+        i, elapsed = future.result()
+      except Exception as e: # the other simulations go on; the failed one is run again on resume
+        failed += 1
+        print("sim"+str(futures[future]), "failed:", repr(e))
+        continue
+      print("sim"+str(i), "completed in", round(elapsed, 1), "s")
+
+  print(len(pending) - failed, "simulations in", round(time.time() - start_time, 1), "s" + (", " + str(failed) + " failed" if failed != 0 else ""))
+  if broker is not None: broker.stop()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,143 @@
+# Software Name: outlier_detector.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Online outlier flag (outlier.isOutlier of the DataQualityAssessment entities) of every observation of a sensor.
+#
+#     Usage: python outlier_detector.py [--csv observations.csv]   (replay throughput; synthetic data without --csv)
+
+import argparse, math, random, time
+
+import configuration_variables
+
+
+# OutlierDetector: per-sensor EWMA z-score
+#     Every sensor keeps the number of observations and the exponentially weighted mean and variance of its values
+#     (three numbers, O(1) per observation). An observation is an outlier when it is more than `threshold` standard
+#     deviations away from the mean of the previous observations, once the sensor has `warmup` of them. The mean and
+#     variance are updated with the value clipped to mean +- threshold*std, so a spike barely moves them while a
+#     level shift is followed in a few observations.
+#     Params:
+#        - alpha: weight of the new observation in the mean and variance (0 < alpha <= 1)
+#        - threshold: z-score above which an observation is an outlier
+#        - warmup: observations of a sensor before any of them can be an outlier
+#        - min_std: lower bound of the standard deviation (sensor resolution), so a flat sensor is not flagged on every change
+class OutlierDetector:
+  def __init__(self, alpha=configuration_variables.outlier_alpha, threshold=configuration_variables.outlier_threshold, warmup=configuration_variables.outlier_warmup, min_std=configuration_variables.outlier_min_std):
+    self.alpha = alpha
+    self.threshold = threshold
+    self.warmup = warmup
+    self.min_variance = min_std**2
+    self.sensors = {} # entity id -> [observations, mean, variance]
+
+  def __len__(self):
+    return len(self.sensors)
+
+  # add: add an observation and compute its outlier flag
+  #     Params:
+  #        - entity_id: id of the sensor (Temperature entity)
+  #        - value: observed value
+  #     Return:
+  #        - True if the observation is an outlier
+  def add(self, entity_id, value):
+    state = self.sensors.get(entity_id)
+    if state is None:
+      self.sensors[entity_id] = [1, value, 0.0]
+      return False
+
+    count, mean, variance = state
+    deviation = value - mean
+    limit = self.threshold*math.sqrt(max(variance, self.min_variance))
+    is_outlier = count >= self.warmup and abs(deviation) > limit
+
+    if deviation > limit: deviation = limit
+    elif deviation < -limit: deviation = -limit
+    state[0] = count + 1
+    state[1] = mean + self.alpha*deviation
+    state[2] = (1-self.alpha)*(variance + self.alpha*deviation*deviation)
+    return is_outlier
+
+  # process: outlier flag of every observation of a stream
+  #     Params:
+  #        - stream: iterable of (entity id, value)
+  #     Return:
+  #        - generator of flags, one per observation
+  def process(self, stream):
+    for (entity_id, value) in stream:
+      yield self.add(entity_id, value)
+
+  def clear(self):
+    self.sensors = {}
+
+
+detector = OutlierDetector()
+
+
+# detect: outlier flag of a Temperature entity with the shared detector
+def detect(input):
+  return detector.add(input['id'], input['value']['value'])
+
+
+# synthetic_stream: replay-like observations (hourly cycle + noise) of several sensors with injected spikes
+#     Return:
+#        - array of (entity id, value) in arrival order
+#        - array of booleans, True for the injected spikes
+def synthetic_stream(observations=200000, sensors=100, spikes=0.01, seed=0):
+  generator = random.Random(seed)
+  offsets = [generator.uniform(10, 20) for k in range(sensors)]
+  stream = []; injected = []
+  for k in range(observations):
+    sensor = k % sensors; step = k // sensors
+    value = offsets[sensor] + 3*math.sin(2*math.pi*step/720) + generator.gauss(0, 0.3)
+    spike = step >= 20 and generator.random() < spikes
+    if spike: value += generator.choice([-1, 1])*generator.uniform(5, 15)
+    stream.append(("urn:x-iot:u7jcfa:"+str(sensor), round(value, 2))); injected.append(spike)
+  return stream, injected
+
+
+# read_stream: observations of a CSV with the columns id, timestamp and value (e.g. the raw_data dataset), in timestamp order
+def read_stream(path):
+  import pandas as pd
+  df = pd.read_csv(path, usecols=["id", "timestamp", "value"]).dropna(subset=["value"])
+  df = df.sort_values("timestamp", kind="stable")
+  return list(zip(df["id"].astype(str).tolist(), df["value"].astype(float).tolist()))
+
+
+# replay: flag every observation of a stream with a new detector
+#     Return:
+#        - array of flags
+#        - observations per second
+def replay(stream, **kwargs):
+  engine = OutlierDetector(**kwargs)
+  start_time = time.perf_counter()
+  flags = list(engine.process(stream))
+  elapsed = time.perf_counter() - start_time
+  return flags, len(stream)/elapsed if elapsed > 0 else math.inf
+
+
+def main():
+  arguments = argparse.ArgumentParser(description="Throughput of the online outlier detector over a replay of observations")
+  arguments.add_argument("--csv", default=None, help="CSV with the columns id, timestamp and value (default: synthetic observations)")
+  arguments.add_argument("--observations", type=int, default=200000, help="synthetic observations")
+  arguments.add_argument("--sensors", type=int, default=100, help="synthetic sensors")
+  args = arguments.parse_args()
+
+  if args.csv is not None:
+    stream = read_stream(args.csv); injected = None
+  else:
+    stream, injected = synthetic_stream(args.observations, args.sensors)
+
+  flags, throughput = replay(stream)
+  print("{} observations of {} sensors: {:.0f} obs/s ({:.3f} us/obs), {} outliers".format(len(stream), len(set(entity_id for (entity_id, _) in stream)), throughput, 1e6/throughput, sum(flags)))
+  if injected is not None:
+    detected = sum(1 for (flag, spike) in zip(flags, injected) if flag and spike)
+    print("injected spikes: {}, recall {:.3f}, precision {:.3f}".format(sum(injected), detected/max(sum(injected), 1), detected/max(sum(flags), 1)))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,29 @@
+# Software Name: payloads.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Serialisation of the Temperature and DataQualityAssessment entities sent to the Context Broker (orjson when it is
+# installed, json otherwise).
+
+import json
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+
+# dumps: JSON bytes of a dictionary/array (e.g. a batch of entities)
+if orjson is not None:
+  def dumps(obj):
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+else:
+  encoder = json.JSONEncoder(separators=(",", ":"), check_circular=False) # built once (json.dumps builds one per call with separators)
+
+  def dumps(obj):
+    return encoder.encode(obj).encode()
@@ -0,0 +1,89 @@
+# Software Name: quality_state.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+from collections import deque
+
+import basic_operations
+import configuration_variables
+
+
+class EntityState:
+  __slots__ = ("last_date", "last_timeliness", "synthetic")
+
+  def __init__(self, lastN):
+    self.last_date = None # dateModified of the last Temperature value
+    self.last_timeliness = None # timeliness of the last DataQualityAssessment
+    self.synthetic = deque(maxlen=lastN) # (timestamp, isSynthetic) of the last lastN assessments
+
+
+# QualityStateStore: per-entity state of the assessments made by this process
+#     It holds what completeness and timeliness would otherwise read back from the Context Broker (the last lastN
+#     isSynthetic flags and the last dateModified/timeliness), so they are answered in O(1) without network I/O.
+#     Entities not assessed yet by this process are unknown (cold start) and must be read from the broker.
+#     Params:
+#        - lastN: maximum number of previous isSynthetic flags (as in the temporal request)
+#        - time_window: minutes of history considered by completeness
+class QualityStateStore:
+  def __init__(self, lastN=configuration_variables.lastN, time_window=configuration_variables.time_window):
+    self.lastN = lastN
+    self.time_window = time_window
+    self.entities = {} # Temperature entity id -> EntityState
+
+  def __len__(self):
+    return len(self.entities)
+
+  def clear(self):
+    self.entities = {}
+
+  # update: record the tagging of an input
+  #     Params:
+  #        - input: Temperature entity
+  #        - quality_input: DataQualityAssessment entity of the input
+  def update(self, input, quality_input):
+    state = self.entities.get(input['id'])
+    if state is None:
+      state = self.entities[input['id']] = EntityState(self.lastN)
+
+    date = input['dateModified']['value']
+    state.last_date = date
+    state.last_timeliness = quality_input['timeliness']['value']
+    state.synthetic.append((basic_operations.get_timestamp(date), quality_input['synthetic']['value']['isSynthetic']['value']))
+
+  # get_quality_temporal: previous isSynthetic values of the input within time_window, shaped as the temporal response
+  #     Params:
+  #        - input: Temperature entity
+  #     Return:
+  #        - temporal entity with the synthetic attribute as an array (an object if there is a single value, as the
+  #          Context Broker returns it), or None if the entity is unknown
+  def get_quality_temporal(self, input):
+    state = self.entities.get(input['id'])
+    if state is None: return None
+
+    time_at = basic_operations.get_timestamp(input['dateModified']['value']) - self.time_window*60
+    synthetic = [{'value': {'isSynthetic': {'value': flag}}} for (timestamp, flag) in state.synthetic if timestamp > time_at]
+    return {
+      'id': input['hasQuality']['object'],
+      'synthetic': synthetic[0] if len(synthetic) == 1 else synthetic
+    }
+
+  # get_last_entities: last Temperature and DataQualityAssessment values of the input, with the attributes used by timeliness
+  #     Params:
+  #        - input: Temperature entity
+  #     Return:
+  #        - data entity and quality entity, or (None, None) if the entity is unknown
+  def get_last_entities(self, input):
+    state = self.entities.get(input['id'])
+    if state is None: return None, None
+
+    data_entity = {'id': input['id'], 'dateModified': {'value': state.last_date}}
+    quality_entity = {'id': input['hasQuality']['object'], 'timeliness': {'value': state.last_timeliness}}
+    return data_entity, quality_entity
+
+
+store = QualityStateStore()
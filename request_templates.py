@@ -0,0 +1,103 @@
+# Software Name: request_templates.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# URLs and headers of the Context Broker requests, shared by context_broker_api and context_broker_api_async.
+#     The Link/Accept headers of every entity type and the URL prefixes are computed once per broker_url (the
+#     templates are rebuilt if configuration_variables.broker_url changes, e.g. when using local_broker.py). Ids and
+#     query values are URL-encoded (memoized).
+
+from functools import lru_cache
+from urllib.parse import quote
+import configuration_variables
+
+QUERY_SAFE = ",:=" # lists of ids/attributes, URNs and dates, georel (near;maxDistance==d)
+JSON_LD_CONTEXT_REL = 'rel="http://www.w3.org/ns/json-ld#context"'
+
+UPSERT_HEADERS = {'Content-Type': 'application/ld+json'}
+DELETE_HEADERS = {'Content-Type': 'application/ld+json'}
+
+# @context of the entities as upserted (used to list them for the cleanup)
+ENTITY_CONTEXTS = {
+  "Temperature": "https://raw.githubusercontent.com/SALTED-Project/contexts/main/wrapped_contexts/energycim-context.jsonld",
+  "DataQualityAssessment": "https://raw.githubusercontent.com/SALTED-Project/contexts/main/wrapped_contexts/dataquality-context.jsonld"
+}
+
+
+# RequestTemplates: URL prefixes and headers for one broker_url
+#     Params:
+#        - broker_url: NGSI-LD API URL (ending with /ngsi-ld/v1/)
+#        - base_context: URL of the folder of the @context files
+#        - types: entity types with their own @context file
+class RequestTemplates:
+  def __init__(self, broker_url, base_context, types):
+    self.broker_url = broker_url
+    self.types = frozenset(types)
+
+    self.entities = broker_url + "entities/"
+    self.temporal = broker_url + "temporal/entities/"
+    self.upsert = broker_url + "entityOperations/upsert?options=update"
+    self.delete = broker_url + "entityOperations/delete"
+
+    self.headers = {entity_type: context_headers(base_context+entity_type.lower()+'-context.jsonld') for entity_type in self.types}
+    self.default_headers = context_headers(base_context + "default-context.jsonld")
+    self.entity_headers = {entity_type: context_headers(context_link, ';type="application/ld+json"') for (entity_type, context_link) in ENTITY_CONTEXTS.items()}
+
+  # get_headers: Accept and Link headers of an entity type (shared dictionary, do not modify)
+  def get_headers(self, entity_type):
+    return self.headers.get(entity_type, self.default_headers)
+
+  # entity_url: URL of an entity (entities/<id>)
+  def entity_url(self, entity_id):
+    return self.entities + quote_id(entity_id)
+
+  # temporal_url: URL of the temporal representation of an entity, with optional query parameters
+  def temporal_url(self, entity_id, **params):
+    return self.temporal + quote_id(entity_id) + query_string(params)
+
+  # query_url: URL of an entities query (entities/?param=value&...)
+  def query_url(self, **params):
+    return self.entities + query_string(params)
+
+
+def context_headers(context_link, suffix=""):
+  return {
+    'Accept': 'application/ld+json',
+    'Link': '<'+context_link+'>;'+JSON_LD_CONTEXT_REL+suffix
+  }
+
+
+# query_string: "?key=value&..." of the parameters that are not None (values URL-encoded, lists joined with commas)
+def query_string(params):
+  items = []
+  for (key, value) in params.items():
+    if value is None: continue
+    if isinstance(value, (list, tuple, set, frozenset)): value = ",".join(value)
+    items.append(key + "=" + quote_value(value if isinstance(value, str) else str(value)))
+  return "?" + "&".join(items) if len(items) != 0 else ""
+
+
+# quote_id, quote_value: URL-encoded id (path segment) and query value, memoized (ids, dates and parameters repeat)
+@lru_cache(maxsize=65536)
+def quote_id(entity_id):
+  return quote(entity_id, safe=":")
+
+@lru_cache(maxsize=65536)
+def quote_value(value):
+  return quote(value, safe=QUERY_SAFE)
+
+
+templates = None
+
+# get: templates of the current configuration_variables.broker_url
+def get():
+  global templates
+  current = templates
+  if current is None or current.broker_url != configuration_variables.broker_url:
+    current = templates = RequestTemplates(configuration_variables.broker_url, configuration_variables.base_context, configuration_variables.types.split(","))
+  return current
@@ -0,0 +1,94 @@
+# Software Name: simulation_statistics.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Python version of the main.m post-processing of the Monte Carlo simulations.
+#     The request/processing times of every simulations/simN folder (times.npy or CSVs, see simulation_storage.py) are
+#     read into one array per dimension (phase x observation x simulation). As in main.m, the per-observation mean across simulations gives the
+#     steady-state mean and standard deviation (after a warm-up of each dimension), and the per-observation medians are
+#     written to simulations/median_values/<dimension>_median.csv for the DQ_dimensions_performance notebook.
+#     Percentiles (p50/p95/p99) of the steady-state times of all simulations are added to statistics.csv.
+#
+#     Usage: python simulation_statistics.py [--simulations simulations] [--output simulations/median_values]
+
+import argparse, os
+import numpy as np
+import pandas as pd
+
+from simulation_storage import Campaign, DIMENSIONS
+
+PHASES = ["requesting", "processing", "total"]
+PERCENTILES = [50, 95, 99]
+
+# First steady-state observation of each dimension (0-based; main.m uses 1-based 1, 6000, 100 and 100)
+WARMUP = {"accuracy": 0, "completeness": 5999, "precision": 99, "timeliness": 99}
+
+
+# read_dimension: times of one dimension in every simulation of a campaign (see simulation_storage.Campaign)
+#     Return:
+#        - array (phase, observation, simulation) with the requesting, processing and total times in seconds
+def read_dimension(campaign, dimension):
+  requesting = campaign.column(dimension+"_request")
+  processing = campaign.column(dimension+"_processing")
+  return np.stack([requesting, processing, requesting + processing])
+
+
+# get_statistics: main.m metrics of one dimension
+#     Return:
+#        - dictionary phase -> {mean, std, p50, p95, p99}
+#        - array (observation, phase) of the medians across simulations
+def get_statistics(times, warmup):
+  warmup = min(warmup, times.shape[1] - 1)
+  statistics = {}
+  for (k, phase) in enumerate(PHASES):
+    average = np.nanmean(times[k], axis=1)[warmup:]
+    steady = times[k, warmup:]
+    steady = steady[~np.isnan(steady)]
+    statistics[phase] = {
+      "mean": np.mean(average),
+      "std": np.std(average, ddof=1) if len(average) > 1 else 0.0
+    }
+    for (p, value) in zip(PERCENTILES, np.percentile(steady, PERCENTILES)):
+      statistics[phase]["p"+str(p)] = value
+
+  medians = np.nanmedian(times, axis=2).T
+  return statistics, medians
+
+
+def main():
+  arguments = argparse.ArgumentParser(description="Performance metrics of the Monte Carlo simulations (main.m in Python)")
+  arguments.add_argument("--simulations", default="simulations", help="folder containing the simN folders")
+  arguments.add_argument("--output", default=os.path.join("simulations", "median_values"))
+  args = arguments.parse_args()
+
+  campaign = Campaign(args.simulations)
+  if len(campaign) == 0: raise SystemExit("No completed simulations in " + args.simulations)
+  os.makedirs(args.output, exist_ok=True)
+
+  rows = []
+  for dimension in DIMENSIONS:
+    statistics, medians = get_statistics(read_dimension(campaign, dimension), WARMUP[dimension])
+    pd.DataFrame(medians, columns=PHASES).to_csv(os.path.join(args.output, dimension+"_median.csv"), sep=";", index=False, float_format="%.15g")
+
+    for phase in PHASES:
+      rows.append(dict({"dimension": dimension, "phase": phase}, **statistics[phase]))
+
+  # Complete pipeline (sum of the four dimensions, as in main.m)
+  df = pd.DataFrame(rows)
+  for phase in ["requesting", "processing"]:
+    selected = df[df["phase"] == phase]
+    rows.append({"dimension": "pipeline", "phase": phase, "mean": selected["mean"].sum(), "std": selected["std"].sum()})
+
+  df = pd.DataFrame(rows)
+  df.to_csv(os.path.join(args.output, "statistics.csv"), sep=";", index=False, float_format="%.15g")
+  print(len(campaign), "simulations")
+  print(df.to_string(index=False))
+
+
+if __name__ == "__main__":
+  main()
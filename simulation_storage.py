@@ -0,0 +1,122 @@
+# Software Name: simulation_storage.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+# Storage of the timing results of the Monte Carlo simulations.
+#     A simulation records its times into one float64 array (observation x COLUMNS), stored column-major
+#     so that every column is contiguous. It is saved as simN/times.npy together with simN/metadata.json (parameters of
+#     the simulation and summary of its Context Broker request times), which is written last and marks the simulation
+#     as completed. The previous format (four pandas CSVs per simulation, as read by main.m) is still supported.
+
+import json, os
+import numpy as np
+
+DIMENSIONS = ["accuracy", "completeness", "precision", "timeliness"]
+COLUMNS = [dimension+"_"+phase for dimension in DIMENSIONS for phase in ["request", "processing"]]
+
+TIMES_FILE = "times.npy"
+METADATA_FILE = "metadata.json"
+CSV_FILES = [dimension+".csv" for dimension in DIMENSIONS]
+FORMATS = ["npy", "csv"]
+
+
+# save_times: store the times of a simulation
+#     Params:
+#        - folder_name: folder of the simulation
+#        - times: array (observation, len(COLUMNS)) in seconds, e.g. instrumentation.Recorder.export(COLUMNS)
+#        - parameters: dictionary with the parameters of the simulation (stored as metadata, npy format only)
+#        - format: "npy" (times.npy + metadata.json) or "csv" (four pandas CSVs, as read by main.m)
+def save_times(folder_name, times, parameters, format="npy"):
+  os.makedirs(folder_name, exist_ok=True)
+  if format == "csv":
+    import pandas as pd
+    for (k, file_name) in enumerate(CSV_FILES):
+      df = pd.DataFrame()
+      df["request_time"] = times[:, 2*k]; df["processing_time"] = times[:, 2*k+1]
+      df.to_csv(os.path.join(folder_name, file_name))
+    return
+
+  if format != "npy": raise ValueError("Unknown format " + str(format))
+  np.save(os.path.join(folder_name, TIMES_FILE), times)
+
+  metadata = dict(parameters, columns=COLUMNS, observations=len(times))
+  path = os.path.join(folder_name, METADATA_FILE)
+  with open(path+".tmp", "w") as f:
+    json.dump(metadata, f, indent=2, default=str)
+  os.replace(path+".tmp", path)
+
+
+# is_completed: True if the folder of a simulation contains all its results, in any format
+def is_completed(folder_name):
+  if os.path.isfile(os.path.join(folder_name, METADATA_FILE)) and os.path.isfile(os.path.join(folder_name, TIMES_FILE)): return True
+  return all(os.path.isfile(os.path.join(folder_name, file_name)) for file_name in CSV_FILES)
+
+
+# load_times: times of a simulation, in any format
+#     Params:
+#        - mmap: memory-map times.npy instead of reading it
+#     Return:
+#        - array (observation, len(COLUMNS))
+#        - metadata dictionary (None for CSV simulations)
+def load_times(folder_name, mmap=True):
+  if os.path.isfile(os.path.join(folder_name, METADATA_FILE)):
+    times = np.load(os.path.join(folder_name, TIMES_FILE), mmap_mode="r" if mmap else None)
+    with open(os.path.join(folder_name, METADATA_FILE)) as f:
+      return times, json.load(f)
+
+  import pandas as pd
+  columns = [
+    pd.read_csv(os.path.join(folder_name, file_name), usecols=["request_time", "processing_time"], dtype=np.float64).to_numpy()
+    for file_name in CSV_FILES
+  ]
+  return np.asfortranarray(np.concatenate(columns, axis=1)), None
+
+
+# load_dimension: request and processing times of one dimension
+#     Return:
+#        - array (observation, 2), a view of the times of the simulation
+def load_dimension(folder_name, dimension):
+  times, _ = load_times(folder_name)
+  k = DIMENSIONS.index(dimension)
+  return times[:, 2*k:2*k+2]
+
+
+# Campaign: completed simulations of a folder (simulations/simN), memory-mapped
+#     Params:
+#        - simulations_folder: folder containing the simN folders
+#     Only the pages that are read (e.g. the columns of one dimension) are loaded into memory.
+class Campaign:
+  def __init__(self, simulations_folder):
+    self.folders = {}
+    for name in os.listdir(simulations_folder):
+      folder = os.path.join(simulations_folder, name)
+      if name.startswith("sim") and name[3:].isdigit() and is_completed(folder):
+        self.folders[int(name[3:])] = folder
+    self.simulations = sorted(self.folders)
+    self.times = {}
+    self.metadata = {}
+
+  def __len__(self):
+    return len(self.simulations)
+
+  # get: times and metadata of simulation i (loaded on first use)
+  def get(self, i):
+    if i not in self.times:
+      self.times[i], self.metadata[i] = load_times(self.folders[i])
+    return self.times[i], self.metadata[i]
+
+  # column: times of one column (see COLUMNS) of every simulation
+  #     Return:
+  #        - array (observation, simulation); simulations with fewer observations are padded with NaN
+  def column(self, name):
+    k = COLUMNS.index(name)
+    series = [self.get(i)[0][:, k] for i in self.simulations]
+    values = np.full((max([len(s) for s in series] or [0]), len(series)), np.nan)
+    for (column, s) in enumerate(series):
+      values[:len(s), column] = s
+    return values
@@ -0,0 +1,188 @@
+# Software Name: snapshot_cache.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import threading, time
+
+import context_broker_api
+import configuration_variables
+import entity_snapshot
+
+
+# fetch_snapshot: every Temperature and DataQualityAssessment entity of the Context Broker
+#     The entities are read page by page (only the attributes used by precision) and added to the snapshot as they
+#     arrive, so the full JSON of every entity is never held in memory.
+#     Return:
+#        - EntitySnapshot (None on error)
+#        - error: boolean specifying if there have been any errors with the requests to the Context Broker
+def fetch_snapshot():
+  data_pages = context_broker_api.EntityPages("Temperature", attrs=entity_snapshot.DATA_ATTRS)
+  quality_pages = context_broker_api.EntityPages("DataQualityAssessment", attrs=entity_snapshot.QUALITY_ATTRS)
+
+  snapshot = entity_snapshot.EntitySnapshot(data_pages, quality_pages) # quality entities are read first
+  if data_pages.error or quality_pages.error: return None, True
+
+  return snapshot, False
+
+
+# SnapshotCache: EntitySnapshot shared by the precision of every observation
+#     The snapshot is downloaded again when it is older than max_staleness (synchronously, a miss) and, once started,
+#     every refresh_interval seconds in a background thread. Entities tagged by this process are updated in the
+#     snapshot (update), and re-applied over the refreshes requested less than upsert_max_delay seconds later, since
+#     they may still be waiting in the write buffer. Snapshots are immutable: updates are queued (update only takes the
+#     lock to append them) and applied in one batch, as a new snapshot, by the next get or refresh. Downloads are made
+#     outside the lock and by one thread at a time: concurrent misses wait for the download in progress.
+#     Params:
+#        - max_staleness: maximum age in seconds of the snapshot returned by get
+#        - refresh_interval: seconds between background refreshes
+#        - fetch: function returning a new snapshot and an error flag
+#        - clock: monotonic time function
+class SnapshotCache:
+  def __init__(self, max_staleness=configuration_variables.snapshot_max_staleness, refresh_interval=configuration_variables.snapshot_refresh_interval, fetch=fetch_snapshot, clock=time.monotonic):
+    self.max_staleness = max_staleness
+    self.refresh_interval = refresh_interval
+    self.fetch = fetch
+    self.clock = clock
+
+    self.snapshot = None
+    self.fetched_at = None # time the current snapshot was requested
+    self.own = {} # entity id -> (time, upsert arguments) of the entities tagged by this process
+    self.pending = {} # entity id -> upsert arguments of the updates not applied to the snapshot yet
+
+    self.lock = threading.RLock()
+    self.apply_lock = threading.Lock() # one batch of updates applied at a time
+    self.refresh_lock = threading.Lock() # one download at a time
+    self.stopped = threading.Event()
+    self.thread = None
+    self.reset_metrics()
+
+  def reset_metrics(self):
+    self.hits = 0; self.misses = 0
+    self.refreshes = 0; self.errors = 0; self.updates = 0
+    self.staleness_sum = 0; self.staleness_max = 0
+
+  # staleness: age in seconds of the current snapshot (None if there is none)
+  def staleness(self):
+    return None if self.fetched_at is None else self.clock() - self.fetched_at
+
+  # get: current snapshot, refreshed first if it is missing or older than max_staleness
+  #     Return:
+  #        - EntitySnapshot (None if it could not be downloaded)
+  #        - error: boolean specifying if there have been any errors with the requests to the Context Broker
+  def get(self):
+    if self.fresh(hit=True): return self.apply(), False
+
+    with self.lock:
+      self.misses += 1
+    with self.refresh_lock:
+      if not self.fresh() and self.reload(): return None, True # not downloaded meanwhile by another thread
+    return self.apply(), False
+
+  # fresh: True if the current snapshot is not older than max_staleness (hit: count it as a hit)
+  def fresh(self, hit=False):
+    with self.lock:
+      staleness = self.staleness()
+      if staleness is None or staleness > self.max_staleness: return False
+      if hit:
+        self.hits += 1
+        self.staleness_sum += staleness; self.staleness_max = max(self.staleness_max, staleness)
+      return True
+
+  # apply: current snapshot with the queued updates
+  def apply(self):
+    with self.apply_lock:
+      with self.lock:
+        snapshot, pending = self.snapshot, self.pending
+        if snapshot is None or len(pending) == 0: return snapshot
+        self.pending = {}
+
+      # Copied outside the lock: update and metrics do not wait for it
+      updated = snapshot.updated([(entity_id,) + arguments for (entity_id, arguments) in pending.items()])
+      with self.lock:
+        if self.snapshot is snapshot: self.snapshot = updated # else replaced by a refresh, which re-applied them
+        return self.snapshot
+
+  # refresh: download a new snapshot and re-apply the recent entities of this process
+  #     Return:
+  #        - error: boolean specifying if there have been any errors with the requests to the Context Broker
+  def refresh(self):
+    with self.refresh_lock:
+      return self.reload()
+
+  def reload(self):
+    start = self.clock()
+    snapshot, error = self.fetch()
+    with self.lock:
+      if error:
+        self.errors += 1
+        return True
+
+      recent = []
+      for (entity_id, (updated_at, arguments)) in list(self.own.items()):
+        if updated_at >= start - configuration_variables.upsert_max_delay: recent.append((entity_id,) + arguments)
+        else: del self.own[entity_id]
+
+      self.snapshot = snapshot.updated(recent) if len(recent) != 0 else snapshot; self.fetched_at = start
+      self.pending = {} # included in recent
+      self.refreshes += 1
+      return False
+
+  # update: queue the tagging of an input made by this process (applied by the next get or refresh)
+  #     Params:
+  #        - input: Temperature entity
+  #        - quality_input: DataQualityAssessment entity of the input
+  def update(self, input, quality_input):
+    arguments = (input['location']['value']['coordinates'], input['value']['value'], quality_input['id'], entity_snapshot.get_outlier_flag(quality_input))
+    with self.lock:
+      self.own[input['id']] = (self.clock(), arguments)
+      self.pending[input['id']] = arguments
+      self.updates += 1
+
+  # metrics: hits, misses, refreshes, errors, local updates and staleness (seconds) of the snapshots returned
+  def metrics(self):
+    with self.lock:
+      return {
+        "hits": self.hits, "misses": self.misses,
+        "refreshes": self.refreshes, "errors": self.errors, "updates": self.updates,
+        "staleness_mean": self.staleness_sum/self.hits if self.hits != 0 else 0,
+        "staleness_max": self.staleness_max,
+        "staleness": self.staleness()
+      }
+
+  def clear(self):
+    with self.lock:
+      self.snapshot = None; self.fetched_at = None
+      self.own = {}; self.pending = {}
+
+  # start: refresh every refresh_interval seconds in a background thread
+  def start(self):
+    if self.thread is not None: return
+    self.stopped.clear()
+
+    def run():
+      while not self.stopped.wait(self.refresh_interval):
+        self.refresh()
+
+    self.thread = threading.Thread(target=run, daemon=True)
+    self.thread.start()
+
+  # close: stop the background thread
+  def close(self):
+    self.stopped.set()
+    if self.thread is not None: self.thread.join()
+    self.thread = None
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+cache = SnapshotCache()
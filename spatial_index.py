@@ -0,0 +1,147 @@
+# Software Name: spatial_index.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import numpy as np
+
+# WGS-84 ellipsoid (same as geopy.distance.distance)
+WGS84_A = 6378137.0
+WGS84_F = 1/298.257223563
+WGS84_E2 = WGS84_F*(2-WGS84_F)
+
+# Smallest meridional radius of curvature (at the equator), used to bound the latitude band
+MIN_MERIDIONAL_RADIUS = WGS84_A*(1-WGS84_E2)
+
+
+# local_distances: distances in metres from one point to an array of points
+#     The ellipsoid is projected onto the tangent plane at the mid-latitude of each pair, using the meridional and
+#     prime vertical radii of curvature. For the few-kilometre ranges used in precision the result differs from the
+#     geodesic distance of geopy by less than 1 mm (relative error below 1e-6), so the `<= distance_range` cut-off
+#     only disagrees for points lying within a millimetre of the boundary.
+#     Params:
+#        - latitude, longitude: reference point in degrees
+#        - latitudes, longitudes: arrays of points in degrees
+#     Return:
+#        - array of distances in metres
+def local_distances(latitude, longitude, latitudes, longitudes):
+  latitudes = np.asarray(latitudes, dtype=np.float64)
+  longitudes = np.asarray(longitudes, dtype=np.float64)
+
+  mid_latitude = np.radians((latitudes + latitude)/2)
+  w = 1 - WGS84_E2*np.sin(mid_latitude)**2
+  meridional_radius = WGS84_A*(1-WGS84_E2)/(w*np.sqrt(w))
+  prime_vertical_radius = WGS84_A/np.sqrt(w)
+
+  delta_latitude = np.radians(latitudes - latitude)
+  delta_longitude = np.radians((longitudes - longitude + 180) % 360 - 180)
+
+  return np.hypot(meridional_radius*delta_latitude, prime_vertical_radius*np.cos(mid_latitude)*delta_longitude)
+
+
+# NeighbourIndex: static index of sensor positions to answer "values within a distance" queries
+#     Points are kept sorted by latitude, so a query only computes distances for the latitude band that can contain
+#     neighbours (binary search) and, inside it, for the points passing a longitude bounding-box check.
+#     Params:
+#        - latitudes, longitudes: arrays of coordinates in degrees
+#        - values: array of observed values
+#        - valid: optional boolean array; points set to False (e.g. outliers) are never returned
+class NeighbourIndex:
+  def __init__(self, latitudes, longitudes, values, valid=None):
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if valid is not None:
+      valid = np.asarray(valid, dtype=bool)
+      latitudes, longitudes, values = latitudes[valid], longitudes[valid], values[valid]
+
+    order = np.argsort(latitudes, kind="stable")
+    self.latitudes = latitudes[order]
+    self.longitudes = longitudes[order]
+    self.values = values[order]
+
+  def __len__(self):
+    return len(self.values)
+
+  # query: values of the indexed points within a distance of a reference point
+  #     Params:
+  #        - latitude, longitude: reference point in degrees
+  #        - distance_required: maximum distance in metres (inclusive)
+  #     Return:
+  #        - array of values
+  def query(self, latitude, longitude, distance_required):
+    delta_latitude = np.degrees(distance_required/MIN_MERIDIONAL_RADIUS)
+    start = np.searchsorted(self.latitudes, latitude - delta_latitude, side="left")
+    end = np.searchsorted(self.latitudes, latitude + delta_latitude, side="right")
+    if start == end: return self.values[0:0]
+
+    latitudes = self.latitudes[start:end]
+    longitudes = self.longitudes[start:end]
+    values = self.values[start:end]
+
+    # Longitude bounding box, skipped close to the poles where it is meaningless
+    max_latitude = min(abs(latitude) + delta_latitude, 90)
+    cos_latitude = np.cos(np.radians(max_latitude))
+    if cos_latitude > 1e-6:
+      delta_longitude = np.degrees(distance_required/(WGS84_A*cos_latitude))
+      if delta_longitude < 180:
+        inside = np.abs((longitudes - longitude + 180) % 360 - 180) <= delta_longitude
+        latitudes, longitudes, values = latitudes[inside], longitudes[inside], values[inside]
+
+    return values[local_distances(latitude, longitude, latitudes, longitudes) <= distance_required]
+
+
+# pairs_within: every pair of points of two sets within a distance of each other
+#     Points are hashed into a grid of cells at least `distance_required` wide (latitude band and longitude bounding
+#     box as in NeighbourIndex.query), so distances are only computed for the points of adjacent cells.
+#     Params:
+#        - latitudes, longitudes: arrays of coordinates of the first set in degrees
+#        - other_latitudes, other_longitudes: arrays of coordinates of the second set in degrees
+#        - distance_required: maximum distance in metres (inclusive)
+#     Return:
+#        - array of indices in the first set
+#        - array of indices in the second set (same length)
+def pairs_within(latitudes, longitudes, other_latitudes, other_longitudes, distance_required):
+  latitudes = np.asarray(latitudes, dtype=np.float64); longitudes = np.asarray(longitudes, dtype=np.float64)
+  other_latitudes = np.asarray(other_latitudes, dtype=np.float64); other_longitudes = np.asarray(other_longitudes, dtype=np.float64)
+  if len(latitudes) == 0 or len(other_latitudes) == 0: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+  cell_latitude = max(np.degrees(distance_required/MIN_MERIDIONAL_RADIUS), 1e-9)
+  max_latitude = min(max(np.abs(latitudes).max(), np.abs(other_latitudes).max()) + cell_latitude, 90)
+  cos_latitude = np.cos(np.radians(max_latitude))
+  columns = 1
+  if cos_latitude > 1e-6:
+    cell_longitude = max(np.degrees(distance_required/(WGS84_A*cos_latitude)), 1e-9)
+    columns = int(360 // cell_longitude)
+    if columns < 3: columns = 1 # adjacent cells would repeat
+
+  def cells(latitudes, longitudes):
+    rows = np.floor((latitudes + 90)/cell_latitude).astype(np.int64)
+    if columns == 1: return rows, np.zeros(len(rows), dtype=np.int64)
+    return rows, np.floor(((longitudes + 180) % 360)/(360/columns)).astype(np.int64) % columns
+
+  other_rows, other_columns = cells(other_latitudes, other_longitudes)
+  other_keys = other_rows*columns + other_columns
+  order = np.argsort(other_keys, kind="stable"); sorted_keys = other_keys[order]
+
+  rows, cell_columns = cells(latitudes, longitudes)
+  first = []; second = []
+  for delta_row in (-1, 0, 1):
+    for delta_column in ((-1, 0, 1) if columns > 1 else (0,)):
+      keys = (rows + delta_row)*columns + (cell_columns + delta_column) % columns
+      start = np.searchsorted(sorted_keys, keys, side="left")
+      counts = np.searchsorted(sorted_keys, keys, side="right") - start
+      total = counts.sum()
+      if total == 0: continue
+      first.append(np.repeat(np.arange(len(keys)), counts))
+      offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+      second.append(order[np.repeat(start, counts) + offsets])
+
+  if len(first) == 0: return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+  first = np.concatenate(first); second = np.concatenate(second)
+  inside = local_distances(latitudes[first], longitudes[first], other_latitudes[second], other_longitudes[second]) <= distance_required
+  return first[inside], second[inside]
@@ -0,0 +1,92 @@
+# Software Name: test_batch_assessment.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import DQ_dimensions_performance as dq
+import batch_assessment
+import spatial_index
+
+
+# Row by row replay of the last value of every entity (reference of precision_column)
+def loop_precision(data, distance_range):
+  last = {}
+  precision = np.zeros(len(data))
+  for k, row in enumerate(data.itertuples(index=False)):
+    known = [(lat, lon, value) for (lat, lon, value, valid) in last.values() if valid]
+    if len(known) != 0:
+      latitudes, longitudes, values = map(np.array, zip(*known))
+      surrounding_values = values[spatial_index.local_distances(row.lat, row.lon, latitudes, longitudes) <= distance_range]
+      if len(surrounding_values) != 0: precision[k] = np.linalg.norm(row.value - surrounding_values)/np.sqrt(len(surrounding_values))
+    last[row.id] = (row.lat, row.lon, row.value, not row.isOutlier)
+  return precision
+
+
+def observations(rows, entities, seed, moving=False):
+  generator = np.random.default_rng(seed)
+  entity = generator.integers(0, entities, rows)
+  latitudes = generator.uniform(43.425, 43.481944, entities); longitudes = generator.uniform(-3.883333, -3.7625, entities)
+  return pd.DataFrame({
+    "id": ["urn:x-iot:u7jcfa:"+str(e) for e in entity], "time": np.arange(rows, dtype=np.float64),
+    "value": np.round(generator.uniform(8, 25, rows), 2),
+    "lat": generator.uniform(43.425, 43.481944, rows) if moving else latitudes[entity],
+    "lon": longitudes[entity], "isSynthetic": False, "isOutlier": generator.random(rows) < 0.1
+  })
+
+
+def test_check_equivalence():
+  assert batch_assessment.check_equivalence(rows=1000, entities=30) == 1000
+
+
+@pytest.mark.parametrize("entities", [1, 5, 50, 400])
+@pytest.mark.parametrize("block_size", [None, 8, 64])
+def test_precision_matches_loop(entities, block_size):
+  data = observations(1500, entities, seed=entities)
+  expected = loop_precision(data, 2000)
+  assert np.allclose(batch_assessment.precision_column(data, 2000, block_size=block_size, chunk_pairs=5000), expected, rtol=1e-12, atol=1e-12)
+
+
+def test_precision_of_moving_entities():
+  data = observations(1000, 20, seed=7, moving=True)
+  assert np.allclose(batch_assessment.precision_column(data, 2000, block_size=16), loop_precision(data, 2000), rtol=1e-12, atol=1e-12)
+
+
+def test_pairs_within():
+  generator = np.random.default_rng(0)
+  latitudes = generator.uniform(43.4, 43.5, 300); longitudes = np.r_[generator.uniform(-3.9, -3.7, 200), generator.uniform(179.99, 180, 100)]
+  other_latitudes = generator.uniform(43.4, 43.5, 200); other_longitudes = np.r_[generator.uniform(-3.9, -3.7, 150), generator.uniform(-180, -179.99, 50)]
+  first, second = spatial_index.pairs_within(latitudes, longitudes, other_latitudes, other_longitudes, 2000)
+
+  expected = {(i, j) for i in range(len(latitudes))
+              for j in np.flatnonzero(spatial_index.local_distances(latitudes[i], longitudes[i], other_latitudes, other_longitudes) <= 2000)}
+  assert set(zip(first.tolist(), second.tolist())) == expected
+
+
+# Chain of dq.timeliness_processing, each observation reading the previous one of its entity (reference of timeliness_column)
+def loop_timeliness(data):
+  last = {}
+  timeliness = np.zeros(len(data))
+  for k, row in enumerate(data.itertuples(index=False)):
+    input = {"dateModified": {"value": pd.Timestamp(row.time, unit="s").strftime('%Y-%m-%dT%H:%M:%SZ')}}
+    timeliness[k] = dq.timeliness_processing(input, *last[row.id]) if row.id in last else 10
+    last[row.id] = (input, {"timeliness": {"value": timeliness[k]}})
+  return timeliness
+
+
+@pytest.mark.parametrize("entities", [1, 3, 40])
+def test_timeliness_matches_the_observation_chain(entities):
+  generator = np.random.default_rng(entities)
+  rows = 5000
+  data = pd.DataFrame({
+    "id": ["urn:x-iot:u7jcfa:"+str(e) for e in generator.integers(0, entities, rows)],
+    "time": 1700000000 + np.cumsum(generator.choice([0, 1, 30, 60, 120], rows)).astype(np.float64)
+  })
+  assert np.allclose(batch_assessment.timeliness_column(data), loop_timeliness(data), rtol=1e-12, atol=1e-12)
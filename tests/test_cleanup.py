@@ -0,0 +1,65 @@
+# Software Name: test_cleanup.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import threading
+from datetime import datetime
+
+import pytest
+
+import DQ_dimensions_performance as dq
+import cleanup
+import configuration_variables
+import context_broker_api
+import local_broker
+
+
+@pytest.fixture
+def broker(monkeypatch):
+  server = local_broker.start()
+  monkeypatch.setattr(configuration_variables, "broker_url", server.url)
+  monkeypatch.setattr(context_broker_api, "client", context_broker_api.BrokerClient(retries=2, backoff=0))
+  yield server
+  server.stop()
+
+
+# answer the first `failures` temporal DELETE requests of every entity with `status`
+def failing_deletes(monkeypatch, status, failures):
+  attempts = {}; lock = threading.Lock()
+  do_DELETE = local_broker.Handler.do_DELETE
+  def delete(self):
+    with lock:
+      attempts[self.path] = attempts.get(self.path, 0) + 1
+      failed = attempts[self.path] <= failures
+    if failed: return self.send(status, headers={"Retry-After": "0"})
+    return do_DELETE(self)
+  monkeypatch.setattr(local_broker.Handler, "do_DELETE", delete)
+  return attempts
+
+
+def add_simulation(prefix, count):
+  inputs = [dq.simulate_input(prefix+str(k), datetime.now()) for k in range(count)]
+  assert context_broker_api.upsert_entities(inputs)[1] == []
+
+
+def test_throttled_requests_are_retried(broker, monkeypatch):
+  add_simulation("sim0:", 5)
+  attempts = failing_deletes(monkeypatch, 429, 1)
+
+  report = cleanup.delete_entities("sim0:")
+  assert cleanup.failures(report) == 0 and report["Temperature"]["entities"] == 5
+  assert sorted(attempts.values()) == [2]*5
+
+
+def test_requests_are_retried_by_one_layer(broker, monkeypatch):
+  add_simulation("sim0:", 5)
+  attempts = failing_deletes(monkeypatch, 503, 100)
+
+  report = cleanup.delete_entities("sim0:")
+  assert len(report["Temperature"]["failures"]) == 5
+  assert sorted(attempts.values()) == [3]*5 # first attempt + the 2 retries of the client
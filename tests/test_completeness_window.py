@@ -0,0 +1,86 @@
+# Software Name: test_completeness_window.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import random
+
+import pytest
+
+import DQ_dimensions_performance as dq
+import completeness_window
+import configuration_variables
+import quality_state
+
+
+# completeness_processing as first published (reference of the equivalence tests)
+def baseline_completeness_processing(is_synthetic, quality_temporal):
+  n = int(is_synthetic)
+  total = 1
+
+  if isinstance(quality_temporal['synthetic'], list): # more than one temporal value
+    total = total + len(quality_temporal['synthetic'])
+    for i in quality_temporal['synthetic']:
+      if i['value']['isSynthetic']['value'] == "True":
+        n = n + 1
+  else: # just one temporal value
+    if quality_temporal['synthetic']['value']['isSynthetic']['value'] == "True":
+      total = total + 1
+      n = n + 1
+
+  return round((total-n)/total,3)*100
+
+
+def temporal(flags):
+  values = [{'value': {'isSynthetic': {'value': str(flag)}}} for flag in flags]
+  return {'synthetic': values[0] if len(values) == 1 else values}
+
+
+@pytest.mark.parametrize("is_synthetic", [False, True])
+@pytest.mark.parametrize("previous", [[], [False], [True], [False, False], [True, False], [True, True, False, True]])
+def test_completeness_processing_matches_baseline(is_synthetic, previous):
+  assert dq.completeness_processing(is_synthetic, temporal(previous)) == baseline_completeness_processing(is_synthetic, temporal(previous))
+
+
+def test_single_previous_real_value_is_not_counted():
+  assert dq.completeness_processing(True, temporal([False])) == 0
+  engine = completeness_window.SlidingCompleteness()
+  engine.add("a", 0, False)
+  assert engine.add("a", 60, True) == 0
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_sliding_completeness_matches_baseline(seed):
+  generator = random.Random(seed)
+  engine = completeness_window.SlidingCompleteness()
+  history = {}; timestamp = 0
+
+  for k in range(5000):
+    entity_id = generator.randrange(20)
+    timestamp = timestamp + generator.choice([0, 1, 30, 60, 120, 600, 1800])
+    is_synthetic = generator.random() < 0.3
+
+    time_at = timestamp - configuration_variables.time_window*60
+    previous = [flag for (t, flag) in history.get(entity_id, []) if t > time_at][-configuration_variables.lastN:]
+    assert engine.add(entity_id, timestamp, is_synthetic) == baseline_completeness_processing(is_synthetic, temporal(previous)), k
+
+    history.setdefault(entity_id, []).append((timestamp, is_synthetic))
+
+
+def test_check_equivalence():
+  assert completeness_window.check_equivalence(observations=5000) == 5000
+
+
+def test_quality_state_matches_broker_response():
+  store = quality_state.QualityStateStore()
+  input = {'id': "a", 'hasQuality': {'object': "qa"}, 'dateModified': {'value': "2023-06-01T10:00:00Z"}}
+  store.update(input, {'timeliness': {'value': 10}, 'synthetic': {'value': {'isSynthetic': {'value': "False"}}}})
+
+  input = dict(input, dateModified={'value': "2023-06-01T10:02:00Z"})
+  quality_temporal = store.get_quality_temporal(input)
+  assert quality_temporal['synthetic'] == temporal([False])['synthetic']
+  assert dq.completeness_processing(True, quality_temporal) == baseline_completeness_processing(True, temporal([False]))
@@ -0,0 +1,85 @@
+# Software Name: test_context_broker_api.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import DQ_dimensions_performance as dq
+import configuration_variables
+import context_broker_api
+import context_broker_api_async
+import instrumentation
+import local_broker
+
+
+@pytest.fixture
+def broker(monkeypatch):
+  server = local_broker.start()
+  monkeypatch.setattr(configuration_variables, "broker_url", server.url)
+  monkeypatch.setattr(configuration_variables, "broker_query_limit", 20)
+  yield server
+  server.stop()
+
+
+# 50 entities at the same point, more than two pages
+def add_entities(count=50):
+  inputs = [dq.simulate_input(k, datetime.now()) for k in range(count)]
+  for input in inputs: input['location']['value']['coordinates'] = [-3.8, 43.46]
+  status, errors = context_broker_api.upsert_entities(inputs)
+  assert errors == []
+  return {input['id'] for input in inputs}
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_geo_query_reads_every_page(broker, monkeypatch, stream):
+  if stream: pytest.importorskip("ijson")
+  monkeypatch.setattr(configuration_variables, "broker_streaming", stream)
+  ids = add_entities()
+
+  entities, error = context_broker_api.get_entities_by_type_geoQuery("Temperature", [-3.8, 43.46], attrs=["value"])
+  assert not error and {i['id'] for i in entities} == ids
+
+  entities, error = context_broker_api.get_entities_by_type_geoQuery("Temperature", [-3.0, 43.46])
+  assert not error and entities == []
+
+
+def test_async_geo_query_reads_every_page(broker):
+  ids = add_entities()
+
+  async def query():
+    async with context_broker_api_async.AsyncBrokerClient() as client:
+      return await context_broker_api_async.get_entities_by_type_geoQuery(client, "Temperature", [-3.8, 43.46], attrs=["value"])
+
+  entities, error = asyncio.run(query())
+  assert not error and {i['id'] for i in entities} == ids
+
+
+# The listing responses are cut in the middle of the body (Content-Length of the whole page, then the connection is closed)
+def test_streamed_page_cut_mid_body(broker, monkeypatch):
+  pytest.importorskip("ijson")
+  ids = add_entities()
+
+  def cut(self, status, body=None, headers=None, content_type="application/ld+json"):
+    payload = local_broker.json.dumps(body).encode()
+    self.send_response(status)
+    self.send_header("Content-Type", content_type); self.send_header("Content-Length", str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload[:len(payload)//2]); self.wfile.flush()
+    self.close_connection = True
+  monkeypatch.setattr(local_broker.Handler, "send", cut)
+  monkeypatch.setattr(context_broker_api, "client", context_broker_api.BrokerClient(timeout=5))
+  recorder = instrumentation.Recorder()
+  monkeypatch.setattr(instrumentation, "recorder", recorder)
+
+  pages = context_broker_api.EntityPages("Temperature", stream=True)
+  entities = list(pages)
+  assert pages.error and len(entities) < len(ids) # ijson reads the body in blocks: the entities before the cut may not be yielded
+  assert recorder.summary()["broker_GET"]["count"] == 1
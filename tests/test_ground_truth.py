@@ -0,0 +1,86 @@
+# Software Name: test_ground_truth.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import threading, time
+from datetime import datetime
+
+import pytest
+
+import configuration_variables
+import ground_truth
+import local_broker
+
+
+def at(date):
+  return datetime.strptime(date, ground_truth.DATE_FORMAT).replace(tzinfo=ground_truth.TIME_ZONE).timestamp()
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+  downloads = []; rows = {"latest": "18/10/2026 14:00"}
+  def fetch(station):
+    downloads.append(station)
+    return [(rows["latest"], 15.0)], False
+  monkeypatch.setattr(ground_truth, "fetch_station_series", fetch)
+  return downloads, rows
+
+
+def test_series_expires_when_the_next_row_is_due(downloads):
+  downloads, rows = downloads
+  now = {"t": at("18/10/2026 14:50")}
+  provider = ground_truth.AemetProvider(ttl=3600, refetch_interval=300, clock=lambda: now["t"])
+
+  provider.get_series(ground_truth.SANTANDER)
+  now["t"] = at("18/10/2026 14:59"); provider.get_series(ground_truth.SANTANDER)
+  assert len(downloads) == 1
+
+  rows["latest"] = "18/10/2026 15:00"
+  now["t"] = at("18/10/2026 15:01")
+  assert provider.get_series(ground_truth.SANTANDER) == ([("18/10/2026 15:00", 15.0)], False)
+  assert len(downloads) == 2 and (provider.hits, provider.misses) == (1, 2)
+
+
+def test_unpublished_row_is_refetched_every_refetch_interval(downloads):
+  downloads, rows = downloads
+  rows["latest"] = "18/10/2026 13:00" # 14:00 not published yet
+  now = {"t": at("18/10/2026 14:10")}
+  provider = ground_truth.AemetProvider(ttl=3600, refetch_interval=300, clock=lambda: now["t"])
+
+  provider.get_series(ground_truth.SANTANDER)
+  now["t"] += 299; provider.get_series(ground_truth.SANTANDER)
+  assert len(downloads) == 1
+  now["t"] += 1; provider.get_series(ground_truth.SANTANDER)
+  assert len(downloads) == 2
+
+
+def test_concurrent_misses_download_once(monkeypatch):
+  downloads = []
+  def fetch(station):
+    downloads.append(station); time.sleep(0.2)
+    return [(datetime.now(ground_truth.TIME_ZONE).strftime(ground_truth.DATE_FORMAT), 15.0)], False
+  monkeypatch.setattr(ground_truth, "fetch_station_series", fetch)
+
+  provider = ground_truth.AemetProvider()
+  stations = [ground_truth.SANTANDER, ground_truth.SANTANDER_AIRPORT]*4
+  threads = [threading.Thread(target=provider.get_series, args=(station,)) for station in stations]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+  assert sorted(downloads) == sorted(set(stations))
+
+
+def test_local_aemet_series_is_cached(monkeypatch):
+  server = local_broker.start()
+  try:
+    monkeypatch.setattr(configuration_variables, "aemet_url", server.aemet_url)
+    provider = ground_truth.AemetProvider()
+    assert provider.get_value([-3.8, 43.46]) not in (None, False)
+    provider.get_value([-3.81, 43.47])
+    assert (provider.hits, provider.misses) == (2, 2)
+  finally:
+    server.stop()
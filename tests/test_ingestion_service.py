@@ -0,0 +1,43 @@
+# Software Name: test_ingestion_service.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+from datetime import datetime
+
+import pytest
+
+import DQ_dimensions_performance as dq
+import configuration_variables
+import ingestion_service
+import local_broker
+
+
+@pytest.fixture
+def broker(monkeypatch):
+  server = local_broker.start()
+  monkeypatch.setattr(configuration_variables, "broker_url", server.url)
+  monkeypatch.setattr(configuration_variables, "aemet_url", server.aemet_url)
+  yield server
+  server.stop()
+
+
+def test_quality_id_keeps_the_whole_suffix():
+  assert dq.get_quality_id("urn:x-iot:u7jcfa:sim1:3") != dq.get_quality_id("urn:x-iot:u7jcfa:sim2:3")
+  assert dq.simulate_input("sim1:3", datetime.now())['hasQuality']['object'] == dq.get_quality_id("urn:x-iot:u7jcfa:sim1:3")
+
+
+def test_submit_adds_distinct_quality_entities(broker):
+  inputs = [dq.simulate_input(prefix+"3", datetime.now()) for prefix in ["sim1:", "sim2:"]]
+  for input in inputs: del input['hasQuality']
+
+  with ingestion_service.IngestionService(workers=2) as service:
+    for input in inputs: assert service.submit(input, is_outlier=False)
+
+  quality_ids = {input['hasQuality']['object'] for input in inputs}
+  stored = {entity_id for entity_id in broker.state.tenant("")["entities"] if entity_id in quality_ids}
+  assert len(quality_ids) == 2 and stored == quality_ids
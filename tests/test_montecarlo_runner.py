@@ -0,0 +1,36 @@
+# Software Name: test_montecarlo_runner.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+from datetime import datetime
+
+import DQ_dimensions_performance as dq
+import configuration_variables
+import context_broker_api
+import local_broker
+import montecarlo_runner
+
+
+def test_rerun_deletes_the_leftovers_of_the_failed_run(monkeypatch, tmp_path):
+  server = local_broker.start()
+  try:
+    for name in ["broker_url", "aemet_url", "precision_fetch"]:
+      monkeypatch.setattr(configuration_variables, name, getattr(configuration_variables, name))
+    monkeypatch.setattr(configuration_variables, "broker_url", server.url)
+    monkeypatch.setattr(context_broker_api, "client", context_broker_api.BrokerClient())
+
+    leftovers = [dq.simulate_input(prefix+"7", datetime.now()) for prefix in ["sim3:", "sim4:"]]
+    assert context_broker_api.upsert_entities(leftovers)[1] == []
+
+    remaining = []
+    monkeypatch.setattr(dq, "run_simulation", lambda *args, **kwargs: remaining.extend(server.state.tenant("")["entities"]))
+    montecarlo_runner.run_worker(3, str(tmp_path), 10, 3, 120, 1.2, 0, None, broker_url=server.url, aemet_url=server.aemet_url)
+
+    assert remaining == [leftovers[1]['id']] # only the entities of the rerun simulation
+  finally:
+    server.stop()
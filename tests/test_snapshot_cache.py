@@ -0,0 +1,101 @@
+# Software Name: test_snapshot_cache.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import threading, time
+
+import entity_snapshot
+import snapshot_cache
+
+
+def temperature(k, value=10.0):
+  return {"id": "urn:x-iot:u7jcfa:"+str(k), "location": {"value": {"coordinates": [-3.8, 43.46]}}, "value": {"value": value}, "hasQuality": {"object": "urn:ngsi-ld:DataQualityAssessment:"+str(k)}}
+
+def quality(k, is_outlier=False):
+  return {"id": "urn:ngsi-ld:DataQualityAssessment:"+str(k), "outlier": {"value": {"isOutlier": {"value": str(is_outlier)}}}}
+
+
+def test_updated_returns_a_new_snapshot():
+  snapshot = entity_snapshot.EntitySnapshot([temperature(0), temperature(1)], [quality(0), quality(1, True)])
+  updated = snapshot.updated([("urn:x-iot:u7jcfa:1", [-3.8, 43.46], 12.0, "urn:ngsi-ld:DataQualityAssessment:1", False), ("urn:x-iot:u7jcfa:2", [-3.8, 43.46], 14.0)])
+
+  assert len(snapshot) == 2 and len(snapshot.neighbour_index()) == 1
+  assert len(updated) == 3 and len(updated.neighbour_index()) == 2 # the new entity has no outlier flag
+  assert updated.get("urn:x-iot:u7jcfa:1")["value"] == 12.0 and snapshot.get("urn:x-iot:u7jcfa:1")["value"] == 10.0
+
+
+def test_concurrent_updates_and_queries():
+  cache = snapshot_cache.SnapshotCache(max_staleness=60, fetch=lambda: (entity_snapshot.EntitySnapshot([temperature(0)], [quality(0)]), False))
+  errors = []
+
+  def update(worker):
+    for k in range(1, 301):
+      cache.update(temperature(1000*worker + k), quality(1000*worker + k))
+
+  def query():
+    for k in range(1000):
+      try:
+        snapshot, _ = cache.get()
+        assert len(snapshot.neighbour_index().query(43.46, -3.8, 2000)) <= len(snapshot)
+      except Exception as e:
+        errors.append(e)
+
+  threads = [threading.Thread(target=update, args=(worker,)) for worker in range(4)] + [threading.Thread(target=query) for k in range(2)]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+
+  assert errors == []
+  snapshot, _ = cache.get()
+  assert len(snapshot) == 1201 and len(snapshot.neighbour_index()) == 1201
+
+
+def test_get_fetches_outside_the_lock():
+  cache = snapshot_cache.SnapshotCache(max_staleness=60)
+  released = []
+
+  def fetch():
+    thread = threading.Thread(target=lambda: released.append(cache.metrics())) # needs the lock
+    thread.start(); thread.join(timeout=5)
+    return entity_snapshot.EntitySnapshot(), False
+
+  cache.fetch = fetch
+  snapshot, error = cache.get()
+  assert not error and len(snapshot) == 0 and len(released) == 1
+
+
+def test_updates_are_applied_in_one_batch(monkeypatch):
+  cache = snapshot_cache.SnapshotCache(max_staleness=60, fetch=lambda: (entity_snapshot.EntitySnapshot([temperature(0)], [quality(0)]), False))
+  cache.get()
+  copies = []
+  updated = entity_snapshot.EntitySnapshot.updated
+  monkeypatch.setattr(entity_snapshot.EntitySnapshot, "updated", lambda self, updates: copies.append(1) or updated(self, updates))
+
+  for k in range(1, 101): cache.update(temperature(k, value=k), quality(k))
+  cache.update(temperature(1, value=50.0), quality(1))
+  assert copies == []
+
+  snapshot, _ = cache.get()
+  assert copies == [1] and len(snapshot) == 101 and snapshot.get("urn:x-iot:u7jcfa:1")["value"] == 50.0
+  cache.get()
+  assert copies == [1]
+
+
+def test_concurrent_misses_download_once():
+  downloads = []
+  def fetch():
+    downloads.append(1); time.sleep(0.2)
+    return entity_snapshot.EntitySnapshot([temperature(0)], [quality(0)]), False
+
+  cache = snapshot_cache.SnapshotCache(max_staleness=60, fetch=fetch)
+  results = []
+  threads = [threading.Thread(target=lambda: results.append(cache.get())) for k in range(8)]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+
+  assert downloads == [1] and len(results) == 8
+  assert all(not error and len(snapshot) == 1 for (snapshot, error) in results)
@@ -0,0 +1,50 @@
+# Software Name: test_spatial_index.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import numpy as np
+from geopy import distance
+
+import configuration_variables
+import spatial_index
+
+
+# Points around random references of the Santander area, at random bearings and at distances close to distance_range
+def pairs_near_the_radius(count, seed, spread=200):
+  generator = np.random.default_rng(seed)
+  references = np.column_stack([generator.uniform(43.425, 43.481944, count), generator.uniform(-3.883333, -3.7625, count)])
+  points = []
+  for (reference, bearing, metres) in zip(references, generator.uniform(0, 360, count), configuration_variables.distance_range + generator.uniform(-spread, spread, count)):
+    point = distance.geodesic(meters=metres).destination(tuple(reference), bearing)
+    points.append((point.latitude, point.longitude))
+  return references, np.array(points)
+
+
+def test_local_distances_match_geodesic():
+  references, points = pairs_near_the_radius(500, seed=0)
+  expected = np.array([distance.geodesic(tuple(reference), tuple(point)).m for (reference, point) in zip(references, points)])
+  result = np.array([spatial_index.local_distances(reference[0], reference[1], point[0:1], point[1:2])[0] for (reference, point) in zip(references, points)])
+
+  assert np.all(np.abs(result - expected)/expected < 1e-6)
+  assert np.all(np.abs(result - expected) < 1e-3)
+
+
+def test_query_returns_the_geodesic_neighbours():
+  references, points = pairs_near_the_radius(40, seed=1, spread=20)
+  latitudes = np.concatenate([points[:, 0], np.random.default_rng(2).uniform(43.425, 43.481944, 200)])
+  longitudes = np.concatenate([points[:, 1], np.random.default_rng(3).uniform(-3.883333, -3.7625, 200)])
+  index = spatial_index.NeighbourIndex(latitudes, longitudes, np.arange(len(latitudes)))
+
+  for reference in references:
+    geodesic = np.array([distance.distance(tuple(reference), (latitude, longitude)).m for (latitude, longitude) in zip(latitudes, longitudes)])
+    expected = set(np.flatnonzero(geodesic <= configuration_variables.distance_range)) # baseline filter of get_surrounding_values
+    ambiguous = set(np.flatnonzero(np.abs(geodesic - configuration_variables.distance_range) < 1e-3)) # within a millimetre of the boundary
+
+    result = set(index.query(reference[0], reference[1], configuration_variables.distance_range).astype(int))
+    assert result - ambiguous == expected - ambiguous
+    assert len(expected) != 0
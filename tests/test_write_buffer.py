@@ -0,0 +1,46 @@
+# Software Name: test_write_buffer.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import threading, time
+
+import write_buffer
+
+
+def test_concurrent_producers_with_a_slow_broker():
+  sent = []; outbox = []
+  def upsert(chunk):
+    outbox.append(len(buffer.outbox))
+    time.sleep(0.005)
+    sent.extend((body['id'], body['version']) for body in chunk)
+    return 204, []
+
+  buffer = write_buffer.UpsertBuffer(max_size=5, max_delay=None, upsert=upsert, max_pending=4)
+  def produce(worker):
+    for k in range(150):
+      buffer.add({'id': "urn:%d:%d" % (worker, k % 50), 'version': k // 50}) # every id three times
+      outbox.append(len(buffer.outbox))
+
+  threads = [threading.Thread(target=produce, args=(worker,)) for worker in range(8)]
+  for thread in threads: thread.start()
+  for thread in threads: thread.join()
+  assert buffer.flush() == []
+
+  expected = [("urn:%d:%d" % (worker, k % 50), k // 50) for worker in range(8) for k in range(150)]
+  assert sorted(sent) == sorted(expected) # none lost or sent twice
+  for entity_id in set(entity_id for (entity_id, _) in expected):
+    assert [version for (i, version) in sent if i == entity_id] == [0, 1, 2]
+  assert max(outbox) <= 4 and buffer.entities == len(expected)
+
+
+def test_flush_sends_every_batch_in_order():
+  sent = []
+  buffer = write_buffer.UpsertBuffer(max_size=2, max_delay=None, upsert=lambda chunk: sent.append([body['id'] for body in chunk]) or (204, []), max_pending=2)
+  for k in range(7): buffer.add({'id': str(k)})
+  buffer.flush()
+  assert sent == [["0", "1"], ["2", "3"], ["4", "5"], ["6"]]
@@ -0,0 +1,151 @@
+# Software Name: write_buffer.py
+# SPDX-FileCopyrightText: Copyright (c) 2023 Universidad de Cantabria
+# SPDX-License-Identifier: LGPL-3.0
+#
+# This software is distributed under the LGPL-3.0 license;
+# see the LICENSE file for more details.
+#
+# Author: Laura MARTIN <lmartin@tlmat.unican.es> et al.
+
+import threading, time
+from collections import deque
+
+import context_broker_api
+import configuration_variables
+
+
+# UpsertBuffer: write-behind buffer sending entities to the Context Broker through batch upserts
+#     Entities are sent in insertion order when `max_size` entities are pending or the oldest pending entity is older
+#     than `max_delay` seconds. An entity whose id is already pending triggers a flush first, so every version reaches
+#     the broker (and its temporal history) instead of being overwritten in the buffer. Flushed batches wait in an
+#     outbox and are sent in order by one thread at a time, outside the buffer lock: add() never waits for a
+#     request sent by another thread (that thread, or the background thread, also sends the newer batches). A batch
+#     whose upsert raises is recorded in failures with the exception. The outbox holds at most max_pending batches: a
+#     flush that would exceed it first sends the outbox from the calling thread (waiting for the thread sending, if
+#     any), so producers faster than the broker are slowed down instead of piling up batches in memory.
+#     Params:
+#        - max_size: maximum number of entities per batch
+#        - max_delay: maximum time in seconds an entity waits in the buffer (None: only size-triggered and explicit flushes)
+#        - upsert: function sending a batch, returning the status code and the failed (entity id, error) tuples
+#        - max_pending: maximum number of batches in the outbox
+class UpsertBuffer:
+  def __init__(self, max_size=configuration_variables.upsert_batch_size, max_delay=configuration_variables.upsert_max_delay, upsert=context_broker_api.upsert_entities, max_pending=configuration_variables.upsert_max_pending):
+    self.max_size = max_size
+    self.max_delay = max_delay
+    self.max_pending = max_pending
+    self.upsert = upsert
+
+    self.pending = []; self.pending_ids = set()
+    self.oldest = None
+    self.outbox = deque() # flushed batches not sent yet, in order
+    self.failures = [] # (entity id, error) of every failed entity
+    self.batches = 0; self.entities = 0
+
+    self.lock = threading.RLock()
+    self.send_lock = threading.Lock()
+    self.stopped = threading.Event()
+    self.thread = None
+
+  # add: queue an entity for upserting
+  def add(self, body):
+    while True:
+      with self.lock:
+        duplicate = body['id'] in self.pending_ids
+        size = 1 if duplicate else len(self.pending) + 1
+        if self.room(duplicate + (size >= self.max_size or (not duplicate and self.expired()))):
+          if duplicate: self.detach()
+
+          self.pending.append(body); self.pending_ids.add(body['id'])
+          if self.oldest is None: self.oldest = time.monotonic()
+
+          if len(self.pending) >= self.max_size or self.expired(): self.detach()
+          ready = len(self.outbox) != 0
+          break
+      self.send() # outbox full
+    if ready: self.send(wait=False)
+
+  def expired(self):
+    return self.max_delay is not None and self.oldest is not None and time.monotonic() - self.oldest >= self.max_delay
+
+  # room: True if the outbox can take that many more batches (called with the lock held)
+  def room(self, batches):
+    return batches == 0 or len(self.outbox) == 0 or len(self.outbox) + batches <= self.max_pending
+
+  # detach: move the pending entities to the outbox (called with the lock held)
+  def detach(self):
+    if len(self.pending) == 0: return
+    self.outbox.append(self.pending)
+    self.pending = []; self.pending_ids = set()
+    self.oldest = None
+
+  # flush: send every pending entity
+  #     Return:
+  #        - array of (entity id, error) tuples of the entities sent by this call that could not be upserted
+  def flush(self):
+    failures = []
+    while True:
+      with self.lock:
+        if self.room(1):
+          self.detach()
+          break
+      failures.extend(self.send()) # outbox full
+    return failures + self.send()
+
+  # send: send the batches of the outbox, in order
+  #     Params:
+  #        - wait: wait for the thread currently sending (False: return, that thread sends the outbox)
+  def send(self, wait=True):
+    failures = []
+    while True:
+      if not self.send_lock.acquire(blocking=wait): return failures
+      try:
+        while True:
+          with self.lock:
+            if len(self.outbox) == 0: break
+            batch = self.outbox.popleft()
+
+          for start in range(0, len(batch), self.max_size):
+            chunk = batch[start:start+self.max_size]
+            try:
+              _, errors = self.upsert(chunk)
+            except Exception as e: # e.g. requests.ConnectionError once the retries are exhausted
+              errors = [(body['id'], repr(e)) for body in chunk]
+            failures.extend(errors)
+            with self.lock:
+              self.batches += 1; self.entities += len(chunk)
+              self.failures.extend(errors)
+      finally:
+        self.send_lock.release()
+
+      with self.lock:
+        if len(self.outbox) == 0: return failures
+      # a batch was added after the outbox was found empty, by a thread that could not take the send lock
+
+  # start: flush in a background thread whenever the oldest pending entity reaches max_delay
+  def start(self):
+    if self.thread is not None or self.max_delay is None: return
+    self.stopped.clear()
+
+    def run():
+      while not self.stopped.wait(self.max_delay/2):
+        with self.lock:
+          if self.expired() and self.room(1): self.detach() # else the outbox is sent first
+          ready = len(self.outbox) != 0
+        if ready: self.send()
+
+    self.thread = threading.Thread(target=run, daemon=True)
+    self.thread.start()
+
+  # close: stop the background thread and send the remaining entities
+  def close(self):
+    self.stopped.set()
+    if self.thread is not None: self.thread.join()
+    self.thread = None
+    return self.flush()
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *exc):
+    self.close()